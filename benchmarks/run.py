@@ -0,0 +1,312 @@
+#!/usr/bin/env python
+"""
+Benchmarks of the persistence paths of modelplus models.
+
+Every case is timed against every backend at every table size, and the
+results are written as JSON so two runs can be compared:
+
+    python -m benchmarks.run --rows 1000,100000 --output new.json
+    python -m benchmarks.run --compare old.json new.json
+
+Backends:
+    sqlite-memory  SQLite in memory
+    sqlite-file    SQLite in a temporary file
+    redis          a Redis server on localhost:6379 (db 0, which is flushed!)
+    fakeredis      the in-process fakeredis stand-in for Redis
+    mongomock      the in-process mongomock stand-in for MongoDB
+    memory         the in-process MemoryStore
+    log            the log-structured store in a temporary directory
+"""
+import json
+import optparse
+import os
+import platform
+import random
+import shutil
+import sys
+import tempfile
+import time
+from timeit import default_timer
+
+import modelplus
+from modelplus import models
+from modelplus.store import memory, redis_db, sqlite_db
+
+BACKENDS = ['sqlite-memory', 'sqlite-file', 'redis', 'fakeredis', 'mongomock', 'memory', 'log']
+
+
+class Owner(models.Model):
+    name = models.StringField()
+
+
+class Item(models.Model):
+    name = models.StringField()
+    category = models.StringField()
+    price = models.IntegerField()
+    created = models.DateTimeField(auto_now_add=True)
+    visits = models.Counter()
+    owner = models.ReferenceField(Owner)
+
+
+CATEGORIES = ['book', 'music', 'film', 'game', 'toy']
+
+
+def open_backend(name):
+    """Sets up the global store for a backend, returns a cleanup function."""
+    if name == 'sqlite-memory':
+        modelplus.store = sqlite_db.setup(file=':memory:')
+        return lambda: None
+    if name == 'sqlite-file':
+        fd, path = tempfile.mkstemp(suffix='.sqlite')
+        os.close(fd)
+        modelplus.store = sqlite_db.setup(file=path)
+
+        def cleanup():
+            modelplus.store.connection.close()
+            os.remove(path)
+        return cleanup
+    if name == 'redis':
+        modelplus.store = redis_db.setup()
+        modelplus.store.flushdb()
+        return modelplus.store.flushdb
+    if name == 'fakeredis':
+        import fakeredis
+        modelplus.store = redis_db.setup(client=fakeredis.FakeStrictRedis())
+        return modelplus.store.flushdb
+    if name == 'mongomock':
+        import mongomock
+        from modelplus.store import mongodb
+        modelplus.store = mongodb.setup(client=mongomock.MongoClient())
+        return modelplus.store.flushdb
+    if name == 'memory':
+        modelplus.store = memory.setup()
+        return modelplus.store.flushdb
+    if name == 'log':
+        from modelplus.store import log_db
+        path = tempfile.mkdtemp()
+        modelplus.store = log_db.setup(path=path)
+
+        def cleanup():
+            modelplus.store.close()
+            shutil.rmtree(path)
+        return cleanup
+    raise ValueError("Unknown backend %s" % name)
+
+
+class Context(object):
+    """The objects created by the population, shared by the cases."""
+
+    def __init__(self, rows):
+        self.rows = rows
+        self.owners = []
+        self.ids = []
+        self.random = random.Random(rows)
+
+    def sample(self, n):
+        return [self.random.choice(self.ids) for i in range(n)]
+
+
+def populate(ctx):
+    ctx.owners = [Owner.objects.create(name="owner %d" % i) for i in range(10)]
+    for i in range(ctx.rows):
+        item = Item(name="item %d" % i, category=CATEGORIES[i % len(CATEGORIES)],
+                    price=i % 1000, owner=ctx.owners[i % len(ctx.owners)])
+        item.save()
+        ctx.ids.append(item.id)
+        yield
+
+
+#
+# The cases, each yields once per timed operation
+#
+
+def case_get_by_id(ctx, n):
+    for id in ctx.sample(n):
+        Item.objects.get_by_id(id)
+        yield
+
+
+def case_filter(ctx, n):
+    for i in range(n):
+        len(Item.objects.filter(category=CATEGORIES[i % len(CATEGORIES)]))
+        yield
+
+
+def case_exclude(ctx, n):
+    for i in range(n):
+        len(Item.objects.exclude(category=CATEGORIES[i % len(CATEGORIES)]))
+        yield
+
+
+def case_order(ctx, n):
+    for i in range(n):
+        list(Item.objects.all().order('-price').limit(10))
+        yield
+
+
+def case_limit(ctx, n):
+    for i in range(n):
+        list(Item.objects.filter(category='book').limit(10, i))
+        yield
+
+
+def case_counter(ctx, n):
+    for id in ctx.sample(n):
+        item = Item.objects.get_by_id(id)
+        item.incr('visits')
+        item.visits
+        yield
+
+
+def case_reference(ctx, n):
+    for id in ctx.sample(n):
+        Item.objects.get_by_id(id).owner.name
+        yield
+
+
+def case_delete(ctx, n):
+    for id in ctx.ids[-n:]:
+        Item.objects.get_by_id(id).delete()
+        yield
+    del ctx.ids[-n:]
+
+
+# name, function, True if the operation scans the whole table
+CASES = [
+    ('get_by_id', case_get_by_id, False),
+    ('filter', case_filter, True),
+    ('exclude', case_exclude, True),
+    ('order', case_order, True),
+    ('limit', case_limit, True),
+    ('counter', case_counter, False),
+    ('reference', case_reference, False),
+    ('delete', case_delete, False),
+]
+
+
+def measure(operations):
+    """Times each step of a generator, returns the list of durations."""
+    times = []
+    start = default_timer()
+    for _ in operations:
+        end = default_timer()
+        times.append(end - start)
+        start = end
+    return times
+
+
+def summarize(backend, rows, case, times, error=None):
+    result = {'backend': backend, 'rows': rows, 'case': case, 'ops': len(times)}
+    if error is not None:
+        result['error'] = error
+    if times:
+        ordered = sorted(times)
+        result.update({
+            'total': sum(times),
+            'mean': sum(times) / len(times),
+            'median': ordered[len(ordered) // 2],
+            'min': ordered[0],
+            'max': ordered[-1],
+        })
+    return result
+
+
+def run(backends, sizes, repeat, scan_repeat, cases=None, out=sys.stderr):
+    results = []
+    for backend in backends:
+        for rows in sizes:
+            cleanup = open_backend(backend)
+            try:
+                ctx = Context(rows)
+                times = measure(populate(ctx))
+                results.append(summarize(backend, rows, 'save', times))
+                out.write("%-14s %8d %-10s %.6fs\n" % (backend, rows, 'save', results[-1]['mean']))
+                for name, case, scan in CASES:
+                    if cases and name not in cases:
+                        continue
+                    times = []
+                    try:
+                        n = min(scan_repeat if scan else repeat, rows)
+                        times = measure(case(ctx, n))
+                        results.append(summarize(backend, rows, name, times))
+                        out.write("%-14s %8d %-10s %.6fs\n" % (backend, rows, name, results[-1]['mean']))
+                    except Exception, e:
+                        # Record what is broken and carry on with the other cases
+                        results.append(summarize(backend, rows, name, times,
+                                                 "%s: %s" % (e.__class__.__name__, e)))
+                        out.write("%-14s %8d %-10s %s\n" % (backend, rows, name, results[-1]['error']))
+            finally:
+                cleanup()
+    return {
+        'created': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'results': results,
+    }
+
+
+def compare(old, new, threshold):
+    """
+    Prints the ratio of the mean times of two runs, returns the number of
+    cases more than threshold times slower.
+    """
+    def index(run):
+        return dict(((r['backend'], r['rows'], r['case']), r) for r in run['results'] if 'mean' in r)
+
+    old, new = index(old), index(new)
+    regressions = 0
+    for key in sorted(set(old) & set(new)):
+        ratio = new[key]['mean'] / old[key]['mean'] if old[key]['mean'] else 1.0
+        flag = ''
+        if ratio > threshold:
+            flag = '  SLOWER'
+            regressions += 1
+        print "%-14s %8d %-10s %10.6fs %10.6fs %6.2fx%s" % (key + (old[key]['mean'], new[key]['mean'], ratio, flag))
+    return regressions
+
+
+def main(argv=None):
+    parser = optparse.OptionParser(usage="%prog [options] | --compare OLD NEW")
+    parser.add_option('--backends', default='sqlite-memory,sqlite-file',
+                      help="comma separated list of %s" % ", ".join(BACKENDS))
+    parser.add_option('--rows', default='1000',
+                      help="comma separated table sizes, e.g. 1000,100000,1000000")
+    parser.add_option('--repeat', type='int', default=200,
+                      help="operations timed per case")
+    parser.add_option('--scan-repeat', type='int', default=5,
+                      help="operations timed per case reading the whole table")
+    parser.add_option('--cases', default='', help="comma separated cases to run (default all)")
+    parser.add_option('--output', help="file to write the JSON results to")
+    parser.add_option('--compare', action='store_true',
+                      help="compare two JSON result files")
+    parser.add_option('--threshold', type='float', default=1.2,
+                      help="slowdown ratio reported as a regression")
+    options, args = parser.parse_args(argv)
+
+    if options.compare:
+        if len(args) != 2:
+            parser.error("--compare needs two result files")
+        with open(args[0]) as f:
+            old = json.load(f)
+        with open(args[1]) as f:
+            new = json.load(f)
+        return 1 if compare(old, new, options.threshold) else 0
+
+    backends = options.backends.split(',')
+    for backend in backends:
+        if backend not in BACKENDS:
+            parser.error("unknown backend %s" % backend)
+    sizes = [int(rows) for rows in options.rows.split(',')]
+    cases = [c for c in options.cases.split(',') if c]
+    report = run(backends, sizes, options.repeat, options.scan_repeat, cases)
+    data = json.dumps(report, indent=2, sort_keys=True)
+    if options.output:
+        with open(options.output, 'w') as f:
+            f.write(data)
+    else:
+        print data
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -1,16 +1,19 @@
-__all__ = ['setup', 'get_db']
+__all__ = ['setup', 'get_db', 'dump', 'load']
 
 from modelplus.store import redis_db, sqlite_db
+from modelplus.transfer import dump, load
 
 store = None
 
 def setup(params):
     """
         'redis'   : { host, port, db }
-        'sqlite'  : { file }
-        'mysql'   : { host, port, db }
+        'sqlite'  : { file, codec }
+        'mysql'   : { host, port, db, user, passwd, codec }
         'riak'    : { host, port, bucket }
-        'mongodb' : { host, port, bucket }
+        'mongodb' : { host, port, db }
+        'memory'  : {}
+        'log'     : { path, codec, sync, segment_size, compact_ratio }
     """
     global store
 
@@ -20,6 +23,21 @@ def setup(params):
     kwargs = params.get('sqlite')
     if kwargs:
         store = sqlite_db.setup(**kwargs)
+    kwargs = params.get('mysql')
+    if kwargs:
+        from modelplus.store import mysql
+        store = mysql.setup(**kwargs)
+    if 'memory' in params:
+        from modelplus.store import memory
+        store = memory.setup(**params['memory'])
+    kwargs = params.get('log')
+    if kwargs:
+        from modelplus.store import log_db
+        store = log_db.setup(**kwargs)
+    kwargs = params.get('mongodb')
+    if kwargs:
+        from modelplus.store import mongodb
+        store = mongodb.setup(**kwargs)
 
 def get_db():
     return store
@@ -1,9 +1,14 @@
 from base import *
 from fields import *
 from exceptions import *
+from aggregates import *
+from backfill import *
 
 __all__ = ['Model', 'Attribute', 'BooleanField', 'IntegerField',
            'Counter', 'FloatField', 'DateTimeField', 'DateField',
-           'ReferenceField', 'ListField', 'ValidationError', 'from_key',
+           'ReferenceField', 'ListField', 'ValidationError', 'from_key', 'from_keys',
            'ValidationError', 'MissingID', 'AttributeNotIndexed',
-           'FieldValidationError', 'BadKeyError']
+           'FieldValidationError', 'BadKeyError', 'ConflictError',
+           'retry_on_conflict', 'Mutex', 'lock_stats', 'LockTimeout', 'FullScanError',
+           'IndexBackfill',
+           'Count', 'Sum', 'Avg', 'Min', 'Max']
@@ -0,0 +1,82 @@
+"""
+Aggregates computed over a ModelSet, see ``ModelSet.aggregate``.
+"""
+
+__all__ = ['Count', 'Sum', 'Avg', 'Min', 'Max']
+
+class Aggregate(object):
+    """
+    An aggregate function of an attribute.
+
+    ``function`` is the name of the aggregate in the datastores, the
+    result is computed in Python by ``add`` and ``result`` when the
+    datastore can't.
+    """
+    function = None
+
+    def __init__(self, field=None):
+        self.field = field
+
+    def start(self):
+        return None
+
+    def add(self, state, value):
+        raise NotImplementedError
+
+    def result(self, state):
+        return state
+
+    def __repr__(self):
+        return "%s(%r)" % (self.__class__.__name__, self.field)
+
+class Count(Aggregate):
+    """Number of objects, or of objects with a value for ``field``."""
+    function = 'count'
+
+    def start(self):
+        return 0
+
+    def add(self, state, value):
+        if self.field is None or value is not None:
+            state += 1
+        return state
+
+class Sum(Aggregate):
+    function = 'sum'
+
+    def add(self, state, value):
+        if value is None:
+            return state
+        return value if state is None else state + value
+
+class Avg(Aggregate):
+    function = 'avg'
+
+    def start(self):
+        return (0, 0)
+
+    def add(self, state, value):
+        if value is None:
+            return state
+        return (state[0] + value, state[1] + 1)
+
+    def result(self, state):
+        if not state[1]:
+            return None
+        return float(state[0]) / state[1]
+
+class Min(Aggregate):
+    function = 'min'
+
+    def add(self, state, value):
+        if value is None:
+            return state
+        return value if state is None or value < state else state
+
+class Max(Aggregate):
+    function = 'max'
+
+    def add(self, state, value):
+        if value is None:
+            return state
+        return value if state is None or value > state else state
@@ -0,0 +1,30 @@
+"""
+Columnar decoding of stored values into NumPy arrays.
+"""
+from fields import BooleanField, IntegerField, FloatField, DateTimeField, DateField
+
+def decode_column(np, model_class, name, values):
+    """
+    Decodes the stored values of the field name in one vectorised pass.
+
+    Returns a masked array, masked where the value is missing.
+    """
+    field = model_class._attributes[name]
+    mask = np.array([v is None for v in values], dtype=bool)
+    if isinstance(field, (BooleanField, IntegerField, FloatField, DateTimeField, DateField)):
+        raw = np.array([0 if v is None else v for v in values])
+        if isinstance(field, (BooleanField, IntegerField)):
+            data = raw.astype(np.int64)
+            if isinstance(field, BooleanField):
+                data = data.astype(bool)
+        elif isinstance(field, FloatField):
+            data = raw.astype(np.float64)
+        elif isinstance(field, DateTimeField):
+            data = np.round(raw.astype(np.float64) * 1e6).astype(np.int64).astype('datetime64[us]')
+        else:
+            data = (raw.astype(np.float64).astype(np.int64) // 86400).astype('datetime64[D]')
+    else:
+        data = np.empty(len(values), dtype=object)
+        data[:] = [None if v is None else field.typecast_for_read(model_class._decompress(name, v))
+                   for v in values]
+    return np.ma.masked_array(data, mask=mask)
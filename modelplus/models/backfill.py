@@ -0,0 +1,189 @@
+"""
+Backfill of the indices added to a model that already has objects.
+
+The attributes are stored with every object, so a field that becomes
+``indexed=True`` can be queried right away. An entry of ``Meta.indices``
+computed by a method or a property is only stored by the saves that
+follow its addition. Until a backfill has written it on every object,
+filters on such an index are checked on the loaded objects; once the
+backfill completed, equality filters on it are handed to the datastore
+like those on the attributes.
+
+The same goes for the full-text index of the searchable fields: when a
+field becomes searchable on a model that has objects, searches read
+every object until a backfill has indexed them all::
+
+    backfill = IndexBackfill(Person)
+    while not backfill.run(batches=10):
+        time.sleep(1)
+
+The objects are walked ``batch_size`` at a time in the order of the
+store's ``scan_ids`` and only those missing a value are written, one
+pipeline per object guarded by its version, or by the stored values of
+its fields for the models that aren't versioned, so a concurrent save
+is never overwritten with values computed from what it replaced. The
+position reached is kept in the datastore after every batch, and a
+backfill that was stopped resumes from there.
+"""
+import modelplus
+from base import INDEX_STATES, VERSION_FIELD, retry_on_conflict
+from exceptions import ConflictError, WatchError
+from fields import Counter
+
+__all__ = ['IndexBackfill']
+
+BUILDING = 'building'
+READY = 'ready'
+
+
+class IndexBackfill(object):
+    """
+    Writes the computed indices of a model on the objects that don't
+    store them yet, and their words in the full-text index, then marks
+    the indices ready.
+
+    :param indices: the names of the indices, by default the computed
+                    indices and the full-text index (``_text_index()``)
+                    of the model that aren't ready.
+    """
+
+    def __init__(self, model_class, indices=None, batch_size=500):
+        self.model_class = model_class
+        self.db = model_class._meta['db'] or modelplus.get_db()
+        self.key = model_class._key
+        self.state_key = INDEX_STATES[model_class._key]
+        self.batch_size = batch_size
+        self.db.construct(self.key, codec=model_class._meta['codec'], indices=model_class._indices)
+        self.db.construct(INDEX_STATES)
+
+        computed = model_class._computed_indices()
+        if model_class._searchable:
+            computed.append(model_class._text_index())
+        states = self.db.hgetall(self.state_key) or {}
+        if indices is None:
+            indices = [k for k in computed if states.get(k) != READY]
+        for k in indices:
+            if k not in computed:
+                raise ValueError("%s is not an index computed by %s" % (k, model_class.__name__))
+        self.indices = list(indices)
+        # the full-text index, if backfilled, is written for every object
+        self.text = model_class._text_index() if model_class._text_index() in self.indices else None
+        # the fields the indices may be computed from
+        self.sources = [k for k, v in model_class._attributes.iteritems() if not isinstance(v, Counter)]
+        self.done = not self.indices
+        # number of objects walked by this backfill
+        self.processed = 0
+
+        cursors = set(states.get('%s:cursor' % k) for k in self.indices)
+        if len(cursors) == 1 and all(states.get(k) == BUILDING for k in self.indices):
+            self.cursor = cursors.pop()
+        else:
+            # start over, until complete the indices aren't used
+            self.cursor = None
+            if self.indices:
+                with self.db.pipeline() as pipeline:
+                    pipeline.hmset(self.state_key, dict((k, BUILDING) for k in self.indices))
+                    pipeline.hdel(self.state_key, *['%s:cursor' % k for k in self.indices])
+                    pipeline.execute()
+                model_class._ready_indices(refresh=True)
+
+    def run(self, batches=None, progress=None):
+        """
+        Backfills ``batches`` batches of objects, all of the remaining
+        ones if None. Returns True once the indices are ready.
+
+        :param progress: called with (objects walked, cursor) after
+                         every batch.
+        """
+        n = 0
+        while not self.done and (batches is None or n < batches):
+            self.step()
+            n += 1
+            if progress is not None:
+                progress(self.processed, self.cursor)
+        return self.done
+
+    def step(self):
+        """Backfills the next batch of objects and saves the position."""
+        if self.done:
+            return
+        cursor, ids = self.db.scan_ids(self.key, self.cursor, self.batch_size)
+        if ids:
+            self._write(ids)
+        self.processed += len(ids)
+        self.cursor = cursor
+        with self.db.pipeline() as pipeline:
+            if cursor is None:
+                pipeline.hmset(self.state_key, dict((k, READY) for k in self.indices))
+                pipeline.hdel(self.state_key, *['%s:cursor' % k for k in self.indices])
+            else:
+                pipeline.hmset(self.state_key, dict(('%s:cursor' % k, cursor) for k in self.indices))
+            pipeline.execute()
+        if cursor is None:
+            self.done = True
+            self.model_class._ready_indices(refresh=True)
+
+    def _write(self, ids):
+        """
+        Stores the indices of the objects with ids that miss them or
+        store stale values.
+        """
+        keys = [self.key[id] for id in ids]
+        written = False
+        # A pipeline per object, Redis watches the keys before the writes
+        # of a pipeline
+        for key, stored in zip(keys, self.db.hgetall_many(keys)):
+            try:
+                written = self._write_one(key, stored) or written
+            except ConflictError:
+                # saved since it was read, read it again
+                written = retry_on_conflict(lambda: self._write_one(key, self.db.hgetall(key))) or written
+        if written:
+            self.model_class._bump_write_version()
+
+    def _write_one(self, key, stored):
+        """
+        Stores the indices of the object key read as stored, raises
+        ConflictError if it changed since.  Returns True if it wrote.
+        """
+        if not stored:
+            # deleted since it was listed
+            return False
+        instance = self.model_class()
+        instance._id = key.split(':', 1)[1]
+        instance._load(stored)
+        values, removed = {}, []
+        for k in self.indices:
+            if k == self.text:
+                continue
+            v = instance._computed_index_value(k)
+            if v is None and k in stored:
+                removed.append(k)
+            elif v is not None and stored.get(k) != v:
+                values[k] = v
+        tokens = instance._search_tokens() if self.text else None
+        if not values and not removed and tokens is None:
+            return False
+        with self.db.pipeline() as pipeline:
+            if not self._guard(pipeline, key, stored):
+                raise ConflictError("%s was modified since it was loaded" % key)
+            self._store(pipeline, key, values, removed)
+            if tokens is not None:
+                self.db.index_text(pipeline, key, tokens)
+            try:
+                pipeline.execute()
+            except WatchError:
+                raise ConflictError("%s was modified since it was loaded" % key)
+        return True
+
+    def _guard(self, pipeline, key, stored):
+        """Makes the pipeline fail if the object changes from stored."""
+        if self.model_class._meta['versioned']:
+            return self.db.check_version(pipeline, key, VERSION_FIELD, stored.get(VERSION_FIELD))
+        return self.db.check_fields(pipeline, key, dict((k, stored[k]) for k in self.sources if k in stored))
+
+    def _store(self, pipeline, key, values, removed):
+        if values:
+            pipeline.hmset(key, values)
+        if removed:
+            pipeline.hdel(key, *removed)
@@ -1,13 +1,32 @@
+import copy
 import time
 from datetime import datetime
 from dateutil.tz import tzutc
 import modelplus
 from fields import BaseField, DateTimeField, DateField, IntegerField, FloatField, ListField, ReferenceField, Counter
 from key import Key
+import compression
+import fulltext
+import ids
 from managers import ManagerDescriptor, Manager
-from exceptions import FieldValidationError, MissingID, BadKeyError, WatchError
+from exceptions import FieldValidationError, MissingID, BadKeyError, WatchError, ConflictError, LockTimeout, \
+    ExpiryNotSupported
+
+__all__ = ['Model', 'from_key', 'from_keys', 'retry_on_conflict', 'Mutex', 'lock_stats']
+
+# Hidden field holding the version of versioned models
+VERSION_FIELD = '_version'
+
+# Key of the hashes holding the state of the index backfills of the models
+INDEX_STATES = Key('_indexes')
+# Seconds the index states read from the datastore are used for
+INDEX_STATES_TTL = 10
+
+# Seconds between two sweeps of the expired objects of a model by its
+# saves, and the most objects a sweep removes
+SWEEP_INTERVAL = 10
+SWEEP_BATCH = 500
 
-__all__ = ['Model', 'from_key']
 
 ##############################
 # Model Class Initialization #
@@ -33,6 +52,14 @@ def _initialize_attributes(model_class, name, bases, attrs):
             model_class._attributes[k] = v
             v.name = v.name or k
 
+def _initialize_searchable(model_class):
+    """
+    Stores the names of the string fields added to the full-text index.
+    """
+    model_class._searchable = sorted(k for k, v in model_class._attributes.iteritems()
+                                     if getattr(v, 'searchable', False))
+
+
 def _initialize_referenced(model_class, attribute):
     """
     Adds a property to the target of a reference field that
@@ -160,6 +187,125 @@ def _initialize_manager(model_class):
     model_class.objects = ManagerDescriptor(Manager(model_class))
 
 
+def _initialize_query_cache(model_class):
+    """
+    Initializes the write version counter and the cache of query
+    results that it invalidates, which is turned off once an object of
+    the model is saved with a time to live.
+    """
+    model_class._write_version = 0
+    model_class._query_cache = {}
+    model_class._expiring = False
+
+
+def _initialize_index_states(model_class):
+    """
+    The states of the backfills of the computed indices and of the
+    full-text index are read from the datastore when first needed, as
+    (time read, {index: state}).
+    """
+    model_class._index_states = None
+
+
+def _initialize_expiry(model_class):
+    """
+    The saves giving objects a time to live sweep the expired objects of
+    the model, once every SWEEP_INTERVAL seconds at most.
+    """
+    model_class._next_sweep = 0
+
+
+def _initialize_serializers(model_class):
+    """
+    The functions turning objects into stored hashes and back are built
+    once, with the class, from its attributes.
+    """
+    model_class._serializer_functions = _build_serializers(model_class)
+
+
+def _build_serializers(model_class):
+    """
+    Builds the functions that set the auto_now dates, encode the
+    attributes for the datastore and decode them, with the typecasts and
+    compression of every field looked up once for the model rather than
+    dispatched on the field types at every save and load.  Only the
+    fields with compression are decompressed on load.
+    """
+    auto_now = []
+    encoders = []
+    decoders = []
+    for k, v in model_class._attributes.iteritems():
+        if isinstance(v, (DateTimeField, DateField)) and (v.auto_now or v.auto_now_add):
+            auto_now.append((k, v.auto_now))
+        compressor, threshold = model_class._compression_for(k)
+        encoders.append((k, v.typecast_for_storage, v.typecast_for_native, compressor, threshold))
+        if not isinstance(v, Counter):
+            decoders.append((k, v.__set__, v.typecast_for_read, compressor))
+
+    def touch(instance, new):
+        """Sets the auto_now dates, and the auto_now_add ones if new."""
+        if not auto_now:
+            return
+        now = datetime.now(tz=tzutc())
+        for k, always in auto_now:
+            if always or new:
+                setattr(instance, k, now)
+
+    def encode(instance, names, native, binary):
+        """
+        Returns the stored values of the attributes in names (all of them
+        if None) and the list of the attributes without value.
+        """
+        h = {}
+        removed = []
+        for k, for_storage, for_native, compressor, threshold in encoders:
+            if names is not None and k not in names:
+                continue
+            value = getattr(instance, k)
+            if value is None:
+                removed.append(k)
+                continue
+            value = for_native(value) if native else for_storage(value)
+            if compressor and isinstance(value, basestring):
+                value = compression.compress(value, compressor, threshold, binary=binary)
+            h[k] = value
+        return h, removed
+
+    def decode(instance, stored_attrs):
+        """Sets the attributes from the stored values."""
+        for k, set_value, for_read, compressor in decoders:
+            if k in stored_attrs:
+                value = stored_attrs[k]
+                if compressor:
+                    value = compression.decompress(value)
+                set_value(instance, for_read(value))
+
+    return touch, encode, decode
+
+
+# key -> model class, and class name -> model class for references by name
+_models = {}
+_model_names = {}
+
+
+def _initialize_registry(model_class, bases):
+    """
+    Registers the model so it is found from its keys.
+    """
+    if not any(isinstance(base, ModelBase) for base in bases):
+        # Model itself
+        return
+    _models[model_class._key] = model_class
+    _model_names[model_class.__name__] = model_class
+
+
+def _initialize_id_generator(model_class):
+    """
+    Initializes the generator of the ids of new objects.
+    """
+    model_class._id_generator = staticmethod(ids.get_id_generator(model_class._meta['id_generator']))
+
+
 class ModelOptions(object):
     """Handles options defined in Meta class of the model.
 
@@ -202,11 +348,18 @@ class ModelBase(type):
         deferred = _initialize_references(cls, name, bases, attrs)
         _deferred_refs.extend(deferred)
         _initialize_attributes(cls, name, bases, attrs)
+        _initialize_searchable(cls)
         _initialize_counters(cls, name, bases, attrs)
         _initialize_lists(cls, name, bases, attrs)
         _initialize_indices(cls, name, bases, attrs)
         _initialize_key(cls, name)
         _initialize_manager(cls)
+        _initialize_query_cache(cls)
+        _initialize_index_states(cls)
+        _initialize_expiry(cls)
+        _initialize_id_generator(cls)
+        _initialize_serializers(cls)
+        _initialize_registry(cls, bases)
         # if targeted by a reference field using a string,
         # override for next try
         for target, model_class, att in _deferred_refs:
@@ -219,6 +372,10 @@ class Model(object):
     __metaclass__ = ModelBase
 
     def __init__(self, **kwargs):
+        # names of the fields set since the object was loaded or saved
+        self._dirty = set()
+        # version of versioned models when they were loaded
+        self._stored_version = None
         self.update_attributes(**kwargs)
 
     def is_valid(self):
@@ -295,13 +452,17 @@ class Model(object):
             if att.name in kwargs:
                 att.__set__(self, kwargs[att.name])
 
-    def save(self):
+    def save(self, ttl=None):
         """
         Saves the instance to the datastore with the following steps:
         1. Validate all the fields
         2. Assign an ID if the object is new
         3. Save to the datastore.
 
+        :param ttl: seconds after which the object expires, by default
+                    ``Meta.ttl``. Without either, a new object never
+                    expires and an existing one keeps its expiry.
+
         >>> from modelplus import models
         >>> class Foo(models.Model):
         ...    name = models.StringField()
@@ -314,11 +475,17 @@ class Model(object):
         """
         if not self.is_valid():
             return self._errors
+        if ttl is None:
+            ttl = self._meta['ttl']
+        if ttl and not self.db.expires(self._key):
+            raise ExpiryNotSupported("%s can't expire objects" % type(self.db).__name__)
+        if ttl:
+            # no write tells the query cache about the expiry
+            type(self)._expiring = True
         _new = self.is_new()
         if _new:
             self._initialize_id()
-        # TODO? with Mutex(self):
-        self._write(_new)
+        self._write(_new, ttl)
         return True
 
     def key(self, att=None):
@@ -343,11 +510,23 @@ class Model(object):
 
     def delete(self):
         """Deletes the object from the datastore."""
-        with self.db.pipeline() as pipeline:
-            self._delete_from_indices(pipeline)
-            self._delete_membership(pipeline)
-            pipeline.delete(self.key())
-            pipeline.execute()
+        while True:
+            with self.db.pipeline() as pipeline:
+                if self._searchable:
+                    # The store may read the words of the object first, a
+                    # save in between fails the pipeline to try again
+                    self.db.check_exists(pipeline, self.key())
+                self._delete_from_indices(pipeline)
+                self._delete_membership(pipeline)
+                pipeline.delete(self.key())
+                if self._searchable:
+                    self.db.index_text(pipeline, self.key(), None)
+                try:
+                    pipeline.execute()
+                    break
+                except (WatchError, ConflictError):
+                    pass
+        self._bump_write_version()
 
     def is_new(self):
         """
@@ -376,6 +555,7 @@ class Model(object):
         if att not in self.counters:
             raise ValueError("%s is not a counter.")
         self.db.incr_by(self.key(), att, val)
+        self._bump_write_version()
 
     def decr(self, att, val=1):
         """
@@ -445,11 +625,7 @@ class Model(object):
         Setting the id for the object will fetch it from the datastorage.
         """
         self._id = str(val)
-        stored_attrs = self.db.hgetall(self.key())
-        attrs = self.attributes.values()
-        for att in attrs:
-            if att.name in stored_attrs and not isinstance(att, Counter):
-                att.__set__(self, att.typecast_for_read(stored_attrs[att.name]))
+        self._load(self.db.hgetall(self.key()))
 
     @property
     def attributes(self):
@@ -521,52 +697,85 @@ class Model(object):
 
     def _initialize_id(self):
         """Initializes the id of the instance."""
-        from uuid import uuid4
-        self._id = str(uuid4())
+        self._id = self._id_generator(self)
+
+    def _load(self, stored_attrs):
+        """Sets the attributes from the hash fetched from the datastore."""
+        if not stored_attrs:
+            return
+        self._serializers()[2](self, stored_attrs)
+        self._stored_version = stored_attrs.get(VERSION_FIELD)
+        self._dirty = set()
 
-    def _write(self, _new=False):
+    def _write(self, _new=False, ttl=None):
         """Writes the values of the attributes to the datastore.
 
         This method also creates the indices and saves the lists
         associated to the object.
+
+        A new object is written as a whole, while for an existing
+        object only the fields that changed since it was loaded or
+        last saved are sent to the datastore.  An object which expired
+        or was deleted since is written again as a whole, without an
+        expiry unless given one, or fails with a ConflictError if it
+        is versioned.
         """
+        self.db.construct(self._key, codec=self._meta['codec'], indices=self._indices)
+        native = self.db.native_types(self._key)
+        if self._searchable and _new and not self._text_index_ready():
+            self._start_text_index()
         with self.db.pipeline() as pipeline:
+            versioned = self._meta['versioned']
+            # write every attribute, over whatever is stored
+            whole = _new
+            if versioned and not _new:
+                if not self.db.check_version(pipeline, self.key(), VERSION_FIELD, self._stored_version):
+                    raise ConflictError("%s was modified since it was loaded" % self.key())
+            elif not _new and not self.db.check_exists(pipeline, self.key()):
+                whole = True
             self._create_membership(pipeline)
             self._update_indices(pipeline)
-            h = {}
             # attributes
-            for k, v in self.attributes.iteritems():
-                if isinstance(v, DateTimeField):
-                    if v.auto_now:
-                        setattr(self, k, datetime.now(tz=tzutc()))
-                    if v.auto_now_add and _new:
-                        setattr(self, k, datetime.now(tz=tzutc()))
-                elif isinstance(v, DateField):
-                    if v.auto_now:
-                        setattr(self, k, datetime.now(tz=tzutc()))
-                    if v.auto_now_add and _new:
-                        setattr(self, k, datetime.now(tz=tzutc()))
-                for_storage = getattr(self, k)
-                if for_storage is not None:
-                    h[k] = v.typecast_for_storage(for_storage)
-            # indices
-            for index in self.indices:
-                if index not in self.lists and index not in self.attributes:
-                    v = getattr(self, index)
-                    if callable(v):
-                        v = v()
-                    if v:
-                        try:
-                            h[index] = unicode(v)
-                        except UnicodeError:
-                            h[index] = unicode(v.decode('utf-8'))
-
-            pipeline.delete(self.key())
+            touch, encode, decode = self._serializers()
+            touch(self, _new)
+            h, removed = encode(self, None if whole else self._dirty, native,
+                                self.db.binary_values(self._key))
+            # indices, which may be computed from any of the attributes,
+            # and search words, from the stored values of those this
+            # object didn't change rather than its possibly stale ones
+            search = self._searchable and (whole or self._dirty.intersection(self._searchable))
+            current = self
+            if not whole and self._dirty and (self._computed_indices() or
+                                              search and set(self._searchable) - self._dirty):
+                current = self._with_stored()
+            for index in self._computed_indices():
+                if not whole and not self._dirty:
+                    break
+                v = current._computed_index_value(index)
+                if v is not None:
+                    h[index] = v
+                else:
+                    removed.append(index)
+
+            if versioned:
+                version = 1 if _new else int(self._stored_version or 0) + 1
+                h[VERSION_FIELD] = str(version)
+
+            if whole:
+                pipeline.delete(self.key())
             if h:
                 pipeline.hmset(self.key(), h)
+            if removed and not whole:
+                pipeline.hdel(self.key(), *removed)
+            if search:
+                self.db.index_text(pipeline, self.key(), current._search_tokens())
+            if ttl:
+                self.db.expire(pipeline, self.key(), ttl)
 
             # lists
             for k, v in self.lists.iteritems():
+                if not whole and k not in self._dirty:
+                    continue
                 l = List(self.key()[k], pipeline=pipeline)
                 l.clear()
                 values = getattr(self, k)
@@ -575,7 +784,142 @@ class Model(object):
                         l.extend([item.id for item in values])
                     else:
                         l.extend(values)
+            try:
+                pipeline.execute()
+            except WatchError:
+                raise ConflictError("%s was modified since it was loaded" % self.key())
+        if versioned:
+            self._stored_version = h[VERSION_FIELD]
+        self._dirty = set()
+        self._bump_write_version()
+        if ttl and time.time() >= self._next_sweep:
+            self.sweep_expired(SWEEP_BATCH)
+
+    @classmethod
+    def sweep_expired(cls, count=1000):
+        """
+        Removes up to count objects of the model whose time to live ran
+        out, with their entries in the indices of the datastore, and
+        returns the number removed. The saves of objects with a time to
+        live call it every SWEEP_INTERVAL seconds.
+        """
+        cls._next_sweep = time.time() + SWEEP_INTERVAL
+        db = cls._meta['db'] or modelplus.get_db()
+        db.construct(cls._key, codec=cls._meta['codec'], indices=cls._indices)
+        swept = db.sweep(cls._key, count)
+        if swept:
+            cls._bump_write_version()
+        return swept
+
+    @classmethod
+    def _compression_for(cls, att):
+        """
+        Returns the compressor and threshold of an attribute, from the
+        field or, for string fields, from the Meta compress options.
+        """
+        field = cls._attributes[att]
+        if field.compress:
+            return field.compress, field.compress_threshold
+        if cls._meta['compress'] and field.value_type() is unicode:
+            return cls._meta['compress'], cls._meta['compress_threshold'] or 1024
+        return None, None
+
+    @classmethod
+    def _decompress(cls, att, value):
+        """A stored value of att, decompressed if the field compresses."""
+        if cls._compression_for(att)[0]:
+            return compression.decompress(value)
+        return value
+
+    @classmethod
+    def _serializers(cls):
+        """Returns the (touch, encode, decode) functions of the model."""
+        return cls._serializer_functions
+
+    def _with_stored(self):
+        """
+        A copy of the object with the stored values of the attributes it
+        didn't change, to compute what depends on all of them.
+        """
+        current = copy.copy(self)
+        current._dirty = set()
+        for k, v in self._attributes.iteritems():
+            if k not in self._dirty and not isinstance(v, Counter):
+                current.__dict__.pop('_' + k, None)
+        stored = self.db.hgetall(self.key()) or {}
+        self._serializers()[2](current, dict((k, v) for k, v in stored.iteritems() if k not in self._dirty))
+        return current
+
+    def _search_tokens(self):
+        """The words of the searchable fields, for the full-text index."""
+        tokens = []
+        for k in self._searchable:
+            tokens.extend(fulltext.tokenize(getattr(self, k)))
+        return tokens
+
+    @classmethod
+    def _computed_indices(cls):
+        """The indices computed by a method or a property of the model."""
+        return [k for k in cls._indices if k not in cls._attributes and k not in cls._lists]
+
+    def _computed_index_value(self, index):
+        """The stored value of a computed index, None when it is empty."""
+        v = getattr(self, index)
+        if callable(v):
+            v = v()
+        if not v:
+            return None
+        try:
+            return unicode(v)
+        except UnicodeError:
+            return unicode(v.decode('utf-8'))
+
+    @classmethod
+    def _ready_indices(cls, refresh=False):
+        """
+        The computed indices whose backfill completed, stored by every
+        object, so that the datastore can filter on them.
+        """
+        states = cls._index_states
+        if refresh or states is None or time.time() - states[0] > INDEX_STATES_TTL:
+            db = cls._meta['db'] or modelplus.get_db()
+            db.construct(INDEX_STATES)
+            states = cls._index_states = (time.time(), db.hgetall(INDEX_STATES[cls._key]) or {})
+        return set(k for k, state in states[1].iteritems() if state == 'ready')
+
+    @classmethod
+    def _text_index(cls):
+        """
+        The name of the full-text index in the states of the indices,
+        which changes with the searchable fields.
+        """
+        return '_text:%s' % ','.join(cls._searchable)
+
+    @classmethod
+    def _text_index_ready(cls):
+        """True once every object of the model is in the full-text index."""
+        return cls._text_index() in cls._ready_indices()
+
+    @classmethod
+    def _start_text_index(cls):
+        """
+        Marks the full-text index ready when the model has no object yet,
+        as every object saved from then on is indexed.  Otherwise the
+        objects saved before need an IndexBackfill.
+        """
+        db = cls._meta['db'] or modelplus.get_db()
+        if db.scan_ids(cls._key, None, 1)[1]:
+            return
+        with db.pipeline() as pipeline:
+            pipeline.hmset(INDEX_STATES[cls._key], {cls._text_index(): 'ready'})
             pipeline.execute()
+        cls._ready_indices(refresh=True)
+
+    @classmethod
+    def _bump_write_version(cls):
+        """Invalidates the cached query results of the model."""
+        cls._write_version += 1
+        cls._query_cache.clear()
 
     ##############
     # Membership #
@@ -716,14 +1060,57 @@ class Model(object):
 
 
 
+def retry_on_conflict(func, retries=5, delay=0.01):
+    """
+    Calls ``func`` until it completes without a ConflictError, at most
+    ``retries`` times, sleeping a random, growing delay between tries.
+
+    ``func`` should load the objects it modifies, so that every try
+    works on fresh data.
+
+    >>> from modelplus import models
+    >>> class Foo(models.Model):
+    ...     name = models.StringField()
+    ...     class Meta:
+    ...         versioned = True
+    ...
+    >>> f = Foo.objects.create(name="Einstein")
+    >>> def rename():
+    ...     o = Foo.objects.get_by_id(f.id)
+    ...     o.name = "Tesla"
+    ...     return o.save()
+    ...
+    >>> retry_on_conflict(rename)
+    True
+    """
+    import random
+    for attempt in range(retries):
+        try:
+            return func()
+        except ConflictError:
+            if attempt == retries - 1:
+                raise
+            time.sleep(random.uniform(0, delay * (2 ** attempt)))
+
+
+def invalidate_caches():
+    """
+    Forgets the cached query results and index states of every model,
+    called by the datastores when they are flushed.
+    """
+    # Every subclass, _models keeps one per key
+    classes = Model.__subclasses__()
+    while classes:
+        model_class = classes.pop()
+        model_class._bump_write_version()
+        model_class._index_states = None
+        classes.extend(model_class.__subclasses__())
+
+
 def get_model_from_key(key):
-    """Gets the model from a given key."""
-    _known_models = {}
-    model_name = key.split(':', 2)[0]
-    # populate
-    for klass in Model.__subclasses__():
-        _known_models[klass.__name__] = klass
-    return _known_models.get(model_name, None)
+    """Gets the model from a given key, or from the name of the model."""
+    model_name = key.split(':', 1)[0]
+    return _models.get(model_name) or _model_names.get(model_name)
 
 
 def from_key(key):
@@ -733,20 +1120,104 @@ def from_key(key):
     redisco or no defined model can be found.
     Returns None if the key could not be found.
     """
-    model = get_model_from_key(key)
-    if model is None:
-        raise BadKeyError
-    try:
-        _, id = key.split(':', 2)
-        id = int(id)
-    except ValueError, TypeError:
-        raise BadKeyError
-    return model.objects.get_by_id(id)
+    return from_keys([key])[0]
+
+
+def from_keys(keys):
+    """Returns the model instances of a list of keys, of any models.
+
+    The objects are fetched with a single bulk read per datastore.
+    Raises BadKeyError if a key is not recognized, the list holds None
+    for the keys that could not be found.
+    """
+    # datastore -> [(position, model, key)]
+    batches = {}
+    for i, key in enumerate(keys):
+        model = _models.get(key.split(':', 1)[0])
+        if model is None or ':' not in key:
+            raise BadKeyError
+        db = model._meta['db'] or modelplus.get_db()
+        db.construct(model._key, codec=model._meta['codec'], indices=model._indices)
+        batches.setdefault(db, []).append((i, model, key))
+
+    instances = [None] * len(keys)
+    for db, batch in batches.iteritems():
+        stored = db.hgetall_many([key for i, model, key in batch])
+        for (i, model, key), stored_attrs in zip(batch, stored):
+            if stored_attrs is None:
+                continue
+            instance = model()
+            instance._id = key.split(':', 1)[1]
+            instance._load(stored_attrs)
+            instances[i] = instance
+    return instances
+
+
+class LockStats(object):
+    """
+    Wait and hold times of the locks taken by this process.
+    """
+    def __init__(self):
+        self.reset()
+
+    def reset(self):
+        self.acquired = 0
+        self.contended = 0
+        self.timeouts = 0
+        self.wait_time = 0.0
+        self.max_wait_time = 0.0
+        self.hold_time = 0.0
+        self.max_hold_time = 0.0
+
+    def record_wait(self, seconds, contended):
+        self.acquired += 1
+        if contended:
+            self.contended += 1
+        self.wait_time += seconds
+        self.max_wait_time = max(self.max_wait_time, seconds)
+
+    def record_hold(self, seconds):
+        self.hold_time += seconds
+        self.max_hold_time = max(self.max_hold_time, seconds)
+
+lock_stats = LockStats()
 
 
 class Mutex(object):
-    def __init__(self, instance):
-        self.instance = instance
+    """
+    Exclusive lock shared by every client of the datastore.
+
+    The lock is a key holding a random token that expires after
+    ``timeout`` seconds, so a crashed holder can't keep it forever, and
+    is only released by the holder of the token.  While the lock is
+    taken, ``lock`` sleeps with an exponential, jittered backoff rather
+    than spinning, and gives up after ``blocking_timeout`` seconds.
+
+    ``target`` is either a model instance or the name of the lock.
+
+    >>> from modelplus import models
+    >>> class Foo(models.Model):
+    ...     name = models.StringField()
+    ...
+    >>> f = Foo.objects.create(name="Einstein")
+    >>> with Mutex(f):
+    ...     f.name = "Tesla"
+    ...     f.save()
+    True
+    """
+    def __init__(self, target, timeout=10.0, blocking_timeout=None, db=None,
+                 sleep=0.005, max_sleep=0.5):
+        if isinstance(target, Model):
+            self.name = "_lock:%s" % target.key()
+            self.db = db or target.db
+        else:
+            self.name = "_lock:%s" % target
+            self.db = db or modelplus.get_db()
+        self.timeout = timeout
+        self.blocking_timeout = blocking_timeout
+        self.sleep = sleep
+        self.max_sleep = max_sleep
+        self.token = None
 
     def __enter__(self):
         self.lock()
@@ -756,29 +1227,31 @@ class Mutex(object):
         self.unlock()
 
     def lock(self):
-        o = self.instance
-        _lock_key = o.key('_lock')
-        with o.db.pipeline() as pipe:
-            while True:
-                try:
-                    pipe.watch(_lock_key)
-                    if o.db.exists(_lock_key) and not self.lock_has_expired(o.db.get(_lock_key)):
-                        continue
-
-                    pipe.multi()
-                    pipe.set(_lock_key, self.lock_timeout).execute()
-                    break
-
-                except WatchError:
-                    time.sleep(0.5)
-                    continue
-
-    def lock_has_expired(self, lock):
-        return float(lock) < time.time()
+        import random
+        from uuid import uuid4
+        token = uuid4().hex
+        start = time.time()
+        sleep = self.sleep
+        contended = False
+        while not self.db.acquire_lock(self.name, token, int(self.timeout * 1000)):
+            contended = True
+            waited = time.time() - start
+            if self.blocking_timeout is not None and waited >= self.blocking_timeout:
+                lock_stats.timeouts += 1
+                raise LockTimeout("Could not acquire %s in %.3fs" % (self.name, waited))
+            time.sleep(random.uniform(0, sleep))
+            sleep = min(self.max_sleep, sleep * 2)
+        self.token = token
+        self.acquired_at = time.time()
+        lock_stats.record_wait(self.acquired_at - start, contended)
 
     def unlock(self):
-        self.instance.db.delete(self.instance.key('_lock'))
-
-    @property
-    def lock_timeout(self):
-        return "%f" % (time.time() + 1.0)
+        """
+        Releases the lock, returns False if it had expired and was
+        no longer ours.
+        """
+        if self.token is None:
+            return False
+        lock_stats.record_hold(time.time() - self.acquired_at)
+        token, self.token = self.token, None
+        return self.db.release_lock(self.name, token)
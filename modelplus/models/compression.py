@@ -0,0 +1,92 @@
+"""
+Transparent compression of large field values.
+
+A compressed value starts with a NUL marker byte followed by the tag of
+the compressor, so the values of a field with compression are recognised
+and decompressed on read whatever its compressor and threshold are at
+that time.  A value left as is which starts with the marker is stored
+behind the marker and RAW_TAG, so it is never taken for a compressed one.
+Fields without compression are read as they are stored.
+"""
+import base64
+import zlib
+
+__all__ = ['register_compressor', 'compress', 'decompress']
+
+MARKER = '\x00'
+# The tag of values stored as they are
+RAW_TAG = '='
+
+# name -> (tag, compress, decompress)
+_compressors = {}
+# tag -> decompress
+_tags = {}
+
+def register_compressor(name, tag, compress, decompress):
+    """
+    Registers a compressor. ``tag`` is the single character stored after
+    the marker, ``compress`` and ``decompress`` turn a byte string into
+    another byte string.
+    """
+    if len(tag) != 1 or tag.upper() in _tags or tag.lower() in _tags:
+        raise ValueError("Compressor tag %r is not a free single character" % tag)
+    # The lower case tag marks raw bytes and the upper case one base64 text
+    _compressors[name] = (tag.lower(), compress, decompress)
+    _tags[tag.lower()] = decompress
+    _tags[tag.upper()] = decompress
+
+register_compressor('zlib', 'z', zlib.compress, zlib.decompress)
+_tags[RAW_TAG] = lambda data: data
+
+def compress(value, name, threshold, binary=True):
+    """
+    Compresses the stored form of a value when it is at least
+    ``threshold`` bytes long and compression makes it smaller.
+
+    If the datastore can't keep binary strings (``binary`` is False) the
+    compressed bytes are base64 encoded.
+    """
+    raw = value
+    if isinstance(value, unicode):
+        value = value.encode('utf-8')
+    if len(value) < threshold:
+        return _escape(raw)
+    if name is True:
+        name = 'zlib'
+    try:
+        tag, compressor, _ = _compressors[name]
+    except KeyError:
+        raise ValueError("Unknown compressor %s" % name)
+    data = compressor(value)
+    if binary:
+        data = MARKER + tag + data
+    else:
+        data = MARKER + tag.upper() + base64.b64encode(data)
+    if len(data) >= len(value):
+        return _escape(raw)
+    return data
+
+def _escape(value):
+    """Marks a value starting with the marker as stored as is."""
+    if value[:1] == MARKER:
+        return MARKER + RAW_TAG + value
+    return value
+
+def decompress(value):
+    """
+    Returns the original form of a value read from the datastore,
+    leaving values that were not compressed untouched.
+    """
+    if not isinstance(value, basestring) or value[:1] != MARKER:
+        return value
+    tag = str(value[1:2])
+    if tag not in _tags:
+        return value
+    data = value[2:]
+    if tag == RAW_TAG:
+        return data
+    if tag.isupper():
+        data = base64.b64decode(data)
+    elif isinstance(data, unicode):
+        data = data.encode('latin-1')
+    return _tags[tag](data)
@@ -26,3 +26,19 @@ class FieldValidationError(Error):
 
 class BadKeyError(Error):
     pass
+
+class ConflictError(Error):
+    """The object was saved by someone else since it was loaded."""
+    pass
+
+class LockTimeout(Error):
+    """The lock could not be acquired in time."""
+    pass
+
+class ExpiryNotSupported(Error):
+    """The datastore can't give objects a time to live."""
+    pass
+
+class FullScanError(Error):
+    """The query loads too many objects into Python, see ModelSet.explain."""
+    pass
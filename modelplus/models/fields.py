@@ -28,6 +28,9 @@ class BaseField(object):
         validator -- a callable that can validate the value of the
                      attribute.
         default   -- Initial value of the attribute.
+        compress  -- compress the stored value when it is at least
+                     compress_threshold bytes long. True or the name
+                     of a registered compressor (default: zlib).
     """
     def __init__(self,
                  name=None,
@@ -35,13 +38,17 @@ class BaseField(object):
                  required=False,
                  validator=None,
                  unique=False,
-                 default=None):
+                 default=None,
+                 compress=None,
+                 compress_threshold=1024):
         self.name = name
         self.indexed = indexed
         self.required = required
         self.validator = validator
         self.default = default
         self.unique = unique
+        self.compress = compress
+        self.compress_threshold = compress_threshold
 
     def __get__(self, instance, owner):
         try:
@@ -56,6 +63,7 @@ class BaseField(object):
 
     def __set__(self, instance, value):
         setattr(instance, '_' + self.name, value)
+        instance._dirty.add(self.name)
 
     def typecast_for_read(self, value):
         """Typecasts the value for reading from Redis."""
@@ -73,6 +81,13 @@ class BaseField(object):
         except UnicodeError:
             return value.decode('utf-8')
 
+    def typecast_for_native(self, value):
+        """
+        Typecasts the value for storing with a codec that keeps numbers
+        as numbers, typecast_for_read must accept the result.
+        """
+        return self.typecast_for_storage(value)
+
     def value_type(self):
         return unicode
 
@@ -116,9 +131,17 @@ class BaseField(object):
 
 
 class StringField(BaseField):
-    def __init__(self, max_length=255, **kwargs):
+    """
+    A unicode string of at most max_length characters.
+
+    Options
+        searchable -- add the words of the value to the full-text index
+                      of the model, see ``ModelSet.search``.
+    """
+    def __init__(self, max_length=255, searchable=False, **kwargs):
         super(StringField, self).__init__(**kwargs)
         self.max_length = max_length
+        self.searchable = searchable
 
     def validate(self, instance):
         errors = []
@@ -145,6 +168,9 @@ class BooleanField(BaseField):
             return "0"
         return "1" if value else "0"
 
+    def typecast_for_native(self, value):
+        return 1 if value else 0
+
     def value_type(self):
         return bool
 
@@ -161,6 +187,11 @@ class IntegerField(BaseField):
             return "0"
         return unicode(value)
 
+    def typecast_for_native(self, value):
+        if value is None:
+            return 0
+        return int(value)
+
     def value_type(self):
         return int
 
@@ -176,6 +207,11 @@ class FloatField(BaseField):
             return "0"
         return "%f" % value
 
+    def typecast_for_native(self, value):
+        if value is None:
+            return 0.0
+        return float(value)
+
     def value_type(self):
         return float
 
@@ -208,6 +244,14 @@ class DateTimeField(BaseField):
            value = value.replace(tzinfo=tzlocal())
         return "%d.%06d" % (float(timegm(value.utctimetuple())),  value.microsecond)
 
+    def typecast_for_native(self, value):
+        if not isinstance(value, datetime):
+            raise TypeError("%s should be datetime object, and not a %s" %
+                    (self.name, type(value)))
+        if value.tzinfo is None:
+           value = value.replace(tzinfo=tzlocal())
+        return timegm(value.utctimetuple()) + value.microsecond / 1e6
+
     def value_type(self):
         return datetime
 
@@ -237,6 +281,12 @@ class DateField(BaseField):
             return None
         return "%d" % float(timegm(value.timetuple()))
 
+    def typecast_for_native(self, value):
+        if not isinstance(value, date):
+            raise TypeError("%s should be date object, and not a %s" %
+                    (self.name, type(value)))
+        return timegm(value.timetuple())
+
     def value_type(self):
         return date
 
@@ -286,11 +336,13 @@ class ListField(object):
                     val = filter(lambda o: o is not None, [klass.objects.get_by_id(v) for v in val])
                 else:
                     val = [klass(v) for v in val]
-            self.__set__(instance, val)
+            # Loading the list doesn't make it dirty
+            setattr(instance, '_' + self.name, val)
             return val
 
     def __set__(self, instance, value):
         setattr(instance, '_' + self.name, value)
+        instance._dirty.add(self.name)
 
     def value_type(self):
         if isinstance(self._target_type, basestring):
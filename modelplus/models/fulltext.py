@@ -0,0 +1,55 @@
+"""
+Words and ranking of the full-text search, see ``ModelSet.search``.
+
+The words of a text are its runs of letters and digits, lowercased,
+as the unicode61 tokenizer of SQLite splits them. The stores without a
+text index of their own, and the Python fallback, rank the objects
+holding every word of the query by the sum of the number of times each
+word appears in the object weighted by how rare the word is.
+"""
+import math
+import re
+
+__all__ = ['tokenize', 'terms', 'rank']
+
+_WORD = re.compile(r'[^\W_]+', re.UNICODE)
+
+
+def tokenize(text):
+    """The words of text, in order, with repetitions"""
+    if not text:
+        return []
+    if isinstance(text, str):
+        text = text.decode('utf-8')
+    return _WORD.findall(text.lower())
+
+
+def terms(text):
+    """The distinct words of a query"""
+    seen = []
+    for word in tokenize(text):
+        if word not in seen:
+            seen.append(word)
+    return seen
+
+
+def weight(total, matching):
+    """The weight of a word found in matching objects out of total"""
+    return math.log(1.0 + float(total) / matching)
+
+
+def rank(postings, total):
+    """
+    The ids found in every one of postings, the mappings of id to the
+    number of occurrences of each word of the query, the most relevant
+    first and equally relevant ones by id.
+    """
+    if not postings or not all(postings):
+        return []
+    ids = set(min(postings, key=len))
+    for posting in postings:
+        ids.intersection_update(posting)
+    weights = [weight(total, len(posting)) for posting in postings]
+    scores = dict((id, sum(w * posting[id] for w, posting in zip(weights, postings)))
+                  for id in ids)
+    return sorted(scores, key=lambda id: (-scores[id], id))
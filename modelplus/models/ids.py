@@ -0,0 +1,188 @@
+"""
+Generation of the ids of new objects.
+
+The generator of a model is chosen by ``id_generator`` in its Meta class,
+either the name of a registered generator or a callable taking the object
+and returning its id.  The default ids are ULIDs, which sort in creation
+order, so objects are listed in insertion order without an index.
+
+Ids sort by length first (``id_sort_key``), so in a table holding the
+36 character uuid4 ids of earlier versions the 26 character ULIDs come
+before every legacy id.  Such models keep ``id_generator = 'uuid4'``.
+"""
+import os
+import random
+import threading
+import time
+import uuid
+
+__all__ = ['register_id_generator', 'get_id_generator', 'id_sort_key', 'set_worker_id']
+
+# Crockford's base 32, in ascending order
+ALPHABET = '0123456789ABCDEFGHJKMNPQRSTVWXYZ'
+
+# 2020-01-01 in milliseconds, the start of snowflake timestamps
+SNOWFLAKE_EPOCH = 1577836800000
+
+# Datastore sequence handing out the snowflake worker ids
+WORKER_SEQUENCE = '_snowflake_workers'
+
+_generators = {}
+
+_lock = threading.Lock()
+_random = random.SystemRandom()
+
+
+def register_id_generator(name, generate):
+    """
+    Registers an id generator, ``generate`` takes the object being saved
+    and returns its id as a string.
+    """
+    _generators[name] = generate
+
+
+def get_id_generator(generator):
+    """
+    Returns the generate function for the ``id_generator`` Meta option.
+    """
+    if generator is None:
+        generator = 'ulid'
+    if callable(generator):
+        return generator
+    try:
+        return _generators[generator]
+    except KeyError:
+        raise ValueError("Unknown id generator %s" % generator)
+
+
+def id_sort_key(id):
+    """
+    Sort key of ids: shorter ids first, so sequences of numbers sort
+    numerically and fixed width ids in the order of their characters.
+    """
+    return (len(id), id)
+
+
+def _milliseconds():
+    return int(time.time() * 1000)
+
+
+class _Monotonic(object):
+    """
+    The millisecond timestamp and random part of the last id, the random
+    part is incremented for ids made within the same millisecond so they
+    still sort in creation order.
+    """
+
+    def __init__(self, bits):
+        self.bits = bits
+        self.last = 0
+        self.rand = 0
+
+    def next(self):
+        with _lock:
+            now = _milliseconds()
+            if now <= self.last:
+                now = self.last
+                self.rand += 1
+                if self.rand >> self.bits:
+                    # Ran out of ids for this millisecond, borrow the next
+                    now += 1
+                    self.rand = _random.getrandbits(self.bits - 1)
+            else:
+                # Keep headroom so the increments rarely overflow
+                self.rand = _random.getrandbits(self.bits - 1)
+            self.last = now
+            return now, self.rand
+
+_ulid_state = _Monotonic(80)
+_uuid7_state = _Monotonic(74)
+
+
+def ulid(instance=None):
+    """A 26 character ULID, 48 bits of milliseconds and 80 random bits."""
+    ms, rand = _ulid_state.next()
+    value = (ms << 80) | rand
+    chars = []
+    for i in range(26):
+        chars.append(ALPHABET[value & 31])
+        value >>= 5
+    return ''.join(reversed(chars))
+
+
+def uuid7(instance=None):
+    """A version 7 UUID, which starts with 48 bits of milliseconds."""
+    ms, rand = _uuid7_state.next()
+    value = ((ms << 80) | (7 << 76) | ((rand >> 62) << 64) |
+             (2 << 62) | (rand & ((1 << 62) - 1)))
+    return str(uuid.UUID(int=value))
+
+
+def uuid4(instance=None):
+    """A random UUID, the ids of earlier versions."""
+    return str(uuid.uuid4())
+
+
+class _Snowflake(object):
+    """
+    64 bit integers of 41 bits of milliseconds since SNOWFLAKE_EPOCH, 10
+    bits of worker id and a 12 bit sequence within the millisecond.
+
+    Unless set with set_worker_id, the worker id is taken from a sequence
+    of the datastore of the first object, and again in a forked process,
+    so it is distinct among the last 1024 processes that took one.
+    """
+
+    def __init__(self):
+        self.worker_id = None
+        # process the worker id was taken for, None when it was set
+        self.pid = None
+        self.last = 0
+        self.sequence = 0
+
+    def __call__(self, instance=None):
+        if self.worker_id is None or self.pid not in (None, os.getpid()):
+            self._take_worker_id(instance)
+        with _lock:
+            now = _milliseconds() - SNOWFLAKE_EPOCH
+            if now <= self.last:
+                now = self.last
+                self.sequence = (self.sequence + 1) & 0xfff
+                if not self.sequence:
+                    now += 1
+            else:
+                self.sequence = 0
+            self.last = now
+            return str((now << 22) | (self.worker_id << 12) | self.sequence)
+
+    def _take_worker_id(self, instance):
+        if instance is None:
+            raise ValueError("Snowflake ids need set_worker_id or an object to take a worker id")
+        worker_id = (instance.db.next_id(WORKER_SEQUENCE) - 1) & 0x3ff
+        with _lock:
+            self.worker_id, self.pid = worker_id, os.getpid()
+
+snowflake = _Snowflake()
+
+
+def set_worker_id(worker_id):
+    """
+    Sets the worker id of snowflake ids, which must be unique among the
+    processes writing to the same datastore.
+    """
+    if not 0 <= worker_id < 1024:
+        raise ValueError("The worker id must be between 0 and 1023")
+    with _lock:
+        snowflake.worker_id, snowflake.pid = worker_id, None
+
+
+def sequence(instance):
+    """Consecutive integers counted by the datastore."""
+    return str(instance.db.next_id(instance._key))
+
+
+register_id_generator('ulid', ulid)
+register_id_generator('uuid7', uuid7)
+register_id_generator('uuid4', uuid4)
+register_id_generator('snowflake', snowflake)
+register_id_generator('sequence', sequence)
@@ -35,5 +35,8 @@ class Manager(object):
     def exclude(self, **kwargs):
         return self.get_model_set().exclude(**kwargs)
 
+    def search(self, text):
+        return self.get_model_set().search(text)
+
     def get_by_id(self, id):
         return self.get_model_set().get_by_id(id)
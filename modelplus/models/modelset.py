@@ -1,11 +1,23 @@
 """
 Handles the queries.
 """
+import heapq
 import modelplus
-from exceptions import AttributeNotIndexed
+from fields import IntegerField, FloatField, BooleanField, DateTimeField, DateField
+from exceptions import AttributeNotIndexed, FullScanError
+from arrays import decode_column
+import fulltext
+from ids import id_sort_key
+
+# Fields that are ordered by their numeric value in the datastore
+NUMERIC_FIELDS = (IntegerField, FloatField, BooleanField, DateTimeField, DateField)
 
 # Model Set
 class ModelSet(object):
+    # When set, looking up a collection that loads more than this number
+    # of objects into Python to filter or order them raises FullScanError
+    strict_threshold = None
+
     def __init__(self, model_class):
         self.model_class = model_class
         self.key = model_class._key
@@ -17,9 +29,15 @@ class ModelSet(object):
         self._ordering = []
         self._limit = None
         self._offset = None
+        self._group_by = None
+        # words of the full-text search, None without
+        self._search = None
+        # id -> stored hash of the objects returned by the datastore query
+        self._prefetched = {}
 
         # Insure that we've done any necessary DB work to make this class happen
-        self.db.construct(model_class._key)
+        self.db.construct(model_class._key, codec=model_class._meta['codec'],
+                          indices=model_class._indices)
 
     #################
     # MAGIC METHODS #
@@ -30,7 +48,7 @@ class ModelSet(object):
         Will look in _set to get the id and simply return the instance of the model.
         """
         if isinstance(index, slice):
-            return map(lambda id: self._get_item_with_id(id), self._set[index])
+            return self._get_items_with_ids(self._set[index])
         else:
             id = self._set[index]
             if id:
@@ -47,8 +65,10 @@ class ModelSet(object):
         return "%s" % s
 
     def __iter__(self):
-        for id in self._set:
-            yield self._get_item_with_id(id)
+        ids = self._set
+        for i in range(0, len(ids), 1000):
+            for obj in self._get_items_with_ids(ids[i:i + 1000]):
+                yield obj
 
     def __len__(self):
         return len(self._set)
@@ -79,7 +99,7 @@ class ModelSet(object):
         >>> [f.delete() for f in Foo.objects.all()] # doctest: +ELLIPSIS
         [...]
         """
-        if (self._filters or self._exclusions) and str(id) not in self._set:
+        if (self._filters or self._exclusions or self._search is not None) and str(id) not in self._set:
             return
         if self.model_class.exists(id):
             return self._get_item_with_id(id)
@@ -108,6 +128,145 @@ class ModelSet(object):
         except IndexError:
             return None
 
+    def iterator(self, chunk_size=1000):
+        """
+        Iterate over the objects of the collection without caching them.
+
+        The ids are enumerated ``chunk_size`` at a time, each chunk is
+        fetched with a single bulk read and filtered before the objects
+        are yielded, so memory use is bounded by the chunk size rather
+        than the size of the collection.
+
+        .. Note:: Unless an ordering is given, the objects are yielded in
+                  datastore order rather than sorted by id.
+
+        >>> from redisco import models
+        >>> class Foo(models.Model):
+        ...     name = models.StringField()
+        ...
+        >>> f = Foo(name="Einstein")
+        >>> f.save()
+        True
+        >>> [f.name for f in Foo.objects.all().iterator(chunk_size=100)]
+        [u'Einstein']
+        >>> [f.delete() for f in Foo.objects.all()] # doctest: +ELLIPSIS
+        [...]
+        """
+        filtered = self._filters or self._exclusions
+        # An ordered, limited or searched set has already been filtered by _set
+        if (self._ordering or self._limit is not None or self._search is not None or
+                hasattr(self, '_cached_set')):
+            filtered = False
+        for ids in self._iter_id_chunks(chunk_size):
+            for obj in self._get_items_with_ids(ids):
+                if not filtered or self._matches(obj):
+                    yield obj
+
+
+    def to_arrays(self, fields):
+        """
+        Return the values of some attributes of the collection as NumPy
+        arrays, without loading the objects.
+
+        Only the requested attributes are fetched, in bulk, and each of
+        them is decoded in a single vectorised pass. Dates and datetimes
+        become ``datetime64`` arrays (in UTC). The arrays are masked
+        arrays, masked where the value is missing. ``'id'`` can be
+        requested as well.
+
+        :param fields: the names of the attributes.
+        :returns: a dict of the arrays by attribute name.
+
+        >>> from redisco import models
+        >>> class Foo(models.Model):
+        ...     price = models.FloatField()
+        ...
+        >>> Foo(price=1.5).save()
+        True
+        >>> Foo.objects.all().to_arrays(['price'])['price'].tolist()
+        [1.5]
+        >>> [f.delete() for f in Foo.objects.all()] # doctest: +ELLIPSIS
+        [...]
+        """
+        try:
+            import numpy as np
+        except ImportError:
+            raise ImportError("to_arrays requires the numpy package")
+        names = [name for name in fields if name != 'id']
+        for name in names:
+            if name not in self.model_class._attributes:
+                raise ValueError("%s is not an attribute of %s" % (name, self.model_class.__name__))
+
+        ids = self._set
+        rows = self.db.hmget_many([self.key[id] for id in ids], names) if names else []
+        columns = zip(*rows) if rows else [() for name in names]
+
+        arrays = {}
+        for name, values in zip(names, columns):
+            arrays[name] = decode_column(np, self.model_class, name, list(values))
+        if 'id' in fields:
+            arrays['id'] = np.array(ids, dtype=object)
+        return arrays
+
+    def aggregate(self, **aggregates):
+        """
+        Compute aggregates over the collection.
+
+        The aggregates are computed by the datastore when it can (SQL
+        aggregates in SQLite, a Lua script in Redis) and by streaming
+        the needed attributes through Python otherwise.
+
+        :returns: a dict of the aggregate values by name, or a list of
+                  them per value of the attribute given to ``group_by``.
+
+        >>> from redisco import models
+        >>> class Foo(models.Model):
+        ...     status = models.StringField()
+        ...     amount = models.IntegerField()
+        ...
+        >>> Foo(status="paid", amount=10).save()
+        True
+        >>> Foo(status="paid", amount=5).save()
+        True
+        >>> Foo.objects.all().aggregate(total=models.Sum('amount'), n=models.Count())
+        {'total': 15, 'n': 2}
+        >>> Foo.objects.all().group_by('status').aggregate(n=models.Count())
+        [{'status': u'paid', 'n': 2}]
+        >>> [f.delete() for f in Foo.objects.all()] # doctest: +ELLIPSIS
+        [...]
+        """
+        names = sorted(aggregates)
+        attributes = self.model_class._attributes
+        specs = []
+        for name in names:
+            field = aggregates[name].field
+            if field is not None and field not in attributes:
+                raise ValueError("%s is not an attribute of %s" % (field, self.model_class.__name__))
+            numeric = (field is not None and isinstance(attributes[field], NUMERIC_FIELDS) and
+                       not self.model_class._compression_for(field)[0])
+            specs.append((aggregates[name].function, field, numeric))
+
+        rows = None
+        if self._limit is None:
+            rows = self._aggregate_in_store(specs)
+        if rows is not None:
+            rows = [(self._typecast_group(group),
+                     [self._typecast_aggregate(aggregates[name], value) for name, value in zip(names, values)])
+                    for group, values in rows]
+        else:
+            rows = self._aggregate_in_python([aggregates[name] for name in names])
+
+        results = []
+        for group, values in rows:
+            result = dict(zip(names, values))
+            if self._group_by:
+                result[self._group_by] = group
+            results.append(result)
+        if self._group_by:
+            return results
+        if results:
+            return results[0]
+        return dict((name, aggregates[name].result(aggregates[name].start())) for name in names)
 
     #####################################
     # METHODS THAT MODIFY THE MODEL SET #
@@ -190,12 +349,50 @@ class ModelSet(object):
         alpha = True
         if fname in self.model_class._attributes:
             v = self.model_class._attributes[fname]
+            alpha = not isinstance(v, NUMERIC_FIELDS)
         clone = self._clone()
         if not clone._ordering:
             clone._ordering = []
         clone._ordering.append((field, alpha,))
         return clone
 
+    def group_by(self, field):
+        """
+        Group the results of ``aggregate`` by the value of an attribute.
+        """
+        if field not in self.model_class._attributes:
+            raise ValueError("%s is not an attribute of %s" % (field, self.model_class.__name__))
+        clone = self._clone()
+        clone._group_by = field
+        return clone
+
+    def search(self, text):
+        """
+        Restrict the collection to the objects whose searchable fields
+        hold every word of text, the most relevant first unless an
+        ordering is given.
+
+        The datastore's full-text index ranks the objects when it has one
+        (an FTS5 table in SQLite, sorted sets of the words in Redis),
+        otherwise the objects are loaded and ranked in Python.
+
+        >>> from redisco import models
+        >>> class Foo(models.Model):
+        ...     title = models.StringField(searchable=True)
+        ...
+        >>> Foo(title="The quick brown fox").save()
+        True
+        >>> Foo.objects.search('Quick fox').first().title
+        u'The quick brown fox'
+        >>> [f.delete() for f in Foo.objects.all()] # doctest: +ELLIPSIS
+        [...]
+        """
+        if not self.model_class._searchable:
+            raise AttributeNotIndexed("%s has no searchable field." % self.model_class.__name__)
+        clone = self._clone()
+        clone._search = fulltext.terms(text)
+        return clone
+
     def limit(self, n, offset=0):
         """
         Limit the size of the collection to *n* elements.
@@ -277,21 +474,386 @@ class ModelSet(object):
         if hasattr(self, '_cached_set'):
             return self._cached_set
 
-        s = self.db.get_all(self.key)
+        if self._search is not None:
+            self._cached_set = self._searched_set()
+            return self._cached_set
+
+        cache_key = self._query_cache_key()
+        if cache_key is not None:
+            version = self.model_class._write_version
+            cached = self.model_class._query_cache.get(cache_key)
+            if cached is not None and cached[0] == version:
+                self._cached_set = list(cached[1])
+                return self._cached_set
+
+        if self.strict_threshold is not None:
+            self.explain(strict=True, threshold=self.strict_threshold)
+
+        rows = None
+        if self._filters or self._exclusions or self._limit is not None:
+            rows = self._query_in_store()
+        if rows is not None:
+            self._prefetched = dict(rows)
+            self._cached_set = [id for id, stored_attrs in rows]
+            if cache_key is not None:
+                self.model_class._query_cache[cache_key] = (version, tuple(self._cached_set))
+            return self._cached_set
 
-        self._cached_set = []
+        s = None
         if self._filters or self._exclusions:
-            r = []
-            for obj in [self._get_item_with_id(id) for id in s]:
-                if (((self._filters and self._check_filters(self._filters, obj)) or not self._filters) and
-                    ((self._exclusions and not self._check_filters(self._exclusions, obj)) or not self._exclusions)):
-                    r.append(obj.id)
-            s = r
+            s = [obj.id for obj in self._get_items_with_ids(self.db.get_all(self.key))
+                 if self._matches(obj)]
 
         self._cached_set = self._order(s, self.key)
 
+        if cache_key is not None:
+            self.model_class._query_cache[cache_key] = (version, tuple(self._cached_set))
+
         return self._cached_set
 
+    def _searched_set(self):
+        """
+        The ids of the objects with the words searched, ranked, then
+        filtered, ordered and sliced.
+        """
+        ids = []
+        if self._search:
+            ids = None
+            # Until the objects saved before are indexed, by an
+            # IndexBackfill, the index would miss them
+            if self.model_class._text_index_ready():
+                ids = self.db.search(self.key, self._search)
+            if ids is None:
+                ids = self._search_in_python()
+        if ids and (self._filters or self._exclusions):
+            matching = set(obj.id for obj in self._get_items_with_ids(ids) if self._matches(obj))
+            ids = [id for id in ids if id in matching]
+        if self._ordering:
+            return self._set_with_ordering(ids, self.key)
+        return self._slice(ids)
+
+    def _search_in_python(self, chunk_size=1000):
+        """
+        Rank the objects with the words searched, streaming the
+        searchable fields of the model chunk_size objects at a time.
+        """
+        attributes = self.model_class._attributes
+        names = self.model_class._searchable
+        postings = [{} for term in self._search]
+        total = 0
+        for ids in self.db.iter_ids(self.key, chunk_size):
+            rows = self.db.hmget_many([self.key[id] for id in ids], names)
+            for id, values in zip(ids, rows):
+                total += 1
+                counts = {}
+                for name, value in zip(names, values):
+                    if value is not None:
+                        value = attributes[name].typecast_for_read(self.model_class._decompress(name, value))
+                        for word in fulltext.tokenize(value):
+                            counts[word] = counts.get(word, 0) + 1
+                for term, posting in zip(self._search, postings):
+                    if term in counts:
+                        posting[id] = counts[term]
+        return fulltext.rank(postings, total)
+
+    def _query_cache_key(self):
+        """
+        Returns the normalised form of the query used as the key of the
+        query cache, or None if the model doesn't use the query cache
+        (``Meta.query_cache``), its objects expire (``Meta.ttl`` or a save
+        with a ttl), which no write tells the cache about, or the query
+        can't be hashed.
+        """
+        meta = self.model_class._meta
+        if (not meta['query_cache'] or meta['ttl'] or self.model_class._expiring or
+                self._search is not None):
+            return None
+        key = (tuple(sorted((self._filters or {}).items())),
+               tuple(sorted((self._exclusions or {}).items())),
+               tuple(self._ordering or ()),
+               self._limit,
+               self._offset)
+        try:
+            hash(key)
+        except TypeError:
+            return None
+        return key
+
+    def _aggregate_in_store(self, specs):
+        """
+        Have the datastore compute the aggregates, with the filters
+        when they only compare stored attributes.
+
+        :returns: a list of (stored group value, [values]) or None.
+        """
+        where = self._stored_conditions()
+        if where is not None:
+            rows = self.db.aggregate(self.key, None, self._group_by, specs, *where)
+            if rows is not None:
+                return rows
+        if self._filters or self._exclusions or self._search is not None:
+            return self.db.aggregate(self.key, self._set, self._group_by, specs)
+        return None
+
+    def _stored_conditions(self):
+        """
+        The filters and exclusions as mappings of attribute to stored
+        value, for the datastores to evaluate them.
+
+        :returns: (filters, exclusions) or None if some of them can only
+                  be checked on the objects.
+        """
+        if self._search is not None:
+            return None
+        attributes = self.model_class._attributes
+        native = self.db.native_types(self.key)
+        where = []
+        for conditions, excluded in ((self._filters or {}, False), (self._exclusions or {}, True)):
+            stored = {}
+            for k, v in conditions.iteritems():
+                if k not in self.model_class._indices:
+                    raise AttributeNotIndexed("Attribute %s is not indexed in %s class." % (k, self.model_class.__name__))
+                if k in self.model_class._computed_indices():
+                    # Stored as unicode, empty values not at all, and by
+                    # every object only once its backfill completed
+                    if (excluded or not v or not isinstance(v, basestring) or
+                            k not in self.model_class._ready_indices()):
+                        return None
+                    stored[k] = unicode(v)
+                    continue
+                if (k not in attributes or v is None or
+                        self.model_class._compression_for(k)[0]):
+                    return None
+                if native:
+                    stored[k] = attributes[k].typecast_for_native(v)
+                else:
+                    stored[k] = attributes[k].typecast_for_storage(v)
+            where.append(stored)
+        return tuple(where)
+
+    def _query_in_store(self):
+        """
+        Have the datastore filter, order and page the collection and
+        return the objects.  SQL, MongoDB and the memory store answer in
+        a single round trip.  Redis has no index to serve the query, it
+        scans the keys of the model and runs a script on every chunk of
+        them, about two round trips per chunk, then loads the page.
+
+        :returns: a list of (id, stored hash) or None.
+        """
+        where = self._stored_conditions()
+        if where is None:
+            return None
+        order, desc, alpha = None, False, True
+        if self._ordering:
+            if self._stored_ordering() is None:
+                return None
+            order, desc, alpha = self._stored_ordering()
+        num, start = self._get_limit_and_offset()
+        return self.db.query(self.key, where[0], where[1], order, desc=desc, alpha=alpha,
+                             start=start, num=num)
+
+    def _stored_ordering(self):
+        """
+        The ordering as (attribute, desc, alpha) when it is a single
+        stored attribute the datastores can order by, None otherwise.
+        """
+        if len(self._ordering) != 1:
+            return None
+        field, alpha = self._ordering[0]
+        desc = field.startswith('-')
+        field = field.lstrip('-')
+        if (field not in self.model_class._attributes or
+                self.model_class._compression_for(field)[0]):
+            return None
+        return field, desc, alpha
+
+    def explain(self, strict=False, threshold=1000):
+        """
+        Describe how the collection would be looked up, without running
+        the query.
+
+        :returns: a dict with
+            ``source``: where the ids come from, ``'cache'`` (query
+                cache), ``'store'`` (a single datastore query) or
+                ``'scan'`` (every id of the model is enumerated)
+            ``filter``, ``order``, ``limit``: ``'store'`` or
+                ``'python'``, where they run, None when there are none
+            ``indexes``: the attributes whose datastore index serves the
+                filters or the ordering
+            ``rows``: number of objects of the model
+            ``max_results``: upper bound of the size of the collection
+            ``loaded``: number of objects loaded into Python to filter
+                or order them
+            ``scanned``: number of objects the datastore reads to run
+                the query when none of its indexes serves it
+            ``round_trips``: datastore calls to find the ids
+            ``load_round_trips``: datastore calls to load the objects
+                when iterating, 0 when the query returned them
+
+        If strict, FullScanError is raised when more than threshold
+        objects would be loaded into Python or scanned by the datastore.
+        """
+        db = self.db
+        capabilities = db.capabilities(self.key)
+        rows = db.count(self.key)
+        num, start = self._get_limit_and_offset()
+        conditions = bool(self._filters or self._exclusions)
+        max_results = max(rows - (start or 0), 0)
+        if num is not None:
+            max_results = min(max_results, num)
+        plan = {
+            'model': self.model_class.__name__,
+            'filter': None,
+            'order': None,
+            'limit': None,
+            'indexes': [],
+            'rows': rows,
+            'max_results': max_results,
+            'loaded': 0,
+            'scanned': 0,
+        }
+
+        cache_key = self._query_cache_key()
+        if cache_key is not None:
+            cached = self.model_class._query_cache.get(cache_key)
+            if cached is not None and cached[0] == self.model_class._write_version:
+                plan.update(source='cache', max_results=len(cached[1]), round_trips=0,
+                            load_round_trips=len(cached[1]))
+                return plan
+
+        if self._search is not None:
+            # The ranked ids, then at most every object of the model
+            # loaded to filter or order them, or to search them until
+            # the full-text index was backfilled
+            unindexed = not self.model_class._text_index_ready()
+            loaded = rows if conditions or self._ordering or unindexed else 0
+            plan.update(source='search', loaded=loaded, round_trips=2 if loaded else 1,
+                        load_round_trips=max_results,
+                        filter='python' if conditions else None,
+                        order='python' if self._ordering else None,
+                        limit='python' if num is not None else None)
+            if strict and loaded > threshold:
+                raise FullScanError("The query loads %d %s objects to %s them in Python" %
+                                    (loaded, plan['model'], 'search' if unindexed else
+                                     'filter' if conditions else 'order'))
+            return plan
+
+        ordered_in_store = not self._ordering or self._stored_ordering() is not None
+        if ((conditions or num is not None) and 'query' in capabilities and
+                self._stored_conditions() is not None and ordered_in_store):
+            indexed = db.indexed_fields(self.key)
+            fields = set(self._filters or ()) | set(self._exclusions or ())
+            if self._ordering:
+                fields.add(self._stored_ordering()[0])
+            # Without an index on an equality filter, or on the ordering
+            # of a query without filters, the datastore reads every row
+            if self._filters:
+                scanned = 0 if set(self._filters) & indexed else rows
+            elif self._ordering:
+                scanned = 0 if self._stored_ordering()[0] in indexed else rows
+            else:
+                scanned = 0 if not conditions else rows
+            plan.update(source='store', round_trips=1, load_round_trips=0,
+                        indexes=sorted(fields & indexed), scanned=scanned,
+                        filter='store' if conditions else None,
+                        order='store' if self._ordering else None,
+                        limit='store' if num is not None else None)
+            if strict and scanned > threshold:
+                raise FullScanError("The datastore scans %d %s objects without an index on %s" %
+                                    (scanned, plan['model'], ', '.join(sorted(fields))))
+            return plan
+
+        plan['source'] = 'scan'
+        round_trips = 0
+        if conditions:
+            # get_all then the bulk load of every object
+            plan.update(filter='python', loaded=rows)
+            round_trips += 2
+        if self._ordering:
+            sort = 'sort_ids' if conditions else 'sort'
+            if self._stored_ordering() is not None and sort in capabilities:
+                plan['order'] = 'store'
+                round_trips += 1
+            else:
+                # get_all unless filtered, and the bulk load
+                plan.update(order='python', loaded=rows)
+                round_trips += 1 if conditions else 2
+        elif not conditions:
+            round_trips += 1
+        if num is not None:
+            plan['limit'] = plan['order'] if self._ordering else 'python'
+        plan.update(round_trips=round_trips, load_round_trips=max_results)
+
+        if strict and plan['loaded'] > threshold:
+            raise FullScanError("The query loads %d %s objects to %s them in Python" %
+                                (plan['loaded'], plan['model'],
+                                 'filter' if conditions else 'order'))
+        return plan
+
+    def _aggregate_in_python(self, aggregates, chunk_size=1000):
+        """
+        Compute the aggregates streaming the needed attributes of the
+        collection chunk_size objects at a time.
+
+        :returns: a list of (group value, [values]).
+        """
+        attributes = self.model_class._attributes
+        names = [a.field for a in aggregates if a.field is not None]
+        if self._group_by:
+            names.append(self._group_by)
+        names = list(set(names))
+        groups, order = {}, []
+        ids = self._set
+        for i in range(0, len(ids), chunk_size):
+            keys = [self.key[id] for id in ids[i:i + chunk_size]]
+            for values in (self.db.hmget_many(keys, names) if names else [()] * len(keys)):
+                row = {}
+                for name, value in zip(names, values):
+                    if value is not None:
+                        value = attributes[name].typecast_for_read(self.model_class._decompress(name, value))
+                    row[name] = value
+                group = row.get(self._group_by) if self._group_by else None
+                if group not in groups:
+                    groups[group] = [a.start() for a in aggregates]
+                    order.append(group)
+                state = groups[group]
+                for j, a in enumerate(aggregates):
+                    state[j] = a.add(state[j], row.get(a.field))
+        return [(group, [a.result(s) for a, s in zip(aggregates, groups[group])])
+                for group in order]
+
+    def _typecast_group(self, value):
+        if value is None or not self._group_by:
+            return value
+        field = self.model_class._attributes[self._group_by]
+        return field.typecast_for_read(self.model_class._decompress(self._group_by, value))
+
+    def _typecast_aggregate(self, aggregate, value):
+        """
+        Typecasts an aggregate computed by the datastore to the value
+        computed in Python.
+        """
+        if value is None:
+            return value
+        if aggregate.function == 'count':
+            return int(value)
+        if aggregate.function == 'avg':
+            return float(value)
+        field = self.model_class._attributes[aggregate.field]
+        if aggregate.function == 'sum':
+            if isinstance(field, (IntegerField, BooleanField)):
+                return int(round(float(value)))
+            return float(value)
+        return field.typecast_for_read(value)
+
+    def _matches(self, obj):
+        """
+        True if the object passes both the filters and the exclusions.
+        """
+        return (((self._filters and self._check_filters(self._filters, obj)) or not self._filters) and
+                ((self._exclusions and not self._check_filters(self._exclusions, obj)) or not self._exclusions))
+
     def _check_filters(self, filters, obj):
         """
         Give a list of filters (name == value) check to make sure
@@ -319,6 +881,9 @@ class ModelSet(object):
         """
         This function does not job. It will only call the good
         subfunction in case we want an ordering or not.
+
+        ``keys`` is None when the whole collection is looked-up, so
+        the datastore can order it without enumerating the ids first.
         """
         if self._ordering:
             return self._set_with_ordering(keys, skey)
@@ -328,7 +893,11 @@ class ModelSet(object):
     def _set_with_ordering(self, keys, skey):
         """
         Final call for finally ordering the looked-up collection.
-        The ordering will be done by Redis itself and stored as a temporary set.
+
+        A single ordering on a stored attribute is handed to the datastore
+        (SORT BY in Redis, ORDER BY in SQL) together with the limit.
+        Otherwise the objects are sorted by key, each ordering in turn, or
+        the top of the collection is picked with a heap when limited.
 
         :return: a Set of `id`
         """
@@ -342,24 +911,36 @@ class ModelSet(object):
                 ordering = ordering.lstrip('-')
             else:
                 desc = False
-            info.append((ordering, desc))
-
-        objs = [self._get_item_with_id(id) for id in keys]
-
-        def sortfunc(a, b):
-            for k, desc in info:
-                val = getattr(a, k)
-                av = val() if callable(val) else val
-
-                val = getattr(b, k)
-                bv = val() if callable(val) else val
-
-                v = cmp(av, bv)
-                if v != 0:
-                    return v
-            return 0
+            info.append((ordering, desc, alpha))
+
+        if self._stored_ordering() is not None:
+            field, desc, alpha = self._stored_ordering()
+            ids = self.db.sort(skey, keys, field, desc=desc, alpha=alpha,
+                               start=start, num=num)
+            if ids is not None:
+                return ids
+
+        if keys is None:
+            keys = self.db.get_all(skey)
+        objs = self._get_items_with_ids(keys)
+
+        def keyfunc(k):
+            def value(obj):
+                val = getattr(obj, k)
+                return val() if callable(val) else val
+            return value
+
+        if num is not None and len(set(desc for k, desc, alpha in info)) == 1:
+            values = [keyfunc(k) for k, desc, alpha in info]
+            pick = heapq.nlargest if info[0][1] else heapq.nsmallest
+            objs = pick(start + num, objs, key=lambda obj: tuple(v(obj) for v in values))
+        else:
+            # The sort is stable, so sorting on each ordering from the
+            # last to the first gives the combined ordering.
+            for k, desc, alpha in reversed(info):
+                objs.sort(key=keyfunc(k), reverse=desc)
 
-        return [obj.id for obj in sorted(objs, cmp=sortfunc)]
+        return self._slice([obj.id for obj in objs])
 
     def _set_without_ordering(self, keys, skey):
         """
@@ -368,8 +949,18 @@ class ModelSet(object):
 
         :returns: A Set of `id`
         """
+        if keys is None:
+            keys = self.db.get_all(skey)
+        return self._slice(sorted(keys, key=id_sort_key))
 
-        return sorted(keys)
+    def _slice(self, ids):
+        """
+        Apply the limit and offset to the ordered ids.
+        """
+        num, start = self._get_limit_and_offset()
+        if num is None:
+            return ids
+        return ids[start:start + num]
 
     def _get_limit_and_offset(self):
         """
@@ -386,13 +977,55 @@ class ModelSet(object):
 
     def _get_item_with_id(self, id):
         """
-        Fetch an object and return the instance. The real fetching is
-        done by assigning the id to the Instance. See ``Model`` class.
+        Fetch an object and return the instance, None if it was deleted
+        or expired.
         """
+        if str(id) in self._prefetched:
+            instances = self._get_items_with_ids([id])
+            return instances[0] if instances else None
+        stored = self.db.hgetall(self.key[str(id)])
+        if not stored:
+            return None
         instance = self.model_class()
-        instance.id = str(id)
+        instance._id = str(id)
+        instance._load(stored)
         return instance
 
+    def _get_items_with_ids(self, ids):
+        """
+        Fetch a list of objects with a single bulk read from the datastore.
+        Ids that could not be found are skipped.
+        """
+        ids = [str(id) for id in ids]
+        if all(id in self._prefetched for id in ids):
+            stored = [self._prefetched[id] for id in ids]
+        else:
+            stored = self.db.hgetall_many([self.key[id] for id in ids])
+        instances = []
+        for id, stored_attrs in zip(ids, stored):
+            if stored_attrs is None:
+                continue
+            instance = self.model_class()
+            instance._id = id
+            instance._load(stored_attrs)
+            instances.append(instance)
+        return instances
+
+    def _iter_id_chunks(self, chunk_size):
+        """
+        Yield the ids of the set chunk_size at a time.  Unless the ids
+        are needed all at once (ordering), they are enumerated from the
+        datastore incrementally.
+        """
+        if (self._ordering or self._limit is not None or self._search is not None or
+                hasattr(self, '_cached_set')):
+            ids = self._set
+            for i in range(0, len(ids), chunk_size):
+                yield ids[i:i + chunk_size]
+        else:
+            for ids in self.db.iter_ids(self.key, chunk_size):
+                yield ids
+
     def _clone(self):
         """
         This function allows the chaining of lookup calls.
@@ -411,4 +1044,6 @@ class ModelSet(object):
             c._ordering = self._ordering
         c._limit = self._limit
         c._offset = self._offset
+        c._group_by = self._group_by
+        c._search = self._search
         return c
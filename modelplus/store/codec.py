@@ -0,0 +1,65 @@
+"""
+Codecs turning the hash of an object into the value stored by the
+datastores that keep an object as a single blob.
+"""
+import json
+import sqlite3
+
+class JSONCodec(object):
+    """Stores the hash as JSON text, every value as a string."""
+    name = 'json'
+    # Values are stored as the strings from typecast_for_storage
+    native = False
+
+    def encode(self, hash):
+        return json.dumps(hash)
+
+    def decode(self, data):
+        return json.loads(data)
+
+class MsgpackCodec(object):
+    """
+    Stores the hash as a msgpack binary blob, numbers and timestamps
+    as native msgpack types.
+    """
+    name = 'msgpack'
+    native = True
+
+    def __init__(self):
+        try:
+            import msgpack
+        except ImportError:
+            raise ImportError("The msgpack codec requires the msgpack package")
+        self.msgpack = msgpack
+
+    def encode(self, hash):
+        return sqlite3.Binary(self.msgpack.packb(hash, use_bin_type=True))
+
+    def decode(self, data):
+        # Unpacks buffers (SQLite blobs, mmap slices) without copying them
+        return self.msgpack.unpackb(data, raw=False)
+
+CODECS = {
+    'json'    : JSONCodec,
+    'msgpack' : MsgpackCodec,
+}
+
+_instances = {}
+
+def get_codec(name):
+    """Returns the codec registered under name."""
+    if name not in _instances:
+        try:
+            _instances[name] = CODECS[name]()
+        except KeyError:
+            raise ValueError("Unknown codec %s" % name)
+    return _instances[name]
+
+def decode(data):
+    """
+    Decodes a stored blob whatever the codec it was written with:
+    JSON is stored as text and the binary codecs as blobs.
+    """
+    if isinstance(data, basestring):
+        return get_codec('json').decode(data)
+    return get_codec('msgpack').decode(data)
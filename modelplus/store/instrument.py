@@ -0,0 +1,197 @@
+"""
+Instrumentation of the datastore operations.
+
+Hooks added with ``add_hook`` are called after every store operation with
+an ``Operation``: its name, key, model, duration in seconds and the size
+of the data it returned.  The store methods are only wrapped while there
+are hooks, so there is no cost at all when nothing listens.
+
+``count_operations`` counts the operations run within a block, by the
+thread that entered it, and warns when the same operation on the same
+model repeats more than a threshold, the sign of objects loaded one by
+one in a loop (N+1 queries)::
+
+    with count_operations(threshold=20) as counter:
+        for book in Book.objects.all():
+            book.author.name
+    print counter.total
+"""
+import threading
+import warnings
+from collections import namedtuple
+from timeit import default_timer
+
+__all__ = ['Operation', 'add_hook', 'remove_hook', 'register_store',
+           'count_operations', 'OperationCounter', 'NPlusOneWarning']
+
+Operation = namedtuple('Operation', 'name key model duration size')
+
+# The store methods that are timed
+OPERATIONS = ('get_all', 'scan_ids', 'exists', 'hgetall', 'hgetall_many', 'hmget_many',
+              'sort', 'query', 'aggregate', 'count', 'counter_get', 'incr_by', 'next_id',
+              'search', 'sweep', 'check_version', 'check_exists', 'check_fields',
+              'acquire_lock', 'release_lock', 'pipeline')
+
+_hooks = []
+# store class -> {method name: (original function, True if inherited)}
+_stores = {}
+_lock = threading.Lock()
+
+
+class NPlusOneWarning(UserWarning):
+    pass
+
+
+def register_store(store_class):
+    """
+    Makes the operations of a store class visible to the hooks, those it
+    inherits from a shared base too.
+    """
+    with _lock:
+        originals = {}
+        for name in OPERATIONS:
+            for klass in store_class.__mro__:
+                if name in klass.__dict__:
+                    # (function, True if inherited)
+                    originals[name] = (klass.__dict__[name], klass is not store_class)
+                    break
+        _stores[store_class] = originals
+        if _hooks:
+            _patch(store_class)
+
+
+def add_hook(hook):
+    """Calls hook(operation) after every store operation."""
+    with _lock:
+        _hooks.append(hook)
+        if len(_hooks) == 1:
+            for store_class in _stores:
+                _patch(store_class)
+
+
+def remove_hook(hook):
+    with _lock:
+        _hooks.remove(hook)
+        if not _hooks:
+            for store_class, originals in _stores.iteritems():
+                for name, (method, inherited) in originals.iteritems():
+                    if inherited:
+                        delattr(store_class, name)
+                    else:
+                        setattr(store_class, name, method)
+
+
+def _patch(store_class):
+    for name, (method, inherited) in _stores[store_class].iteritems():
+        setattr(store_class, name, _timed(name, method))
+
+
+def _timed(name, method):
+    def wrapper(self, *args, **kwargs):
+        start = default_timer()
+        result = None
+        try:
+            result = method(self, *args, **kwargs)
+            if name == 'pipeline':
+                result.execute = _timed_execute(result.execute)
+            return result
+        finally:
+            _emit(name, args[0] if args else None, default_timer() - start, result)
+    wrapper.__name__ = method.__name__
+    wrapper.__doc__ = method.__doc__
+    return wrapper
+
+
+def _timed_execute(execute):
+    def wrapper(*args, **kwargs):
+        start = default_timer()
+        result = None
+        try:
+            result = execute(*args, **kwargs)
+            return result
+        finally:
+            _emit('execute', None, default_timer() - start, result)
+    return wrapper
+
+
+def _emit(name, key, duration, result):
+    if isinstance(key, basestring):
+        model = key.split(':', 1)[0]
+    elif isinstance(key, (list, tuple)) and key and isinstance(key[0], basestring):
+        # bulk reads of a list of keys
+        model = key[0].split(':', 1)[0]
+        key = None
+    else:
+        model = key = None
+    operation = Operation(name, key, model, duration, _size(result))
+    for hook in list(_hooks):
+        hook(operation)
+
+
+def _size(value):
+    """Approximate number of bytes of a result."""
+    if value is None:
+        return 0
+    if isinstance(value, basestring):
+        return len(value)
+    if isinstance(value, dict):
+        return sum(_size(k) + _size(v) for k, v in value.iteritems())
+    if isinstance(value, (list, tuple)):
+        return sum(_size(v) for v in value)
+    if isinstance(value, (bool, int, long, float)):
+        return 8
+    return 0
+
+
+class OperationCounter(object):
+    """
+    Counts the store operations run while it is active, per (operation,
+    model), and warns about those repeated more than threshold times.
+
+    Used as a context manager, only the operations of the thread that
+    entered it are counted, the hooks being shared by every thread.
+    """
+
+    def __init__(self, threshold=None, warn=True):
+        self.threshold = threshold
+        self.warn = warn
+        self.counts = {}
+        self.total = 0
+        self.duration = 0.0
+        self.thread = None
+
+    def __call__(self, operation):
+        if self.thread is not None and threading.current_thread() is not self.thread:
+            return
+        pattern = (operation.name, operation.model)
+        self.counts[pattern] = self.counts.get(pattern, 0) + 1
+        self.total += 1
+        self.duration += operation.duration
+
+    def repeated(self):
+        """The (operation, model) patterns run more than threshold times."""
+        if self.threshold is None:
+            return []
+        return sorted(pattern for pattern, n in self.counts.iteritems() if n > self.threshold)
+
+    def __enter__(self):
+        self.thread = threading.current_thread()
+        add_hook(self)
+        return self
+
+    def __exit__(self, type, value, traceback):
+        remove_hook(self)
+        self.thread = None
+        if self.warn:
+            for name, model in self.repeated():
+                warnings.warn("%s on %s ran %d times, probably once per object (N+1)"
+                              % (name, model, self.counts[(name, model)]),
+                              NPlusOneWarning, stacklevel=2)
+
+
+def count_operations(threshold=None, warn=True):
+    """
+    Context manager counting the store operations run within it, see
+    ``OperationCounter``.
+    """
+    return OperationCounter(threshold, warn)
@@ -0,0 +1,642 @@
+"""
+The log-structured store, which appends every write to segment files of
+a directory and never rewrites a record in place.
+
+Every write is a record of the whole hash of an object (or a tombstone
+for a delete) appended to the active segment, the writes of a pipeline
+in a single write call.  An in-memory index (the keydir) maps every key
+to the segment, offset and size of its latest value, which is read back
+through an ``mmap`` of the segment, without copying it for msgpack.
+
+When the active segment reaches ``segment_size`` it is closed and a hint
+file listing its records is written next to it, so opening the store
+reads the hints rather than every segment.  Once enough of the closed
+segments is dead (overwritten or deleted records), a background thread
+merges them into a single segment with the live records only.
+
+Record: crc32, flags, key length, value length, key, value.  A batch is
+made of records flagged CONTINUED followed by one which isn't, and the
+batch a crash cut short is dropped when the store is opened again.
+
+Segment files are ``<number>.<generation>.data``.  A compaction writes
+the live records of segments up to number N as ``N.<generation + 1>``,
+which supersedes them all.
+"""
+import json
+import mmap
+import os
+import re
+import struct
+import threading
+import time
+import zlib
+from modelplus.models.base import invalidate_caches
+from modelplus.models.exceptions import ConflictError
+from modelplus.store import codec, instrument
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+# crc32, flags, key length, value length
+HEADER = struct.Struct('>IBHI')
+# flags, key length, offset of the value, value length
+HINT = struct.Struct('>BHII')
+
+TOMBSTONE = 1
+CONTINUED = 2
+MSGPACK = 4
+
+SEGMENT_NAME = re.compile(r'^(\d{8})\.(\d+)\.data$')
+
+def _bytes(key):
+    if isinstance(key, unicode):
+        return key.encode('utf-8')
+    return key
+
+def _record_size(key, size):
+    return HEADER.size + len(key) + size
+
+class Segment(object):
+    """A data file, mapped in memory when it is first read"""
+
+    def __init__(self, directory, number, generation):
+        self.number = number
+        self.generation = generation
+        self.path = os.path.join(directory, "%08d.%d.data" % (number, generation))
+        self.hint_path = os.path.join(directory, "%08d.%d.hint" % (number, generation))
+        self.size = os.path.getsize(self.path) if os.path.exists(self.path) else 0
+        # Bytes of the records which have been overwritten or deleted
+        self.dead = 0
+        self.file = None
+        self.map = None
+
+    def read(self, offset, size):
+        """The bytes at offset, a slice of the mapping, not a copy"""
+        if self.map is None or offset + size > len(self.map):
+            self.remap()
+        return buffer(self.map, offset, size)
+
+    def remap(self):
+        if self.map is not None:
+            self.map.close()
+        if self.file is None:
+            self.file = open(self.path, 'rb')
+        self.map = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+
+    def close(self):
+        if self.map is not None:
+            self.map.close()
+            self.map = None
+        if self.file is not None:
+            self.file.close()
+            self.file = None
+
+    def remove(self):
+        self.close()
+        for path in (self.path, self.hint_path):
+            if os.path.exists(path):
+                os.remove(path)
+
+class Transaction(object):
+    """
+    Collects the writes, checks the versions and appends the records
+    while holding the lock of the store.
+    """
+    def __init__(self, store):
+        self.store = store
+        self.writes = []
+        self.guards = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, type, value, traceback):
+        return
+
+    def delete(self, key):
+        self.writes.append(('delete', key, None))
+
+    def hmset(self, key, hash):
+        self.writes.append(('hmset', key, dict(hash)))
+
+    def hdel(self, key, *names):
+        self.writes.append(('hdel', key, names))
+
+    def check_version(self, key, name, version):
+        """Only execute if the stored version of key is still version"""
+        self.guards.append((key, name, version))
+
+    def check_exists(self, key):
+        """Only execute if key still exists"""
+        self.guards.append((key, None, None))
+
+    def check_fields(self, key, fields):
+        """Only execute if the stored fields of key still have these values"""
+        self.guards.append((key, None, None))
+        self.guards.extend((key, name, value) for name, value in fields.iteritems())
+
+    def execute(self):
+        store = self.store
+        try:
+            with store.lock:
+                for key, name, version in self.guards:
+                    hash = store._get(key)
+                    if hash is None or (name is not None and hash.get(name) != version):
+                        raise ConflictError("Object was modified since it was loaded")
+                # key -> the hash to write, None to delete
+                final, order = {}, []
+                for operation, key, arg in self.writes:
+                    if key not in final:
+                        order.append(key)
+                        final[key] = store._get(key)
+                    if operation == 'delete':
+                        final[key] = None
+                    elif operation == 'hmset':
+                        hash = dict(final[key] or {})
+                        hash.update(arg)
+                        final[key] = hash
+                    elif final[key] is not None:
+                        for name in arg:
+                            final[key].pop(name, None)
+                store._append([(key, final[key]) for key in order])
+        finally:
+            self.writes = []
+            self.guards = []
+
+class LogStore(object):
+    # Size from which the active segment is closed and a new one started
+    segment_size = 64 * 1024 * 1024
+    # Share of dead bytes in the closed segments which starts a compaction
+    compact_ratio = 0.5
+
+    def __init__(self, path, codec='json', sync=False, segment_size=None, compact_ratio=None):
+        # sync: fsync every write, rather than leave it to the OS
+        self.path = path
+        self.codec = codec
+        self.codecs = {}
+        self.sync = sync
+        if segment_size is not None:
+            self.segment_size = segment_size
+        if compact_ratio is not None:
+            self.compact_ratio = compact_ratio
+        self.lock = threading.RLock()
+        # Held for the whole of a compaction, the segments it reads stay open
+        self.compaction_lock = threading.Lock()
+        self.compaction = None
+        self.locks = {}
+        if not os.path.isdir(path):
+            os.makedirs(path)
+        self._lock_directory()
+        self._open()
+
+    def _lock_directory(self):
+        """Only one process may append to the segments"""
+        self.lock_file = open(os.path.join(self.path, 'LOCK'), 'w')
+        if fcntl is not None:
+            try:
+                fcntl.flock(self.lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except IOError:
+                self.lock_file.close()
+                raise IOError("%s is used by another process" % self.path)
+
+    #
+    # Opening: the keydir is rebuilt from the hints and segments
+    #
+
+    def _open(self):
+        # key -> (segment, offset, size, flags)
+        self.keydir = {}
+        # table -> set of ids
+        self.tables = {}
+        # the records of the active segment, written as its hint when closed
+        self.entries = []
+        found = []
+        for name in os.listdir(self.path):
+            if name.endswith('.tmp'):
+                # an unfinished compaction
+                os.remove(os.path.join(self.path, name))
+                continue
+            match = SEGMENT_NAME.match(name)
+            if match:
+                found.append(Segment(self.path, int(match.group(1)), int(match.group(2))))
+        compacted = [s for s in found if s.generation]
+        latest = max(compacted, key=lambda s: s.generation) if compacted else None
+        self.segments = []
+        for segment in sorted(found, key=lambda s: (s.number, s.generation)):
+            if latest is not None and segment.number <= latest.number and segment is not latest:
+                # merged into the latest compaction, which didn't get to remove it
+                segment.remove()
+            else:
+                self.segments.append(segment)
+        for i, segment in enumerate(self.segments):
+            active = i == len(self.segments) - 1 and not segment.generation
+            if not active and os.path.exists(segment.hint_path):
+                self._load_hint(segment)
+            else:
+                self._scan(segment, active)
+        if not self.segments or self.segments[-1].generation:
+            number = self.segments[-1].number + 1 if self.segments else 1
+            self.segments.append(Segment(self.path, number, 0))
+            self.entries = []
+        self.active = open(self.segments[-1].path, 'ab')
+
+    def _load_hint(self, segment):
+        with open(segment.hint_path, 'rb') as f:
+            data = f.read()
+        pos = 0
+        while pos < len(data):
+            flags, length, offset, size = HINT.unpack_from(data, pos)
+            pos += HINT.size
+            key = data[pos:pos + length]
+            pos += length
+            self._apply(segment, key, offset, size, flags)
+
+    def _scan(self, segment, active):
+        """Reads the records of a segment, drops an incomplete last batch"""
+        if not segment.size:
+            return
+        with open(segment.path, 'rb') as f:
+            data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            try:
+                pos = good = 0
+                batch = []
+                while pos + HEADER.size <= len(data):
+                    crc, flags, length, size = HEADER.unpack_from(data, pos)
+                    end = pos + HEADER.size + length + size
+                    if end > len(data) or zlib.crc32(data[pos + 4:end]) & 0xffffffff != crc:
+                        break
+                    key = data[pos + HEADER.size:pos + HEADER.size + length]
+                    batch.append((key, pos + HEADER.size + length, size, flags))
+                    pos = end
+                    if not flags & CONTINUED:
+                        for key, offset, size, flags in batch:
+                            self._apply(segment, key, offset, size, flags)
+                        batch = []
+                        good = pos
+            finally:
+                data.close()
+        if good < segment.size and active:
+            # torn write of a crash, the next records go where it started
+            with open(segment.path, 'r+b') as f:
+                f.truncate(good)
+            segment.size = good
+
+    def _apply(self, segment, key, offset, size, flags):
+        """Points the keydir at a record"""
+        flags &= ~CONTINUED
+        old = self.keydir.get(key)
+        if old is not None:
+            old[0].dead += _record_size(key, old[2])
+        table, id = key.split(':', 1)
+        if flags & TOMBSTONE:
+            self.keydir.pop(key, None)
+            self.tables.get(table, set()).discard(id)
+            # the tombstone itself is only needed until compaction
+            segment.dead += _record_size(key, size)
+        else:
+            self.keydir[key] = (segment, offset, size, flags)
+            self.tables.setdefault(table, set()).add(id)
+        if segment is self.segments[-1]:
+            self.entries.append((flags, key, offset, size))
+
+    #
+    # Writing
+    #
+
+    def _encode(self, key, hash):
+        """(flags, bytes) of the value of key"""
+        if hash is None:
+            return TOMBSTONE, ''
+        table = key.split(':', 1)[0]
+        c = self.codec_for(table)
+        if c.name == 'json':
+            return 0, c.encode(hash)
+        return MSGPACK, bytes(c.encode(hash))
+
+    def _append(self, writes):
+        """Appends a batch of (key, hash or None), with the lock held"""
+        if not writes:
+            return
+        segment = self.segments[-1]
+        if segment.size >= self.segment_size:
+            segment = self._rotate()
+        chunks, applied = [], []
+        pos = segment.size
+        for i, (key, hash) in enumerate(writes):
+            key = _bytes(key)
+            flags, value = self._encode(key, hash)
+            if i < len(writes) - 1:
+                flags |= CONTINUED
+            body = struct.pack('>BHI', flags, len(key), len(value)) + key + value
+            chunks.append(struct.pack('>I', zlib.crc32(body) & 0xffffffff))
+            chunks.append(body)
+            applied.append((key, pos + HEADER.size + len(key), len(value), flags))
+            pos += HEADER.size + len(key) + len(value)
+        self.active.write(''.join(chunks))
+        self.active.flush()
+        if self.sync:
+            os.fsync(self.active.fileno())
+        segment.size = pos
+        for key, offset, size, flags in applied:
+            self._apply(segment, key, offset, size, flags)
+
+    def _rotate(self):
+        """Closes the active segment, with its hint, and starts a new one"""
+        segment = self.segments[-1]
+        self.active.close()
+        self._write_hint(segment.hint_path, self.entries)
+        self.entries = []
+        segment = Segment(self.path, segment.number + 1, 0)
+        self.segments.append(segment)
+        self.active = open(segment.path, 'ab')
+        self._maybe_compact()
+        return segment
+
+    def _write_hint(self, path, entries):
+        tmp = path + '.tmp'
+        with open(tmp, 'wb') as f:
+            f.write(''.join(HINT.pack(flags, len(key), offset, size) + key
+                            for flags, key, offset, size in entries))
+            f.flush()
+            os.fsync(f.fileno())
+        os.rename(tmp, path)
+
+    #
+    # Compaction
+    #
+
+    def _maybe_compact(self):
+        closed = self.segments[:-1]
+        total = sum(s.size for s in closed)
+        if not total or sum(s.dead for s in closed) < self.compact_ratio * total:
+            return
+        if self.compaction is not None and self.compaction.is_alive():
+            return
+        self.compaction = threading.Thread(target=self.compact)
+        self.compaction.daemon = True
+        self.compaction.start()
+
+    def compact(self):
+        """
+        Merges the closed segments into one holding their live records
+        only.  Writes go on meanwhile, the lock is only taken to list
+        the live records and to switch over to the new segment.
+        """
+        with self.compaction_lock:
+            with self.lock:
+                closed = self.segments[:-1]
+                if not closed:
+                    return
+                victims = set(closed)
+                live = sorted(((key, location) for key, location in self.keydir.iteritems()
+                               if location[0] in victims), key=lambda item: (item[1][0].number, item[1][1]))
+                for segment in closed:
+                    if segment.size:
+                        segment.remap()
+                generation = max(s.generation for s in self.segments) + 1
+            merged = Segment(self.path, closed[-1].number, generation)
+            moved, entries = [], []
+            pos = 0
+            with open(merged.path + '.tmp', 'wb') as f:
+                for key, location in live:
+                    segment, offset, size, flags = location
+                    value = segment.map[offset:offset + size]
+                    body = struct.pack('>BHI', flags, len(key), size) + key + value
+                    f.write(struct.pack('>I', zlib.crc32(body) & 0xffffffff))
+                    f.write(body)
+                    pos += HEADER.size + len(key)
+                    moved.append((key, location, (merged, pos, size, flags)))
+                    entries.append((flags, key, pos, size))
+                    pos += size
+                f.flush()
+                os.fsync(f.fileno())
+            self._write_hint(merged.hint_path, entries)
+            # the new segment supersedes the old ones from here on
+            os.rename(merged.path + '.tmp', merged.path)
+            merged.size = pos
+            with self.lock:
+                for key, old, new in moved:
+                    if self.keydir.get(key) == old:
+                        self.keydir[key] = new
+                    else:
+                        merged.dead += _record_size(key, new[2])
+                self.segments = [merged] + self.segments[len(closed):]
+                for segment in closed:
+                    segment.remove()
+
+    def close(self):
+        """Waits for a compaction and closes the files"""
+        with self.compaction_lock:
+            with self.lock:
+                self.active.close()
+                for segment in self.segments:
+                    segment.close()
+                self.lock_file.close()
+
+    #
+    # Reading
+    #
+
+    def _get(self, key):
+        """The hash of key, with the lock held"""
+        location = self.keydir.get(_bytes(key))
+        if location is None:
+            return None
+        segment, offset, size, flags = location
+        data = segment.read(offset, size)
+        if flags & MSGPACK:
+            return codec.get_codec('msgpack').decode(data)
+        return json.loads(data[:])
+
+    def get_all(self, prefix):
+        """Get all of the keys for a Model"""
+        with self.lock:
+            return list(self.tables.get(prefix, ()))
+
+    def iter_ids(self, prefix, chunk_size=1000):
+        """Get all of the keys for a Model, chunk_size at a time"""
+        ids = self.get_all(prefix)
+        for i in range(0, len(ids), chunk_size):
+            yield ids[i:i + chunk_size]
+
+    def scan_ids(self, prefix, cursor=None, count=1000):
+        """
+        Get up to count ids of a Model from cursor on, and the cursor to
+        continue from, None once every id was returned.
+        """
+        with self.lock:
+            ids = sorted(id for id in self.tables.get(prefix, ()) if cursor is None or id > cursor)[:count]
+        return (ids[-1] if len(ids) == count else None), ids
+
+    def exists(self, key):
+        """True if object exists"""
+        return _bytes(key) in self.keydir
+
+    def hgetall(self, key):
+        """Get all of the values for a key"""
+        with self.lock:
+            return self._get(key)
+
+    def hgetall_many(self, keys):
+        """Get all of the values for a list of keys, None for missing keys"""
+        with self.lock:
+            return [self._get(key) for key in keys]
+
+    def hmget_many(self, keys, names):
+        """Get the values of names for a list of keys"""
+        rows = []
+        with self.lock:
+            for key in keys:
+                hash = self._get(key) or {}
+                rows.append([hash.get(name) for name in names])
+        return rows
+
+    def sort(self, prefix, ids, field, desc=False, alpha=True, start=None, num=None):
+        """There are no secondary indexes, ordering is left to the models"""
+        return None
+
+    def query(self, prefix, filters, exclusions, order=None, desc=False, alpha=True,
+              start=None, num=None):
+        """There are no secondary indexes, queries are left to the models"""
+        return None
+
+    def aggregate(self, prefix, ids, group, aggregates, filters=None, exclusions=None):
+        """There are no secondary indexes, aggregates are left to the models"""
+        return None
+
+    def pipeline(self):
+        return Transaction(self)
+
+    def check_version(self, pipeline, key, name, version):
+        """Make the pipeline fail with a ConflictError if the version of key changes"""
+        pipeline.check_version(key, name, version)
+        return True
+
+    def check_exists(self, pipeline, key):
+        """
+        Make the pipeline fail with a ConflictError if key is deleted,
+        False if it already was.
+        """
+        if not self.exists(key):
+            return False
+        pipeline.check_exists(key)
+        return True
+
+    def check_fields(self, pipeline, key, fields):
+        """Make the pipeline fail with a ConflictError if one of the fields of key changes"""
+        pipeline.check_fields(key, fields)
+        return True
+
+    def index_text(self, pipeline, key, tokens):
+        """There is no full-text index, the search is done on the objects"""
+        return None
+
+    def search(self, prefix, terms):
+        """There is no full-text index, the search is done on the objects"""
+        return None
+
+    def expire(self, pipeline, key, seconds):
+        """The records have no expiry, the objects can't expire"""
+        return None
+
+    def sweep(self, prefix, count=1000):
+        """Nothing ever expires"""
+        return 0
+
+    def counter_get(self, key, name):
+        """Used by counters to get the current value"""
+        hash = self.hgetall(key)
+        if hash is not None:
+            return hash.get(name, 0)
+        return None
+
+    def incr_by(self, key, name, val):
+        """Increment a counter by a set amount"""
+        with self.lock:
+            hash = self._get(key)
+            if hash is not None:
+                value = int(hash.get(name, 0)) + val
+                hash[name] = value if self.native_types(key.split(':', 1)[0]) else str(value)
+                self._append([(key, hash)])
+                return value
+
+    def acquire_lock(self, name, token, ttl):
+        """Take the lock for ttl milliseconds, False if someone holds it"""
+        now = time.time()
+        with self.lock:
+            held = self.locks.get(name)
+            if held is not None and held[1] >= now:
+                return False
+            self.locks[name] = (token, now + ttl / 1000.0)
+            return True
+
+    def release_lock(self, name, token):
+        """Release the lock if token still holds it"""
+        with self.lock:
+            held = self.locks.get(name)
+            if held is None or held[0] != token:
+                return False
+            del self.locks[name]
+            return True
+
+    def next_id(self, table):
+        """Get the next number of the id sequence of table"""
+        key = "_sequence:%s" % table
+        with self.lock:
+            value = (self._get(key) or {}).get('value', 0) + 1
+            self._append([(key, {'value': value})])
+            return value
+
+    def flushdb(self):
+        """Delete all of the segments"""
+        with self.compaction_lock:
+            with self.lock:
+                self.active.close()
+                for segment in self.segments:
+                    segment.remove()
+                self.locks = {}
+                self._open()
+        invalidate_caches()
+
+    def codec_for(self, table):
+        """The codec objects of table are written with"""
+        return codec.get_codec(self.codecs.get(table, self.codec))
+
+    def count(self, prefix):
+        """Number of objects of a Model"""
+        return len(self.tables.get(prefix, ()))
+
+    def capabilities(self, table):
+        """
+        The work the store can take over: 'query', 'sort' (the whole
+        table), 'sort_ids' (a list of ids), 'aggregate' and 'count'
+        (without walking the ids).
+        """
+        return set(['count'])
+
+    def binary_values(self, table):
+        """True if values can be binary strings"""
+        return self.codec_for(table).name != 'json'
+
+    def native_types(self, table):
+        """True if values can be stored as numbers rather than strings"""
+        return self.codec_for(table).native
+
+    def expires(self, table):
+        """True if the objects can be given a time to live"""
+        return False
+
+    def indexed_fields(self, table):
+        """The fields with an index the store uses to filter and order"""
+        return set()
+
+    def construct(self, table, codec=None, indices=None):
+        if codec:
+            self.codecs[table] = codec
+
+instrument.register_store(LogStore)
+
+def setup(**kwargs):
+    return LogStore(**kwargs)
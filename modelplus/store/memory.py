@@ -0,0 +1,595 @@
+"""
+The in-process store, which keeps the objects in Python dicts.
+
+Nothing is encoded or parsed: the stored hashes are dicts of native
+values, the indexed attributes of a model (its ``_indices``) get a hash
+index of value -> set of ids to filter on and a sorted index of (value,
+id) to order and page by, and every read returns copies, so objects
+loaded from the store never share state with it or with each other.
+
+Objects given a time to live are removed by the first read of their
+model after they expired.
+
+It suits unit tests, benchmarks and single process tools, the data is
+gone with the process.
+"""
+import heapq
+import threading
+import time
+from bisect import bisect_left, insort
+from operator import itemgetter
+from modelplus.models import fulltext
+from modelplus.models.base import invalidate_caches
+from modelplus.models.exceptions import ConflictError
+from modelplus.store import instrument
+
+def _entry(id, value):
+    """Entry of the sorted index, ids ordered by length then characters"""
+    return (value, len(id), id)
+
+def _number(value):
+    if isinstance(value, basestring):
+        try:
+            return float(value)
+        except ValueError:
+            return None
+    return value
+
+class Index(object):
+    """The hash and sorted index of an attribute"""
+
+    def __init__(self):
+        # value -> set of ids
+        self.ids = {}
+        # (value, len(id), id) in ascending order
+        self.sorted = []
+        # Number of values which aren't numbers
+        self.others = 0
+
+    def add(self, id, value):
+        self.ids.setdefault(value, set()).add(id)
+        insort(self.sorted, _entry(id, value))
+        if not isinstance(value, (int, long, float)):
+            self.others += 1
+
+    def remove(self, id, value):
+        ids = self.ids.get(value)
+        if ids is None:
+            return
+        ids.discard(id)
+        if not ids:
+            del self.ids[value]
+        entry = _entry(id, value)
+        i = bisect_left(self.sorted, entry)
+        if i < len(self.sorted) and self.sorted[i] == entry:
+            del self.sorted[i]
+            if not isinstance(value, (int, long, float)):
+                self.others -= 1
+
+    def ordered(self, desc=False):
+        """The ids with a value, in order, equal values by ascending id"""
+        if not desc:
+            for entry in self.sorted:
+                yield entry[2]
+            return
+        i = len(self.sorted) - 1
+        while i >= 0:
+            j = i
+            while j > 0 and self.sorted[j - 1][0] == self.sorted[i][0]:
+                j -= 1
+            for k in range(j, i + 1):
+                yield self.sorted[k][2]
+            i = j - 1
+
+class Transaction(object):
+    """
+    Collects the writes and applies them at once, after the version
+    checks, while holding the lock of the store.
+    """
+    def __init__(self, store):
+        self.store = store
+        self.writes = []
+        self.guards = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, type, value, traceback):
+        return
+
+    def delete(self, key):
+        self.writes.append((self.store._delete, key, None))
+
+    def hmset(self, key, hash):
+        self.writes.append((self.store._hmset, key, dict(hash)))
+
+    def hdel(self, key, *names):
+        self.writes.append((self.store._hdel, key, names))
+
+    def check_version(self, key, name, version):
+        """Only execute if the stored version of key is still version"""
+        self.guards.append((key, name, version))
+
+    def check_exists(self, key):
+        """Only execute if key still exists"""
+        self.guards.append((key, None, None))
+
+    def check_fields(self, key, fields):
+        """Only execute if the stored fields of key still have these values"""
+        self.guards.append((key, None, None))
+        self.guards.extend((key, name, value) for name, value in fields.iteritems())
+
+    def execute(self):
+        try:
+            with self.store.lock:
+                for key, name, version in self.guards:
+                    table, id = key.split(':', 1)
+                    hash = self.store.table(table).get(id)
+                    if hash is None or (name is not None and hash.get(name) != version):
+                        raise ConflictError("Object was modified since it was loaded")
+                for write, key, arg in self.writes:
+                    table, id = key.split(':', 1)
+                    write(table, id, arg)
+        finally:
+            self.writes = []
+            self.guards = []
+
+class MemoryStore(object):
+    def __init__(self):
+        self.lock = threading.RLock()
+        # table -> {id: hash}
+        self.tables = {}
+        # table -> {field: Index}
+        self.indexes = {}
+        # table -> {word: {id: occurrences}}, the full-text index
+        self.texts = {}
+        # table -> {id: words of the object in the full-text index}
+        self.words = {}
+        # table -> {id: time the object expires at}
+        self.expiries = {}
+        # table -> heap of (time, id), with the expiries since replaced
+        self.deadlines = {}
+        self.locks = {}
+        self.sequences = {}
+
+    def table(self, table):
+        deadlines = self.deadlines.get(table)
+        if deadlines and deadlines[0][0] <= time.time():
+            self._purge(table)
+        try:
+            return self.tables[table]
+        except KeyError:
+            return self.tables.setdefault(table, {})
+
+    def _purge(self, table, count=None):
+        """Removes up to count of the expired objects of table, returns their number"""
+        removed = 0
+        now = time.time()
+        with self.lock:
+            deadlines = self.deadlines.get(table, [])
+            expiries = self.expiries.get(table, {})
+            while deadlines and deadlines[0][0] <= now and (count is None or removed < count):
+                deadline, id = heapq.heappop(deadlines)
+                if expiries.get(id) != deadline:
+                    continue
+                del expiries[id]
+                old = self.tables.get(table, {}).pop(id, None)
+                if old is not None:
+                    self._index(table, id, old, {})
+                    self._index_text(table, id, None)
+                    removed += 1
+        return removed
+
+    def _split(self, key):
+        table, id = key.split(':', 1)
+        return self.table(table), id
+
+    # Writes, called with the lock held
+
+    def _index(self, table, id, old, new):
+        for field, index in self.indexes.get(table, {}).iteritems():
+            if (field in old) == (field in new) and old.get(field) == new.get(field):
+                continue
+            if field in old:
+                index.remove(id, old[field])
+            if field in new:
+                index.add(id, new[field])
+
+    def _delete(self, table, id, arg=None):
+        old = self.table(table).pop(id, None)
+        if old is not None:
+            self._index(table, id, old, {})
+        self.expiries.get(table, {}).pop(id, None)
+
+    def _expire(self, table, id, deadline):
+        if id not in self.table(table):
+            return
+        self.expiries.setdefault(table, {})[id] = deadline
+        heapq.heappush(self.deadlines.setdefault(table, []), (deadline, id))
+
+    def _hmset(self, table, id, hash):
+        objects = self.table(table)
+        old = objects.get(id, {})
+        new = dict(old)
+        new.update(hash)
+        objects[id] = new
+        self._index(table, id, old, new)
+
+    def _hdel(self, table, id, names):
+        objects = self.table(table)
+        old = objects.get(id)
+        if old is None:
+            return
+        new = dict(old)
+        for name in names:
+            new.pop(name, None)
+        objects[id] = new
+        self._index(table, id, old, new)
+
+    def _index_text(self, table, id, tokens):
+        texts = self.texts.setdefault(table, {})
+        words = self.words.setdefault(table, {})
+        for word in words.pop(id, ()):
+            postings = texts[word]
+            del postings[id]
+            if not postings:
+                del texts[word]
+        for token in tokens or ():
+            postings = texts.setdefault(token, {})
+            postings[id] = postings.get(id, 0) + 1
+        if tokens:
+            words[id] = set(tokens)
+
+    # Reads, all of them return copies
+
+    def get_all(self, prefix):
+        """Get all of the keys for a Model"""
+        with self.lock:
+            return list(self.table(prefix))
+
+    def iter_ids(self, prefix, chunk_size=1000):
+        """Get all of the keys for a Model, chunk_size at a time"""
+        ids = self.get_all(prefix)
+        for i in range(0, len(ids), chunk_size):
+            yield ids[i:i + chunk_size]
+
+    def scan_ids(self, prefix, cursor=None, count=1000):
+        """
+        Get up to count ids of a Model from cursor on, and the cursor to
+        continue from, None once every id was returned.
+        """
+        with self.lock:
+            ids = sorted(id for id in self.table(prefix) if cursor is None or id > cursor)[:count]
+        return (ids[-1] if len(ids) == count else None), ids
+
+    def exists(self, key):
+        """True if object exists"""
+        objects, id = self._split(key)
+        return id in objects
+
+    def _copy(self, key):
+        objects, id = self._split(key)
+        hash = objects.get(id)
+        if hash is not None:
+            return dict(hash)
+        return None
+
+    def hgetall(self, key):
+        """Get all of the values for a key"""
+        return self._copy(key)
+
+    def hgetall_many(self, keys):
+        """Get all of the values for a list of keys, None for missing keys"""
+        with self.lock:
+            return [self._copy(key) for key in keys]
+
+    def hmget_many(self, keys, names):
+        """Get the values of names for a list of keys"""
+        rows = []
+        with self.lock:
+            for key in keys:
+                objects, id = self._split(key)
+                hash = objects.get(id, {})
+                rows.append([hash.get(name) for name in names])
+        return rows
+
+    def _candidates(self, table, filters):
+        """The ids possibly matching filters, narrowed by the hash indexes"""
+        indexes = self.indexes.get(table, {})
+        sets = [indexes[field].ids.get(value, set())
+                for field, value in filters.iteritems() if field in indexes]
+        if not sets:
+            return None
+        return set.intersection(*sorted(sets, key=len))
+
+    def _matches(self, hash, filters, exclusions):
+        for field, value in filters.iteritems():
+            if hash.get(field) != value:
+                return False
+        if exclusions:
+            for field, value in exclusions.iteritems():
+                if hash.get(field) != value:
+                    return True
+            return False
+        return True
+
+    def _select(self, table, ids, filters, exclusions):
+        """The ids among ids (all if None) matching filters and not exclusions"""
+        objects = self.table(table)
+        candidates = self._candidates(table, filters)
+        if ids is not None:
+            ids = [id for id in ids if id in objects]
+            if candidates is not None:
+                ids = [id for id in ids if id in candidates]
+        elif candidates is not None:
+            ids = candidates
+        else:
+            ids = objects
+        if not filters and not exclusions:
+            return set(ids)
+        return set(id for id in ids if self._matches(objects[id], filters, exclusions))
+
+    def _ordered(self, table, ids, field, desc, alpha, stop=None):
+        """
+        ids ordered by the value of field, missing values first like
+        None, equal values by id.  Only the first stop ids are ordered
+        when it can be read off the sorted index.
+        """
+        objects = self.table(table)
+        if field is None:
+            return sorted(ids, key=lambda id: (len(id), id), reverse=desc)
+        index = self.indexes.get(table, {}).get(field)
+        missing = sorted((id for id in ids if field not in objects[id]), key=lambda id: (len(id), id))
+        # Numeric ordering can only be read off an index of numbers
+        if index is not None and (alpha or not index.others):
+            present = []
+            wanted = None if stop is None else stop - (0 if desc else len(missing))
+            for id in index.ordered(desc):
+                if wanted is not None and len(present) >= wanted:
+                    break
+                if id in ids:
+                    present.append(id)
+        else:
+            value = itemgetter(0)
+            entries = []
+            for id in ids:
+                if field in objects[id]:
+                    v = objects[id][field]
+                    entries.append(_entry(id, v if alpha else _number(v)))
+            entries.sort()
+            if desc:
+                # stable, equal values keep their ascending ids
+                entries.sort(key=value, reverse=True)
+            present = [entry[2] for entry in entries]
+        if desc:
+            return present + missing
+        return missing + present
+
+    def _page(self, ids, start, num):
+        start = start or 0
+        if num is None:
+            return ids[start:]
+        return ids[start:start + num]
+
+    def sort(self, prefix, ids, field, desc=False, alpha=True, start=None, num=None):
+        """Get the keys for a Model ordered by field"""
+        with self.lock:
+            selected = self._select(prefix, ids, {}, {})
+            stop = None if num is None else (start or 0) + num
+            return self._page(self._ordered(prefix, selected, field, desc, alpha, stop), start, num)
+
+    def query(self, prefix, filters, exclusions, order=None, desc=False, alpha=True,
+              start=None, num=None):
+        """
+        Get the (id, hash) of the objects matching filters and not
+        exclusions, mappings of field to stored value, ordered by order
+        (by id if None) and paged.
+        """
+        with self.lock:
+            selected = self._select(prefix, None, filters, exclusions)
+            stop = None if num is None else (start or 0) + num
+            ids = self._page(self._ordered(prefix, selected, order, desc and bool(order), alpha, stop),
+                             start, num)
+            objects = self.table(prefix)
+            return [(id, dict(objects[id])) for id in ids]
+
+    def aggregate(self, prefix, ids, group, aggregates, filters=None, exclusions=None):
+        """
+        Compute aggregates, a list of (function, field, numeric), of the
+        objects matching filters and not exclusions, mappings of field to
+        stored value, grouped by the value of group.
+
+        Returns a list of (group value, [aggregate values]), None if it
+        can't be done here.
+        """
+        for function, field, numeric in aggregates:
+            if function not in ('count', 'sum', 'avg', 'min', 'max'):
+                return None
+            if function in ('sum', 'avg') and not numeric:
+                return None
+        with self.lock:
+            objects = self.table(prefix)
+            groups, order = {}, []
+            for id in self._select(prefix, ids, filters or {}, exclusions or {}):
+                hash = objects[id]
+                g = hash.get(group) if group else None
+                if g not in groups:
+                    groups[g] = [[] for a in aggregates]
+                    order.append(g)
+                for values, (function, field, numeric) in zip(groups[g], aggregates):
+                    if field is None:
+                        values.append(1)
+                    elif field in hash:
+                        values.append(_number(hash[field]) if numeric else hash[field])
+        rows = []
+        for g in order:
+            result = []
+            for values, (function, field, numeric) in zip(groups[g], aggregates):
+                values = [v for v in values if v is not None]
+                if function == 'count':
+                    result.append(len(values))
+                elif not values:
+                    result.append(None)
+                elif function == 'sum':
+                    result.append(sum(values))
+                elif function == 'avg':
+                    result.append(float(sum(values)) / len(values))
+                else:
+                    result.append(min(values) if function == 'min' else max(values))
+            rows.append((g, result))
+        return rows
+
+    def pipeline(self):
+        return Transaction(self)
+
+    def check_version(self, pipeline, key, name, version):
+        """Make the pipeline fail with a ConflictError if the version of key changes"""
+        pipeline.check_version(key, name, version)
+        return True
+
+    def check_exists(self, pipeline, key):
+        """
+        Make the pipeline fail with a ConflictError if key is deleted or
+        expires, False if it already was.
+        """
+        if not self.exists(key):
+            return False
+        pipeline.check_exists(key)
+        return True
+
+    def check_fields(self, pipeline, key, fields):
+        """Make the pipeline fail with a ConflictError if one of the fields of key changes"""
+        pipeline.check_fields(key, fields)
+        return True
+
+    def index_text(self, pipeline, key, tokens):
+        """
+        Replace the words of key in the full-text index with tokens, or
+        drop it from the index if None.
+        """
+        pipeline.writes.append((self._index_text, key, tokens))
+        return True
+
+    def search(self, prefix, terms):
+        """The ids of the objects with all of the words terms, the most relevant first"""
+        with self.lock:
+            total = len(self.table(prefix))
+            words = self.texts.get(prefix, {})
+            postings = [dict(words.get(term, {})) for term in terms]
+        return fulltext.rank(postings, total)
+
+    def expire(self, pipeline, key, seconds):
+        """Make key expire seconds from now"""
+        pipeline.writes.append((self._expire, key, time.time() + seconds))
+        return True
+
+    def sweep(self, prefix, count=1000):
+        """
+        The reads remove the expired objects as they go, remove up to
+        count of those left and return their number.
+        """
+        return self._purge(prefix, count)
+
+    def counter_get(self, key, name):
+        """Used by counters to get the current value"""
+        objects, id = self._split(key)
+        hash = objects.get(id)
+        if hash is not None:
+            return hash.get(name, 0)
+        return None
+
+    def incr_by(self, key, name, val):
+        """Increment a counter by a set amount"""
+        table, id = key.split(':', 1)
+        with self.lock:
+            hash = self.table(table).get(id)
+            if hash is not None:
+                value = int(hash.get(name, 0)) + val
+                self._hmset(table, id, {name: value})
+                return value
+
+    def acquire_lock(self, name, token, ttl):
+        """Take the lock for ttl milliseconds, False if someone holds it"""
+        now = time.time()
+        with self.lock:
+            held = self.locks.get(name)
+            if held is not None and held[1] >= now:
+                return False
+            self.locks[name] = (token, now + ttl / 1000.0)
+            return True
+
+    def release_lock(self, name, token):
+        """Release the lock if token still holds it"""
+        with self.lock:
+            held = self.locks.get(name)
+            if held is None or held[0] != token:
+                return False
+            del self.locks[name]
+            return True
+
+    def next_id(self, table):
+        """Get the next number of the id sequence of table"""
+        with self.lock:
+            value = self.sequences[table] = self.sequences.get(table, 0) + 1
+            return value
+
+    def flushdb(self):
+        """Delete all of the objects, the indexes stay defined"""
+        with self.lock:
+            self.tables = {}
+            self.texts = {}
+            self.words = {}
+            self.expiries = {}
+            self.deadlines = {}
+            for indexes in self.indexes.itervalues():
+                for field in indexes:
+                    indexes[field] = Index()
+            self.locks = {}
+            self.sequences = {}
+        invalidate_caches()
+
+    def count(self, prefix):
+        """Number of objects of a Model"""
+        return len(self.table(prefix))
+
+    def capabilities(self, table):
+        """
+        The work the store can take over: 'query', 'sort' (the whole
+        table), 'sort_ids' (a list of ids), 'aggregate' and 'count'
+        (without walking the ids).
+        """
+        return set(['query', 'sort', 'sort_ids', 'aggregate', 'count'])
+
+    def indexed_fields(self, table):
+        """The fields with an index the store uses to filter and order"""
+        return set(self.indexes.get(table, ()))
+
+    def binary_values(self, table):
+        """True if values can be binary strings"""
+        return True
+
+    def native_types(self, table):
+        """True if values can be stored as numbers rather than strings"""
+        return True
+
+    def expires(self, table):
+        """True if the objects can be given a time to live"""
+        return True
+
+    def construct(self, table, codec=None, indices=None):
+        """Create the indexes of the indexed attributes of a Model"""
+        with self.lock:
+            indexes = self.indexes.setdefault(table, {})
+            objects = self.table(table)
+            for field in indices or ():
+                if field in indexes:
+                    continue
+                index = indexes[field] = Index()
+                for id, hash in objects.iteritems():
+                    if field in hash:
+                        index.add(id, hash[field])
+
+instrument.register_store(MemoryStore)
+
+def setup(**kwargs):
+    return MemoryStore(**kwargs)
@@ -0,0 +1,445 @@
+import time
+from datetime import datetime, timedelta
+import pymongo
+from pymongo.errors import DuplicateKeyError
+from modelplus.models.base import invalidate_caches
+from modelplus.models.exceptions import ConflictError
+from modelplus.store import instrument
+
+# Hidden field of the time an object expires at, under a TTL index
+EXPIRES_FIELD = '_expires_at'
+# Hidden field of the length of the id, to order the ids by length then
+# characters like ids.id_sort_key, so that '10' comes after '9'
+ID_LENGTH_FIELD = '_id_len'
+# The hidden fields left out of the objects read
+HIDDEN = {EXPIRES_FIELD: False, ID_LENGTH_FIELD: False}
+# Orders by id
+ID_ORDER = [(ID_LENGTH_FIELD, 1), ('_id', 1)]
+
+
+def _live(selector=None):
+    """
+    selector restricted to the objects which didn't expire, the TTL
+    monitor of the server only deletes them once a minute.
+    """
+    selector = dict(selector or {})
+    selector['$or'] = [{EXPIRES_FIELD: None}, {EXPIRES_FIELD: {'$gt': datetime.utcnow()}}]
+    return selector
+
+class Transaction(object):
+    """
+    Collects the writes and sends them as a single bulk_write.  The writes
+    to the same object are merged into one operation, so a version check
+    applies to all of them.
+    """
+    def __init__(self, store):
+        self.store = store
+        self.reset()
+
+    def reset(self):
+        # key -> [deleted, {field: value} to set, set of fields to unset]
+        self.writes = {}
+        self.order = []
+        # key -> (name, version)
+        self.guards = {}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, type, value, traceback):
+        return
+
+    def _write(self, key):
+        if key not in self.writes:
+            self.writes[key] = [False, {}, set()]
+            self.order.append(key)
+        return self.writes[key]
+
+    def delete(self, key):
+        self.writes[key] = [True, {}, set()]
+        if key not in self.order:
+            self.order.append(key)
+
+    def hmset(self, key, hash):
+        write = self._write(key)
+        write[1].update(hash)
+        write[2].difference_update(hash)
+
+    def hdel(self, key, *names):
+        write = self._write(key)
+        for name in names:
+            write[1].pop(name, None)
+        write[2].update(names)
+
+    def check_version(self, key, name, version):
+        """Only execute if the stored version of key is still version"""
+        self.guards[key] = {name: version}
+
+    def check_exists(self, key):
+        """Only execute if key still exists and didn't expire"""
+        self.guards[key] = {}
+
+    def check_fields(self, key, fields):
+        """Only execute if the stored fields of key still have these values"""
+        self.guards[key] = dict(fields)
+
+    def expire(self, key, expires_at):
+        write = self._write(key)
+        write[1][EXPIRES_FIELD] = expires_at
+        write[2].discard(EXPIRES_FIELD)
+
+    def execute(self):
+        try:
+            # collection -> [operations]
+            batches = {}
+            guarded = []
+            for key in self.order:
+                deleted, values, removed = self.writes[key]
+                table, id = key.split(':', 1)
+                selector = {'_id': id}
+                if key in self.guards:
+                    selector.update(self.guards[key])
+                    selector = _live(selector)
+                if deleted and not values:
+                    operation = pymongo.DeleteOne(selector)
+                elif deleted:
+                    values[ID_LENGTH_FIELD] = len(id)
+                    operation = pymongo.ReplaceOne(selector, values, upsert=key not in self.guards)
+                else:
+                    if not values and not removed:
+                        continue
+                    values[ID_LENGTH_FIELD] = len(id)
+                    update = {'$set': values}
+                    if removed:
+                        update['$unset'] = dict((name, '') for name in removed)
+                    operation = pymongo.UpdateOne(selector, update, upsert=key not in self.guards)
+                if key in self.guards:
+                    guarded.append((table, operation))
+                else:
+                    batches.setdefault(table, []).append(operation)
+            # Versioned writes go one by one to tell which one conflicted
+            for table, operation in guarded:
+                result = self.store.collection(table).bulk_write([operation])
+                if not result.matched_count:
+                    raise ConflictError("Object was modified since it was loaded")
+            for table, operations in batches.iteritems():
+                self.store.collection(table).bulk_write(operations, ordered=False)
+        finally:
+            self.reset()
+
+class MongoStore(object):
+    def __init__(self, host='localhost', port=27017, db='modelplus', client=None):
+        # client: an existing client object, such as a mongomock one
+        self.client = client or pymongo.MongoClient(host, port)
+        self.db = self.client[db]
+        self.inited = set()
+
+    def collection(self, table):
+        return self.db[table]
+
+    def _split(self, key):
+        table, id = key.split(':', 1)
+        return self.db[table], id
+
+    def get_all(self, prefix):
+        """Get all of the keys for a Model"""
+        return [doc['_id'] for doc in self.db[prefix].find(_live(), {'_id': 1})]
+
+    def iter_ids(self, prefix, chunk_size=1000):
+        """Get all of the keys for a Model, chunk_size at a time"""
+        chunk = []
+        for doc in self.db[prefix].find(_live(), {'_id': 1}).batch_size(chunk_size):
+            chunk.append(doc['_id'])
+            if len(chunk) >= chunk_size:
+                yield chunk
+                chunk = []
+        if chunk:
+            yield chunk
+
+    def scan_ids(self, prefix, cursor=None, count=1000):
+        """
+        Get up to count ids of a Model from cursor on, and the cursor to
+        continue from, None once every id was returned.
+        """
+        conditions = {} if cursor is None else {'_id': {'$gt': cursor}}
+        # The expired objects count toward count, so that the next
+        # cursor is right whatever expires in between
+        now = datetime.utcnow()
+        docs = list(self.db[prefix].find(conditions, {'_id': 1, EXPIRES_FIELD: 1})
+                    .sort('_id', 1).limit(count))
+        ids = [doc['_id'] for doc in docs if doc.get(EXPIRES_FIELD) is None or doc[EXPIRES_FIELD] > now]
+        return (docs[-1]['_id'] if len(docs) == count else None), ids
+
+    def exists(self, key):
+        """True if object exists"""
+        collection, id = self._split(key)
+        return collection.find_one(_live({'_id': id}), {'_id': 1}) is not None
+
+    def hgetall(self, key):
+        """Get all of the values for a key"""
+        collection, id = self._split(key)
+        doc = collection.find_one(_live({'_id': id}), HIDDEN)
+        if doc is not None:
+            del doc['_id']
+        return doc
+
+    def hgetall_many(self, keys):
+        """Get all of the values for a list of keys, None for missing keys"""
+        found = {}
+        tables = {}
+        for key in keys:
+            table, id = key.split(':', 1)
+            tables.setdefault(table, []).append(id)
+        for table, ids in tables.iteritems():
+            for doc in self.db[table].find(_live({'_id': {'$in': ids}}), HIDDEN):
+                found["%s:%s" % (table, doc.pop('_id'))] = doc
+        return [found.get(key) for key in keys]
+
+    def hmget_many(self, keys, names):
+        """Get the values of names for a list of keys"""
+        found = {}
+        tables = {}
+        for key in keys:
+            table, id = key.split(':', 1)
+            tables.setdefault(table, []).append(id)
+        projection = dict((name, 1) for name in names)
+        for table, ids in tables.iteritems():
+            for doc in self.db[table].find(_live({'_id': {'$in': ids}}), projection):
+                found["%s:%s" % (table, doc['_id'])] = [doc.get(name) for name in names]
+        return [found.get(key, [None] * len(names)) for key in keys]
+
+    def sort(self, prefix, ids, field, desc=False, alpha=True, start=None, num=None):
+        """Get the keys for a Model ordered by field"""
+        selector = {} if ids is None else {'_id': {'$in': list(ids)}}
+        cursor = self.db[prefix].find(_live(selector), {'_id': 1})
+        cursor = self._page(cursor.sort([(field, -1 if desc else 1)] + ID_ORDER), start, num)
+        return [doc['_id'] for doc in cursor]
+
+    def query(self, prefix, filters, exclusions, order=None, desc=False, alpha=True,
+              start=None, num=None):
+        """
+        Get the (id, hash) of the objects matching filters and not
+        exclusions, mappings of field to stored value, ordered by order
+        (by id if None) and paged, with a single find.
+        """
+        keys = list(ID_ORDER)
+        if order:
+            keys.insert(0, (order, -1 if desc else 1))
+        cursor = self._page(self.db[prefix].find(_live(self._selector(filters, exclusions)),
+                                                 HIDDEN).sort(keys), start, num)
+        rows = []
+        for doc in cursor:
+            rows.append((doc.pop('_id'), doc))
+        return rows
+
+    def aggregate(self, prefix, ids, group, aggregates, filters=None, exclusions=None):
+        """
+        Compute aggregates, a list of (function, field, numeric), of the
+        objects matching filters and not exclusions, mappings of field to
+        stored value, grouped by the value of group.
+
+        Returns a list of (group value, [aggregate values]), None if it
+        can't be done here.
+        """
+        selector = self._selector(filters or {}, exclusions or {})
+        if ids is not None:
+            selector['_id'] = {'$in': list(ids)}
+        accumulators = {'_id': '$%s' % group if group else None}
+        for i, (function, field, numeric) in enumerate(aggregates):
+            if function not in ('count', 'sum', 'avg', 'min', 'max'):
+                return None
+            if function in ('sum', 'avg') and not numeric:
+                return None
+            if field is None:
+                accumulators['a%d' % i] = {'$sum': 1}
+                continue
+            # number of values, $sum gives 0 rather than None without any
+            accumulators['n%d' % i] = {'$sum': {'$cond': [{'$gt': ['$%s' % field, None]}, 1, 0]}}
+            if function != 'count':
+                accumulators['a%d' % i] = {'$%s' % function: '$%s' % field}
+        rows = []
+        for doc in self.db[prefix].aggregate([{'$match': _live(selector)}, {'$group': accumulators}]):
+            values = []
+            for i, (function, field, numeric) in enumerate(aggregates):
+                if field is None:
+                    values.append(doc['a%d' % i])
+                elif function == 'count':
+                    values.append(doc['n%d' % i])
+                else:
+                    values.append(doc['a%d' % i] if doc['n%d' % i] else None)
+            rows.append((doc['_id'], values))
+        return rows
+
+    def _selector(self, filters, exclusions):
+        selector = dict(filters)
+        if exclusions:
+            selector['$nor'] = [dict(exclusions)]
+        return selector
+
+    def _page(self, cursor, start, num):
+        if start:
+            cursor = cursor.skip(start)
+        if num is not None:
+            cursor = cursor.limit(num)
+        return cursor
+
+    def pipeline(self):
+        return Transaction(self)
+
+    def check_version(self, pipeline, key, name, version):
+        """Make the pipeline fail with a ConflictError if the version of key changes"""
+        pipeline.check_version(key, name, version)
+        return True
+
+    def check_exists(self, pipeline, key):
+        """
+        Make the pipeline fail with a ConflictError if key is deleted or
+        expires, False if it already was.
+        """
+        if not self.exists(key):
+            return False
+        pipeline.check_exists(key)
+        return True
+
+    def check_fields(self, pipeline, key, fields):
+        """Make the pipeline fail with a ConflictError if one of the fields of key changes"""
+        pipeline.check_fields(key, fields)
+        return True
+
+    def index_text(self, pipeline, key, tokens):
+        """There is no full-text index, the search is done on the objects"""
+        return None
+
+    def search(self, prefix, terms):
+        """There is no full-text index, the search is done on the objects"""
+        return None
+
+    def expire(self, pipeline, key, seconds):
+        """
+        Make key expire seconds from now, the TTL monitor of the server
+        deletes it within a minute of that.
+        """
+        table, id = key.split(':', 1)
+        if (table, EXPIRES_FIELD) not in self.inited:
+            self.inited.add((table, EXPIRES_FIELD))
+            self.db[table].create_index(EXPIRES_FIELD, expireAfterSeconds=0, background=True)
+        pipeline.expire(key, datetime.utcnow() + timedelta(seconds=seconds))
+        return True
+
+    def sweep(self, prefix, count=1000):
+        """
+        Delete up to count of the expired objects of a Model the TTL
+        monitor didn't get to yet, and return their number.
+        """
+        expired = {EXPIRES_FIELD: {'$lte': datetime.utcnow()}}
+        ids = [doc['_id'] for doc in self.db[prefix].find(expired, {'_id': 1}).limit(count)]
+        if not ids:
+            return 0
+        expired['_id'] = {'$in': ids}
+        return self.db[prefix].delete_many(expired).deleted_count
+
+    def counter_get(self, key, name):
+        """Used by counters to get the current value"""
+        collection, id = self._split(key)
+        doc = collection.find_one(_live({'_id': id}), {name: 1})
+        if doc is not None:
+            return doc.get(name, 0)
+        return None
+
+    def incr_by(self, key, name, val):
+        """Increment a counter by a set amount"""
+        collection, id = self._split(key)
+        doc = collection.find_one_and_update({'_id': id}, {'$inc': {name: val}},
+                                             return_document=pymongo.ReturnDocument.AFTER)
+        if doc is not None:
+            return doc[name]
+
+    def acquire_lock(self, name, token, ttl):
+        """Take the lock for ttl milliseconds, False if someone holds it"""
+        now = time.time()
+        locks = self.db['_locks']
+        locks.delete_one({'_id': name, 'expires': {'$lt': now}})
+        try:
+            locks.insert_one({'_id': name, 'token': token, 'expires': now + ttl / 1000.0})
+        except DuplicateKeyError:
+            return False
+        return True
+
+    def release_lock(self, name, token):
+        """Release the lock if token still holds it"""
+        return self.db['_locks'].delete_one({'_id': name, 'token': token}).deleted_count == 1
+
+    def next_id(self, table):
+        """Get the next number of the id sequence of table"""
+        doc = self.db['_sequences'].find_one_and_update({'_id': table}, {'$inc': {'value': 1}},
+                                                        upsert=True,
+                                                        return_document=pymongo.ReturnDocument.AFTER)
+        return doc['value']
+
+    def flushdb(self):
+        """Drop all of the collections"""
+        for name in self.db.list_collection_names():
+            self.db.drop_collection(name)
+        self.inited = set()
+        invalidate_caches()
+
+    def count(self, prefix):
+        """Number of objects of a Model"""
+        return self.db[prefix].count_documents(_live())
+
+    def capabilities(self, table):
+        """
+        The work the store can take over: 'query', 'sort' (the whole
+        table), 'sort_ids' (a list of ids), 'aggregate' and 'count'
+        (without walking the ids).
+        """
+        return set(['query', 'sort', 'sort_ids', 'aggregate', 'count'])
+
+    def indexed_fields(self, table):
+        """The fields with an index the store uses to filter and order"""
+        fields = set()
+        for info in self.db[table].index_information().itervalues():
+            fields.add(info['key'][0][0])
+        fields.discard('_id')
+        fields.discard(EXPIRES_FIELD)
+        fields.discard(ID_LENGTH_FIELD)
+        return fields
+
+    def binary_values(self, table):
+        """True if values can be binary strings"""
+        return False
+
+    def native_types(self, table):
+        """True if values can be stored as numbers rather than strings"""
+        return True
+
+    def expires(self, table):
+        """True if the objects can be given a time to live"""
+        return True
+
+    def construct(self, table, codec=None, indices=None):
+        """
+        Create the indexes of the indexed attributes of a Model, and give
+        the objects written before the ids were ordered by length theirs.
+        """
+        if table in self.inited:
+            return
+        self.inited.add(table)
+        collection = self.db[table]
+        collection.create_index(ID_ORDER, background=True)
+        for field in indices or ():
+            collection.create_index(field, background=True)
+        operations = []
+        for doc in collection.find({ID_LENGTH_FIELD: None}, {'_id': 1}):
+            operations.append(pymongo.UpdateOne({'_id': doc['_id']},
+                                                {'$set': {ID_LENGTH_FIELD: len(doc['_id'])}}))
+            if len(operations) >= 1000:
+                collection.bulk_write(operations, ordered=False)
+                operations = []
+        if operations:
+            collection.bulk_write(operations, ordered=False)
+
+instrument.register_store(MongoStore)
+
+def setup(**kwargs):
+    return MongoStore(**kwargs)
@@ -0,0 +1,90 @@
+"""
+The MySQL store, the SQL store over mysqlclient (MySQLdb) or PyMySQL.
+Filters, ordering and aggregates run on the JSON functions of MySQL 5.7
+and later.
+"""
+try:
+    import MySQLdb as driver
+    from MySQLdb.constants import CLIENT
+    from MySQLdb.cursors import SSCursor
+except ImportError:
+    import pymysql as driver
+    from pymysql.constants import CLIENT
+    from pymysql.cursors import SSCursor
+from modelplus.store import instrument
+from modelplus.store.sql import Dialect, SqlStore
+
+class MysqlDialect(Dialect):
+    name = 'mysql'
+    param = '%s'
+    equals = '<=>'
+    length = 'CHAR_LENGTH'
+    insert_or_replace = 'REPLACE'
+    insert_or_ignore = 'INSERT IGNORE'
+    # Autocommit is on, the writes of a pipeline are one transaction
+    begin = 'START TRANSACTION'
+    list_tables = 'SHOW TABLES'
+    # Binary collation compares and orders ids and values like Python
+    key_type = 'VARCHAR(191) CHARACTER SET utf8mb4 COLLATE utf8mb4_bin'
+    text_type = 'LONGTEXT CHARACTER SET utf8mb4 COLLATE utf8mb4_bin'
+    binary_type = 'LONGBLOB'
+    real_type = 'DOUBLE'
+    integer_type = 'BIGINT'
+
+    def quote(self, name):
+        return '`%s`' % name.replace('`', '``')
+
+    def extract(self):
+        return "JSON_UNQUOTE(JSON_EXTRACT(%s, %%s))" % self.blob
+
+    def numeric(self, expr):
+        # CAST AS DOUBLE needs MySQL 8.0.17, adding a double converts too
+        return "(%s + 0e0)" % expr
+
+    def upsert_merge(self, table):
+        return ("INSERT INTO %s (id, %s) VALUES (%%s, %%s) "
+                "ON DUPLICATE KEY UPDATE %s = JSON_MERGE_PATCH(%s, VALUES(%s))"
+                % (self.quote(table), self.blob, self.blob, self.blob, self.blob))
+
+    def create_table(self, table, binary=False):
+        # No IF NOT EXISTS for indexes, expires_at is indexed here
+        return ("CREATE TABLE IF NOT EXISTS %s (id %s PRIMARY KEY, %s %s, expires_at %s, "
+                "INDEX (expires_at))" % (self.quote(table), self.key_type, self.blob,
+                                         self.binary_type if binary else self.text_type,
+                                         self.real_type))
+
+    def create_expiry_index(self, table):
+        return None
+
+    def add_expiry(self, table):
+        return "ALTER TABLE %s ADD COLUMN expires_at %s, ADD INDEX (expires_at)" % (
+            self.quote(table), self.real_type)
+
+    def remove(self, table, n):
+        return "UPDATE %s SET %s = JSON_REMOVE(%s, %s) WHERE id = %%s" % (
+            self.quote(table), self.blob, self.blob, self.params(n))
+
+class MysqlStore(SqlStore):
+    def __init__(self, host='localhost', port=3306, db='modelplus', user='root', passwd='',
+                 codec='json', connection=None):
+        # connection: an existing DB-API connection, opened with the
+        # FOUND_ROWS flag so version checks see the rows they match
+        self.params = dict(host=host, port=port, db=db, user=user, passwd=passwd,
+                           charset='utf8mb4', autocommit=True, client_flag=CLIENT.FOUND_ROWS)
+        SqlStore.__init__(self, connection or self.connect(), MysqlDialect(), codec)
+
+    def connect(self):
+        return driver.connect(**self.params)
+
+    def streaming_cursor(self):
+        """
+        A server side cursor, on a connection of its own as the rows have
+        to be read before anything else runs on a MySQL connection.
+        """
+        connection = self.connect()
+        return connection, connection.cursor(SSCursor)
+
+instrument.register_store(MysqlStore)
+
+def setup(**kwargs):
+    return MysqlStore(**kwargs)
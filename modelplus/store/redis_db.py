@@ -1,15 +1,238 @@
+import time
 import redis
+from uuid import uuid4
+from modelplus.models.base import invalidate_caches
+from modelplus.store import instrument
 
 client = None
 
+# The positions in KEYS of the objects matching the filters and not the
+# exclusions, each followed by its value of the field to order by (nil
+# without one).  ARGV are: the number of filters followed by the field,
+# value pairs, the same for the exclusions, and the field to order by
+# ('' for none).
+QUERY = """
+local i = 1
+local function conditions()
+    local n = tonumber(ARGV[i])
+    local t = {}
+    for j = 1, n do t[j] = {ARGV[i + 2 * j - 1], ARGV[i + 2 * j]} end
+    i = i + 2 * n + 1
+    return t
+end
+local filters = conditions()
+local exclusions = conditions()
+local order = ARGV[i]
+
+local function matches(key, conds)
+    for _, c in ipairs(conds) do
+        if redis.call('hget', key, c[1]) ~= c[2] then return false end
+    end
+    return true
+end
+
+local out = {}
+for k, key in ipairs(KEYS) do
+    if redis.call('type', key).ok == 'hash' and matches(key, filters) and
+            (#exclusions == 0 or not matches(key, exclusions)) then
+        table.insert(out, k)
+        table.insert(out, order ~= '' and redis.call('hget', key, order) or false)
+    end
+end
+return out
+"""
+
+# Count, sum, min and max of numeric fields of KEYS grouped by the value
+# of ARGV[1] ('' for no grouping), ARGV[2..] are the fields ('' counts
+# the objects).  Groups are returned as 'n' (no value) or 'v' .. value
+# followed by the four values for each field.
+AGGREGATE = """
+local group = ARGV[1]
+local n = #ARGV - 1
+local groups, order = {}, {}
+for _, key in ipairs(KEYS) do
+    if redis.call('exists', key) == 1 then
+        local g = 'n'
+        if group ~= '' then
+            local v = redis.call('hget', key, group)
+            if v then g = 'v' .. v end
+        end
+        local state = groups[g]
+        if not state then
+            state = {}
+            for i = 1, n do state[i] = {0, 0, false, false} end
+            groups[g] = state
+            table.insert(order, g)
+        end
+        for i = 1, n do
+            local s = state[i]
+            if ARGV[i + 1] == '' then
+                s[1] = s[1] + 1
+            else
+                local v = tonumber(redis.call('hget', key, ARGV[i + 1]))
+                if v then
+                    s[1] = s[1] + 1
+                    s[2] = s[2] + v
+                    if not s[3] or v < s[3] then s[3] = v end
+                    if not s[4] or v > s[4] then s[4] = v end
+                end
+            end
+        end
+    end
+end
+local out = {}
+for _, g in ipairs(order) do
+    table.insert(out, g)
+    for i = 1, n do
+        local s = groups[g][i]
+        table.insert(out, tostring(s[1]))
+        table.insert(out, string.format('%.17g', s[2]))
+        table.insert(out, s[3] and string.format('%.17g', s[3]) or '')
+        table.insert(out, s[4] and string.format('%.17g', s[4]) or '')
+    end
+end
+return out
+"""
+
+# Replaces the words of the object ARGV[1] in the full-text index, whose
+# sorted sets score the objects by the number of times the word appears in
+# them.  KEYS[1] is the set of the words of the object, KEYS[2] the set of
+# the objects in the index, KEYS[3..ARGV[2] + 2] the sorted sets of its words
+# ARGV[3..ARGV[2] + 2] read before, and the remaining KEYS those of the
+# word, count pairs of the remaining ARGV, none to drop the object.
+INDEX_TEXT = """
+local id, old = ARGV[1], tonumber(ARGV[2])
+for i = 1, old do
+    redis.call('zrem', KEYS[i + 2], id)
+    redis.call('srem', KEYS[1], ARGV[i + 2])
+end
+local k = old + 3
+for i = old + 3, #ARGV, 2 do
+    redis.call('zadd', KEYS[k], ARGV[i + 1], id)
+    redis.call('sadd', KEYS[1], ARGV[i])
+    k = k + 1
+end
+if k > old + 3 then
+    redis.call('sadd', KEYS[2], id)
+else
+    redis.call('srem', KEYS[2], id)
+end
+return 1
+"""
+
+# The objects in all of the word sets KEYS[2..] with their score, the
+# counts weighted by how rare each word is out of the objects in the set
+# KEYS[1] of those in the index, walking the smallest of the sets.  An
+# index written before KEYS[1] was kept counts at least the largest set.
+SEARCH = """
+local total, sizes = redis.call('scard', KEYS[1]), {}
+for i = 2, #KEYS do
+    sizes[i] = redis.call('zcard', KEYS[i])
+    if sizes[i] == 0 then return {} end
+    total = math.max(total, sizes[i])
+end
+local weights, smallest = {}, 2
+for i = 2, #KEYS do
+    weights[i] = math.log(1 + total / sizes[i])
+    if sizes[i] < sizes[smallest] then smallest = i end
+end
+local out = {}
+for _, id in ipairs(redis.call('zrange', KEYS[smallest], 0, -1)) do
+    local score = 0
+    for i = 2, #KEYS do
+        local n = redis.call('zscore', KEYS[i], id)
+        if not n then
+            score = nil
+            break
+        end
+        score = score + weights[i] * tonumber(n)
+    end
+    if score then
+        table.insert(out, id)
+        table.insert(out, string.format('%.17g', score))
+    end
+end
+return out
+"""
+
+# Makes the object KEYS[1] expire in ARGV[1] milliseconds.  If it is in the
+# full-text index (its set of words KEYS[2] exists), its id ARGV[3] goes to
+# the sorted set KEYS[3] by the time ARGV[2] it expires at, for the sweeps
+# to drop it from the word sets, whose members can't expire.
+EXPIRE = """
+redis.call('pexpire', KEYS[1], ARGV[1])
+if redis.call('exists', KEYS[2]) == 1 then
+    redis.call('zadd', KEYS[3], ARGV[2], ARGV[3])
+end
+return 1
+"""
+
+# Drops the object ARGV[1] from the full-text index once it expired: takes
+# it out of the sorted set of the expiring objects KEYS[1] and, unless its
+# key KEYS[2] was saved again, out of the set of the objects in the index
+# KEYS[4] and the sorted sets KEYS[5..] of its words ARGV[2..], read from
+# its set of words KEYS[3] before.  Returns 1 if it was dropped.
+SWEEP = """
+local id = ARGV[1]
+redis.call('zrem', KEYS[1], id)
+if redis.call('exists', KEYS[2]) == 1 then
+    return 0
+end
+redis.call('srem', KEYS[4], id)
+for i = 5, #KEYS do
+    redis.call('zrem', KEYS[i], id)
+    redis.call('srem', KEYS[3], ARGV[i - 3])
+end
+if redis.call('scard', KEYS[3]) == 0 then
+    redis.call('del', KEYS[3])
+end
+return 1
+"""
+
+# Only delete the lock if we still hold it
+RELEASE_LOCK = """
+if redis.call('get', KEYS[1]) == ARGV[1] then
+    return redis.call('del', KEYS[1])
+end
+return 0
+"""
+
+def _words(key):
+    """The set of the words of the object key in the full-text index"""
+    return '_search:%s:_words:%s' % tuple(key.split(':', 1))
+
 class RedisStore(object):
-    def __init__(self, host='localhost', port=6379, db=1):
-        self.client = redis.StrictRedis(host='localhost', port=6379, db=0)
+    def __init__(self, host='localhost', port=6379, db=1, client=None):
+        # client: an existing client object, such as a fakeredis one
+        self.client = client or redis.StrictRedis(host='localhost', port=6379, db=0)
+        self._release_lock = self.client.register_script(RELEASE_LOCK)
+        self._aggregate = self.client.register_script(AGGREGATE)
+        self._query = self.client.register_script(QUERY)
+        self._search = self.client.register_script(SEARCH)
 
     def get_all(self, prefix):
         """Get all of the keys for a Model"""
         return [k[len(prefix)+1:] for k in self.client.keys("%s:*" % prefix)]
 
+    def iter_ids(self, prefix, chunk_size=1000):
+        """Get all of the keys for a Model, chunk_size at a time"""
+        chunk = []
+        for k in self.client.scan_iter(match="%s:*" % prefix, count=chunk_size):
+            chunk.append(k[len(prefix)+1:])
+            if len(chunk) >= chunk_size:
+                yield chunk
+                chunk = []
+        if chunk:
+            yield chunk
+
+    def scan_ids(self, prefix, cursor=None, count=1000):
+        """
+        Get up to count ids of a Model from cursor on, and the cursor to
+        continue from, None once every id was returned.
+        """
+        cursor, keys = self.client.scan(int(cursor or 0), match="%s:*" % prefix, count=count)
+        return (str(cursor) if int(cursor) else None), [k[len(prefix)+1:] for k in keys]
+
     def exists(self, id):
         """True if object exists"""
         return self.client.exists(id)
@@ -18,10 +241,240 @@ class RedisStore(object):
         """Get all of the values for a key"""
         return self.client.hgetall(key)
 
+    def hgetall_many(self, keys):
+        """Get all of the values for a list of keys, None for missing keys"""
+        pipe = self.client.pipeline(transaction=False)
+        for key in keys:
+            pipe.hgetall(key)
+        return [h or None for h in pipe.execute()]
+
+    def hmget_many(self, keys, names):
+        """Get the values of names for a list of keys"""
+        pipe = self.client.pipeline(transaction=False)
+        for key in keys:
+            pipe.hmget(key, names)
+        return pipe.execute()
+
+    def sort(self, prefix, ids, field, desc=False, alpha=True, start=None, num=None):
+        """Get the keys for a Model ordered by field, None if it can't be done here"""
+        if ids is None:
+            ids = self.get_all(prefix)
+        if not ids:
+            return []
+        # Kept out of the model prefix so get_all never sees it
+        tmp = "_sort:%s:%s" % (prefix, uuid4().hex)
+        pipe = self.client.pipeline()
+        pipe.sadd(tmp, *ids)
+        pipe.sort(tmp, by="%s:*->%s" % (prefix, field), start=start, num=num,
+                  desc=desc, alpha=alpha)
+        pipe.delete(tmp)
+        return pipe.execute()[1]
+
+    def query(self, prefix, filters, exclusions, order=None, desc=False, alpha=True,
+              start=None, num=None, chunk_size=1000):
+        """
+        Get the (id, hash) of the objects matching filters and not
+        exclusions, mappings of field to stored value, ordered by order
+        (by id if None) and paged.  The ids are enumerated with SCAN and
+        every chunk of objects is matched by a script given their keys,
+        then the page is fetched with a single pipeline.
+        """
+        args = []
+        for conditions in (filters, exclusions):
+            args.append(len(conditions))
+            for field, value in conditions.iteritems():
+                args.extend([field, value])
+        args.append(order or '')
+        found = []
+        for ids in self.iter_ids(prefix, chunk_size):
+            # the keys of the lists of the objects aren't objects
+            ids = [id for id in ids if ':' not in id]
+            if not ids:
+                continue
+            out = self._query(keys=["%s:%s" % (prefix, id) for id in ids], args=args)
+            for i in range(0, len(out), 2):
+                found.append((ids[int(out[i]) - 1], out[i + 1]))
+        # ids ordered by length then characters, missing values first like None
+        found.sort(key=lambda row: (len(row[0]), row[0]))
+        if order:
+            def value(row):
+                if alpha or row[1] is None:
+                    return row[1]
+                try:
+                    return float(row[1])
+                except ValueError:
+                    return None
+            # stable, equal values stay in the order of their ids
+            found.sort(key=value, reverse=desc)
+        start = start or 0
+        page = found[start:] if num is None else found[start:start + num]
+        hashes = self.hgetall_many(["%s:%s" % (prefix, id) for id, v in page])
+        return [(id, hash) for (id, v), hash in zip(page, hashes) if hash is not None]
+
+    def aggregate(self, prefix, ids, group, aggregates, filters=None, exclusions=None,
+                  chunk_size=1000):
+        """
+        Compute aggregates, a list of (function, field, numeric), of the
+        objects with ids grouped by the value of group.
+
+        Returns a list of (group value, [aggregate values]), None if it
+        can't be done here.
+        """
+        if filters or exclusions:
+            return None
+        for function, field, numeric in aggregates:
+            if function not in ('count', 'sum', 'avg', 'min', 'max'):
+                return None
+            if field is not None and not numeric:
+                return None
+        if ids is None:
+            ids = self.get_all(prefix)
+        fields = [field or '' for function, field, numeric in aggregates]
+        step = 1 + 4 * len(fields)
+
+        def lowest(a, b):
+            return b if a is None else a if b is None else min(a, b)
+
+        groups, order = {}, []
+        for i in range(0, len(ids), chunk_size):
+            keys = ["%s:%s" % (prefix, id) for id in ids[i:i + chunk_size]]
+            out = self._aggregate(keys=keys, args=[group or ''] + fields)
+            for j in range(0, len(out), step):
+                g = out[j]
+                if g not in groups:
+                    groups[g] = [[0, 0.0, None, None] for field in fields]
+                    order.append(g)
+                for k, state in enumerate(groups[g]):
+                    count, total, low, high = out[j + 1 + 4 * k:j + 5 + 4 * k]
+                    state[0] += int(count)
+                    state[1] += float(total)
+                    if low:
+                        state[2] = lowest(state[2], float(low))
+                        state[3] = max(state[3], float(high))
+
+        rows = []
+        for g in order:
+            values = []
+            for (function, field, numeric), (count, total, low, high) in zip(aggregates, groups[g]):
+                if function == 'count':
+                    values.append(count)
+                elif function == 'sum':
+                    values.append(total if count else None)
+                elif function == 'avg':
+                    values.append(total / count if count else None)
+                elif function == 'min':
+                    values.append(low)
+                else:
+                    values.append(high)
+            rows.append((None if g == 'n' else g[1:], values))
+        return rows
+
     def pipeline(self):
         """TODO - Transactions"""
         return self.client.pipeline()
 
+    def check_version(self, pipeline, key, name, version):
+        """
+        Make the pipeline fail with a WatchError if the version of key changes,
+        False if it already has.
+        """
+        pipeline.watch(key, _words(key))
+        if pipeline.hget(key, name) != version:
+            pipeline.reset()
+            return False
+        pipeline.multi()
+        return True
+
+    def check_exists(self, pipeline, key):
+        """
+        Make the pipeline fail with a WatchError if key is deleted or
+        expires, False if it already was.
+        """
+        pipeline.watch(key, _words(key))
+        exists = pipeline.exists(key)
+        pipeline.multi()
+        return bool(exists)
+
+    def check_fields(self, pipeline, key, fields):
+        """
+        Make the pipeline fail with a WatchError if key changes, False if
+        one of the fields already has.
+        """
+        pipeline.watch(key, _words(key))
+        names = list(fields)
+        if not pipeline.exists(key) or names and pipeline.hmget(key, names) != [fields[k] for k in names]:
+            pipeline.reset()
+            return False
+        pipeline.multi()
+        return True
+
+    def index_text(self, pipeline, key, tokens):
+        """
+        Replace the words of key in the full-text index with tokens, or
+        drop it from the index if None.
+        """
+        prefix, id = key.split(':', 1)
+        counts = {}
+        for token in tokens or ():
+            counts[token] = counts.get(token, 0) + 1
+        # Every key is passed to the script, so that it runs on Redis
+        # Cluster, the words of the object read first.  The check_* guards
+        # watch them, so that a save in between fails the pipeline.
+        words = _words(key)
+        old = sorted(self.client.smembers(words))
+        keys = [words, '_search:%s:_docs' % prefix]
+        keys.extend('_search:%s:%s' % (prefix, word) for word in old)
+        args = [id, len(old)] + old
+        for word, count in counts.iteritems():
+            keys.append('_search:%s:%s' % (prefix, word))
+            args.extend([word, count])
+        # Kept out of the model prefix so get_all never sees it.  EVAL
+        # rather than a registered script, which would cost the pipeline
+        # a SCRIPT EXISTS round trip.
+        pipeline.eval(INDEX_TEXT, len(keys), *(keys + args))
+        return True
+
+    def search(self, prefix, terms):
+        """The ids of the objects with all of the words terms, the most relevant first"""
+        keys = ['_search:%s:_docs' % prefix]
+        keys.extend('_search:%s:%s' % (prefix, term) for term in terms)
+        out = self._search(keys=keys)
+        scores = dict((out[i], float(out[i + 1])) for i in range(0, len(out), 2))
+        # Leave out the objects which expired since they were indexed
+        with self.client.pipeline(transaction=False) as pipeline:
+            for id in scores:
+                pipeline.exists('%s:%s' % (prefix, id))
+            live = set(id for id, exists in zip(scores, pipeline.execute()) if exists)
+        return sorted(live, key=lambda id: (-scores[id], id))
+
+    def expire(self, pipeline, key, seconds):
+        """Make key expire seconds after the pipeline is executed"""
+        prefix, id = key.split(':', 1)
+        # Kept out of the model prefix so get_all never sees it
+        pipeline.eval(EXPIRE, 3, key, _words(key), '_expires:%s' % prefix,
+                      int(seconds * 1000), time.time() + seconds, id)
+        return True
+
+    def sweep(self, prefix, count=1000):
+        """
+        Redis removes the expired objects itself, drop up to count of
+        them from the full-text index and return their number.
+        """
+        expiring = '_expires:%s' % prefix
+        ids = self.client.zrangebyscore(expiring, '-inf', time.time(), start=0, num=count)
+        with self.client.pipeline(transaction=False) as pipeline:
+            for id in ids:
+                pipeline.smembers('_search:%s:_words:%s' % (prefix, id))
+            words = pipeline.execute()
+        with self.client.pipeline(transaction=False) as pipeline:
+            for id, old in zip(ids, words):
+                old = sorted(old)
+                keys = [expiring, '%s:%s' % (prefix, id), '_search:%s:_words:%s' % (prefix, id),
+                        '_search:%s:_docs' % prefix]
+                keys.extend('_search:%s:%s' % (prefix, word) for word in old)
+                pipeline.eval(SWEEP, len(keys), *(keys + [id] + old))
+            return sum(pipeline.execute())
+
     def counter_get(self, key, name):
         """Used by counters to get the current value"""
         return self.client.hget(key, name)
@@ -30,11 +483,56 @@ class RedisStore(object):
         """Increment a counter by a set amount"""
         return self.client.hincrby(key, name, val)
 
+    def next_id(self, table):
+        """Get the next number of the id sequence of table"""
+        # Kept out of the model prefix so get_all never sees it
+        return self.client.incr("_sequence:%s" % table)
+
+    def acquire_lock(self, name, token, ttl):
+        """Take the lock for ttl milliseconds, False if someone holds it"""
+        return bool(self.client.set(name, token, nx=True, px=ttl))
+
+    def release_lock(self, name, token):
+        """Release the lock if token still holds it"""
+        return bool(self._release_lock(keys=[name], args=[token]))
+
     def flushdb(self):
         self.client.flushdb()
+        invalidate_caches()
+
+    def count(self, prefix):
+        """Number of objects of a Model"""
+        # SCAN rather than KEYS, which blocks the server on large databases
+        return sum(len(ids) for ids in self.iter_ids(prefix))
+
+    def capabilities(self, table):
+        """
+        The work the store can take over: 'query', 'sort' (the whole
+        table), 'sort_ids' (a list of ids), 'aggregate' and 'count'
+        (without walking the ids).
+        """
+        return set(['query', 'sort', 'sort_ids', 'aggregate'])
+
+    def binary_values(self, table):
+        """True if values can be binary strings"""
+        return True
 
-    def construct(self, table):
+    def native_types(self, table):
+        """True if values can be stored as numbers rather than strings"""
+        return False
+
+    def expires(self, table):
+        """True if the objects can be given a time to live"""
+        return True
+
+    def indexed_fields(self, table):
+        """The fields with an index the store uses to filter and order"""
+        return set()
+
+    def construct(self, table, codec=None, indices=None):
         pass
 
+instrument.register_store(RedisStore)
+
 def setup(**kwargs):
     return RedisStore(**kwargs)
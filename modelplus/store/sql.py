@@ -0,0 +1,714 @@
+"""
+The core of the SQL stores, which keep every object as a blob in a table
+of its model with ``id`` and ``blob`` columns, and the time the object
+expires at, if ever, in an indexed ``expires_at`` column.  The reads skip
+the expired objects, which ``sweep`` deletes.
+
+``SqlStore`` works over any DB-API connection and leaves what differs
+between the databases to a ``Dialect``: quoting, parameter markers, the
+JSON functions filters and ordering run on, upserts and column types.
+
+The text of a statement only depends on the table and the shape of the
+operation (the number of ids, filters...), never on the values, which
+are always parameters.  It is built once and kept in ``statements``, so
+the driver's statement cache (sqlite3's, or the server's) sees the very
+same text every time and skips parsing and planning it again.
+"""
+import time
+from modelplus.models.base import invalidate_caches
+from modelplus.models.exceptions import ConflictError
+from modelplus.store import codec
+
+def _path(field):
+    """The JSON path of a field of the blob"""
+    return "$.%s" % field
+
+def _padded(ids, size):
+    """
+    Pads a list of ids to size by repeating the last one, so "IN" lists
+    only come in a few lengths and their statements are reused.
+    """
+    return ids + ids[-1:] * (size - len(ids))
+
+def _bucket(n):
+    """The smallest power of two not below n"""
+    size = 1
+    while size < n:
+        size *= 2
+    return size
+
+class Dialect(object):
+    """
+    The SQL of a database.  The defaults are standard SQL, the JSON
+    functions, upserts and the listing of tables have to be given by
+    every database.
+    """
+    name = None
+    # DB-API parameter marker
+    param = '?'
+    # Equality which is also true when both sides are NULL
+    equals = 'IS NOT DISTINCT FROM'
+    # Length of a string in characters
+    length = 'length'
+    insert_or_replace = None
+    insert_or_ignore = None
+    # Started by the driver itself if None
+    begin = None
+    # Lists the names of the tables
+    list_tables = None
+    key_type = 'VARCHAR(255)'
+    text_type = 'TEXT'
+    binary_type = 'BLOB'
+    real_type = 'REAL'
+    integer_type = 'INTEGER'
+
+    def __init__(self):
+        self.blob = self.quote('blob')
+
+    def quote(self, name):
+        """Quotes a table or column name, model names can be SQL keywords"""
+        return '"%s"' % name.replace('"', '""')
+
+    def params(self, n):
+        return ", ".join([self.param] * n)
+
+    def extract(self):
+        """The value of the blob at the JSON path given as a parameter"""
+        raise NotImplementedError
+
+    def numeric(self, expr):
+        """expr as a number, to order and sum numeric fields"""
+        return "CAST(%s AS %s)" % (expr, self.real_type)
+
+    def upsert_merge(self, table):
+        """Inserts (id, blob), or merges the JSON blob into the stored one"""
+        raise NotImplementedError
+
+    def remove(self, table, n):
+        """Removes n JSON paths from the blob of (paths..., id)"""
+        raise NotImplementedError
+
+    def create_table(self, table, binary=False):
+        return "CREATE TABLE IF NOT EXISTS %s (id %s PRIMARY KEY, %s %s, expires_at %s)" % (
+            self.quote(table), self.key_type, self.blob,
+            self.binary_type if binary else self.text_type, self.real_type)
+
+    def create_expiry_index(self, table):
+        """Indexes expires_at, for the sweeps to find the expired objects"""
+        return "CREATE INDEX IF NOT EXISTS %s ON %s (expires_at)" % (
+            self.quote('_expires_%s' % table), self.quote(table))
+
+    def add_expiry(self, table):
+        """Adds expires_at to a table created without it"""
+        return "ALTER TABLE %s ADD COLUMN expires_at %s" % (self.quote(table), self.real_type)
+
+    def create_locks(self):
+        return "CREATE TABLE IF NOT EXISTS _locks (name %s PRIMARY KEY, token %s, expires %s)" % (
+            self.key_type, self.key_type, self.real_type)
+
+    def create_sequences(self):
+        return "CREATE TABLE IF NOT EXISTS _sequences (name %s PRIMARY KEY, value %s)" % (
+            self.key_type, self.integer_type)
+
+class Transaction(object):
+    def __init__(self, store):
+        self.store = store
+        self.stmts  = []
+        self.guards = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, type, value, traceback):
+        return
+
+    def delete(self, key):
+        table, id = key.split(':', 1)
+        self.store.construct(table)
+        self.stmts.append([self.store.statement(('delete', table), lambda d: (
+            "DELETE FROM %s WHERE id = %s" % (d.quote(table), d.param))), [id]])
+
+    def hmset(self, key, hash):
+        table, id = key.split(':', 1)
+        self.store.construct(table)
+        if not self.store.is_json(table):
+            self.stmts.append(lambda cursor: self._update(cursor, table, id, hash, ()))
+            return
+        self.stmts.append([self.store.statement(('hmset', table), lambda d: d.upsert_merge(table)),
+                           [id, codec.get_codec('json').encode(hash)]])
+
+    def hdel(self, key, *names):
+        table, id = key.split(':', 1)
+        self.store.construct(table)
+        if not self.store.is_json(table):
+            self.stmts.append(lambda cursor: self._update(cursor, table, id, {}, names))
+            return
+        self.stmts.append([self.store.statement(('hdel', table, len(names)),
+                                                lambda d: d.remove(table, len(names))),
+                           [_path(name) for name in names] + [id]])
+
+    def check_version(self, key, name, version):
+        """Only execute if the stored version of key is still version"""
+        table, id = key.split(':', 1)
+        self.store.construct(table)
+        if not self.store.is_json(table):
+            self.guards.append(lambda cursor: self._check_version(cursor, table, id, name, version))
+            return
+        self.guards.append([self.store.statement(('check_version', table), lambda d: (
+            "UPDATE %s SET id = id WHERE id = %s AND %s %s %s AND %s"
+            % (d.quote(table), d.param, d.extract(), d.equals, d.param, self.store._live(d)))),
+            [id, _path(name), version, time.time()]])
+
+    def check_exists(self, key):
+        """Only execute if key still exists and didn't expire"""
+        table, id = key.split(':', 1)
+        self.store.construct(table)
+        self.guards.append([self.store.statement(('check_exists', table), lambda d: (
+            "UPDATE %s SET id = id WHERE id = %s AND %s" % (d.quote(table), d.param, self.store._live(d)))),
+            [id, time.time()]])
+
+    def check_fields(self, key, fields):
+        """Only execute if the stored fields of key still have these values"""
+        table, id = key.split(':', 1)
+        self.store.construct(table)
+        self.guards.append(lambda cursor: self._check_fields(cursor, table, id, fields))
+
+    def _read(self, cursor, table, id):
+        """The blob and expiry of id, expired or not"""
+        cursor.execute(self.store.statement(('read', table), lambda d: (
+            "SELECT %s, expires_at FROM %s WHERE id = %s" % (d.blob, d.quote(table), d.param))), [id])
+        for row in cursor.fetchall():
+            return row
+        return None
+
+    def _update(self, cursor, table, id, hash, removed):
+        """Merge hash into a blob the SQL JSON functions can't handle"""
+        data, expires_at = {}, None
+        row = self._read(cursor, table, id)
+        if row is not None:
+            data, expires_at = codec.decode(row[0]), row[1]
+        data.update(hash)
+        for name in removed:
+            data.pop(name, None)
+        cursor.execute(self.store.statement(('replace', table), lambda d: (
+            "%s INTO %s (id, %s, expires_at) VALUES (%s)"
+            % (d.insert_or_replace, d.quote(table), d.blob, d.params(3)))),
+            [id, self.store.codec_for(table).encode(data), expires_at])
+
+    def _check_version(self, cursor, table, id, name, version):
+        return self._check_fields(cursor, table, id, {name: version})
+
+    def _check_fields(self, cursor, table, id, fields):
+        # Take the write lock before reading the fields
+        cursor.execute(self.store.statement(('lock', table), lambda d: (
+            "UPDATE %s SET id = id WHERE id = %s" % (d.quote(table), d.param))), [id])
+        row = self._read(cursor, table, id)
+        if row is None or (row[1] is not None and row[1] <= time.time()):
+            return False
+        hash = codec.decode(row[0])
+        return all(hash.get(name) == value for name, value in fields.iteritems())
+
+    def expire(self, key, expires_at):
+        table, id = key.split(':', 1)
+        self.store.construct(table)
+        self.stmts.append([self.store.statement(('expire', table), lambda d: (
+            "UPDATE %s SET expires_at = %s WHERE id = %s" % (d.quote(table), d.param, d.param))),
+            [expires_at, id]])
+
+    def execute(self):
+        cursor = self.store.cursor()
+        try:
+            self.store.begin(cursor)
+            # The guards take the write lock, so nobody can change the
+            # versions before the statements are committed.
+            for stmt in self.guards:
+                if callable(stmt):
+                    ok = stmt(cursor)
+                else:
+                    cursor.execute(*stmt)
+                    ok = cursor.rowcount == 1
+                if not ok:
+                    raise ConflictError("Object was modified since it was loaded")
+            # Runs of the same statement go to the server as one executemany
+            run = []
+            for stmt in self.stmts + [None]:
+                if run and (callable(stmt) or stmt is None or stmt[0] != run[0][0]):
+                    if len(run) == 1:
+                        cursor.execute(*run[0])
+                    else:
+                        cursor.executemany(run[0][0], [params for sql, params in run])
+                    run = []
+                if callable(stmt):
+                    stmt(cursor)
+                elif stmt is not None:
+                    run.append(stmt)
+        except:
+            self.store.connection.rollback()
+            raise
+        finally:
+            self.stmts = []
+            self.guards = []
+        self.store.connection.commit()
+
+class SqlStore(object):
+    # Longest "IN (?, ...)" list, below SQLITE_MAX_VARIABLE_NUMBER
+    max_variables = 512
+
+    def __init__(self, connection, dialect, codec='json'):
+        self.connection = connection
+        self.dialect = dialect
+        self.codec = codec
+        self.codecs = {}
+        self.inited = set()
+        # (operation, table, shape...) -> text of the statement
+        self.statements = {}
+        self._cursor = None
+
+    def statement(self, key, build):
+        """The text of the statement of key, build(dialect) makes it the first time"""
+        try:
+            return self.statements[key]
+        except KeyError:
+            text = self.statements[key] = build(self.dialect)
+            return text
+
+    def cursor(self):
+        """
+        The cursor shared by the statements whose rows are all read
+        before the next statement runs.
+        """
+        if self._cursor is None:
+            self._cursor = self.connection.cursor()
+        return self._cursor
+
+    def streaming_cursor(self):
+        """
+        A (connection, cursor) reading the rows of a large result as they
+        are fetched, which stays open while other statements run.
+        """
+        return self.connection, self.connection.cursor()
+
+    def begin(self, cursor):
+        if self.dialect.begin:
+            cursor.execute(self.dialect.begin)
+
+    def _execute(self, key, build, params=()):
+        cursor = self.cursor()
+        cursor.execute(self.statement(key, build), params)
+        return cursor
+
+    def _stream(self, key, build, params=(), chunk_size=1000):
+        """The rows of a statement, chunk_size at a time"""
+        connection, cursor = self.streaming_cursor()
+        try:
+            cursor.execute(self.statement(key, build), params)
+            while True:
+                rows = cursor.fetchmany(chunk_size)
+                if not rows:
+                    break
+                yield rows
+        finally:
+            cursor.close()
+            if connection is not self.connection:
+                connection.close()
+
+    def _live(self, d):
+        """The condition of the objects which didn't expire, the time is a parameter"""
+        return "(expires_at IS NULL OR expires_at > %s)" % d.param
+
+    def _chunks(self, keys):
+        """(table, ids) of keys, max_variables ids at a time"""
+        tables = {}
+        for key in keys:
+            table, id = key.split(':', 1)
+            tables.setdefault(table, []).append(id)
+        for table, ids in tables.iteritems():
+            for i in range(0, len(ids), self.max_variables):
+                yield table, ids[i:i + self.max_variables]
+
+    def _where(self, d, filters, exclusions):
+        """The WHERE clause of the objects which didn't expire, n filters and n exclusions"""
+        condition = "%s %s %s" % (d.extract(), d.equals, d.param)
+        where = [self._live(d)] + [condition] * filters
+        if exclusions:
+            where.append("NOT (%s)" % " AND ".join([condition] * exclusions))
+        return " WHERE " + " AND ".join(where)
+
+    def _conditions(self, filters, exclusions):
+        params = [time.time()]
+        for conditions in (filters or {}, exclusions or {}):
+            for field, value in conditions.iteritems():
+                params.extend([_path(field), value])
+        return params
+
+    def get_all(self, prefix):
+        """Get all of the keys for a Model"""
+        return [row[0] for row in self._execute(('get_all', prefix), lambda d: (
+            "SELECT id FROM %s WHERE %s" % (d.quote(prefix), self._live(d))), [time.time()]).fetchall()]
+
+    def iter_ids(self, prefix, chunk_size=1000):
+        """Get all of the keys for a Model, chunk_size at a time"""
+        for rows in self._stream(('get_all', prefix), lambda d: (
+                "SELECT id FROM %s WHERE %s" % (d.quote(prefix), self._live(d))), [time.time()],
+                chunk_size=chunk_size):
+            yield [row[0] for row in rows]
+
+    def scan_ids(self, prefix, cursor=None, count=1000):
+        """
+        Get up to count ids of a Model from cursor on, and the cursor to
+        continue from, None once every id was returned.
+        """
+        self.construct(prefix)
+        # The expired objects count toward count, so that the next
+        # cursor is right whatever expires in between
+        if cursor is None:
+            rows = self._execute(('scan_ids', prefix), lambda d: (
+                "SELECT id, %s FROM %s ORDER BY id LIMIT %s"
+                % (self._live(d), d.quote(prefix), d.param)), [time.time(), count])
+        else:
+            rows = self._execute(('scan_ids_after', prefix), lambda d: (
+                "SELECT id, %s FROM %s WHERE id > %s ORDER BY id LIMIT %s"
+                % (self._live(d), d.quote(prefix), d.param, d.param)), [time.time(), cursor, count])
+        rows = rows.fetchall()
+        ids = [row[0] for row in rows if row[1]]
+        return (rows[-1][0] if len(rows) == count else None), ids
+
+    def exists(self, key):
+        """True if object exists"""
+        table, id = key.split(':', 1)
+        return bool(self._execute(('exists', table), lambda d: (
+            "SELECT 1 FROM %s WHERE id = %s AND %s" % (d.quote(table), d.param, self._live(d))),
+            [id, time.time()]).fetchall())
+
+    def hgetall(self, key):
+        """Get all of the values for a key"""
+        table, id = key.split(':', 1)
+        for row in self._execute(('hgetall', table), lambda d: (
+                "SELECT %s FROM %s WHERE id = %s AND %s"
+                % (d.blob, d.quote(table), d.param, self._live(d))), [id, time.time()]).fetchall():
+            return codec.decode(row[0])
+        return None
+
+    def hgetall_many(self, keys):
+        """Get all of the values for a list of keys, None for missing keys"""
+        found = {}
+        for table, ids in self._chunks(keys):
+            size = _bucket(len(ids))
+            rows = self._execute(('hgetall_many', table, size), lambda d: (
+                "SELECT id, %s FROM %s WHERE id IN (%s) AND %s"
+                % (d.blob, d.quote(table), d.params(size), self._live(d))),
+                _padded(ids, size) + [time.time()]).fetchall()
+            for row in rows:
+                found["%s:%s" % (table, row[0])] = codec.decode(row[1])
+        return [found.get(key) for key in keys]
+
+    def hmget_many(self, keys, names):
+        """Get the values of names for a list of keys"""
+        found = {}
+        for table, ids in self._chunks(keys):
+            size = _bucket(len(ids))
+            json_blob = self.is_json(table)
+            if json_blob:
+                columns = lambda d: ", ".join([d.extract()] * len(names))
+                paths = [_path(name) for name in names]
+            else:
+                columns, paths = lambda d: d.blob, []
+            rows = self._execute(('hmget_many', table, size, len(paths)), lambda d: (
+                "SELECT id, %s FROM %s WHERE id IN (%s) AND %s"
+                % (columns(d), d.quote(table), d.params(size), self._live(d))),
+                paths + _padded(ids, size) + [time.time()]).fetchall()
+            for row in rows:
+                if json_blob:
+                    values = list(row[1:])
+                else:
+                    data = codec.decode(row[1])
+                    values = [data.get(name) for name in names]
+                found["%s:%s" % (table, row[0])] = values
+        return [found.get(key, [None] * len(names)) for key in keys]
+
+    def _order_by(self, d, order, desc, alpha):
+        sql = " ORDER BY "
+        if order:
+            expr = d.extract()
+            if not alpha:
+                expr = d.numeric(expr)
+            sql += "%s %s, " % (expr, "DESC" if desc else "ASC")
+        return sql + "%s(id), id" % d.length
+
+    def _limit(self, d, paged):
+        if not paged:
+            return ""
+        return " LIMIT %s OFFSET %s" % (d.param, d.param)
+
+    def sort(self, prefix, ids, field, desc=False, alpha=True, start=None, num=None):
+        """Get the keys for a Model ordered by field, None if it can't be done here"""
+        if ids is not None or not self.is_json(prefix):
+            return None
+        params = [time.time(), _path(field)]
+        if num is not None:
+            params.extend([num, start or 0])
+        rows = self._execute(('sort', prefix, desc, alpha, num is not None), lambda d: (
+            "SELECT id FROM %s WHERE %s" % (d.quote(prefix), self._live(d))
+            + self._order_by(d, field, desc, alpha)
+            + self._limit(d, num is not None)), params).fetchall()
+        return [row[0] for row in rows]
+
+    def query(self, prefix, filters, exclusions, order=None, desc=False, alpha=True,
+              start=None, num=None):
+        """
+        Get the (id, hash) of the objects matching filters and not
+        exclusions, mappings of field to stored value, ordered by order
+        (by id if None) and paged, None if it can't be done here.
+        """
+        if not self.is_json(prefix):
+            return None
+        params = self._conditions(filters, exclusions)
+        if order:
+            params.append(_path(order))
+        if num is not None:
+            params.extend([num, start or 0])
+        key = ('query', prefix, len(filters), len(exclusions), bool(order), desc, alpha, num is not None)
+        rows = self._execute(key, lambda d: (
+            "SELECT id, %s FROM %s" % (d.blob, d.quote(prefix))
+            + self._where(d, len(filters), len(exclusions))
+            + self._order_by(d, order, desc, alpha) + self._limit(d, num is not None)),
+            params).fetchall()
+        return [(row[0], codec.decode(row[1])) for row in rows]
+
+    def aggregate(self, prefix, ids, group, aggregates, filters=None, exclusions=None):
+        """
+        Compute aggregates, a list of (function, field, numeric), of the
+        objects matching filters and not exclusions, mappings of field to
+        stored value, grouped by the value of group.
+
+        Returns a list of (group value, [aggregate values]), None if it
+        can't be done here.
+        """
+        if ids is not None or not self.is_json(prefix):
+            return None
+        filters, exclusions = filters or {}, exclusions or {}
+        params = [_path(group)] if group else []
+        # (function, whole rows, numeric) of every column
+        shape = []
+        for function, field, numeric in aggregates:
+            shape.append((function, field is None, bool(numeric) and function != 'count'))
+            if field is not None:
+                params.append(_path(field))
+        params.extend(self._conditions(filters, exclusions))
+
+        def build(d):
+            columns = [d.extract() if group else "NULL"]
+            for function, rows, numeric in shape:
+                if rows:
+                    columns.append("COUNT(*)")
+                else:
+                    columns.append("%s(%s)" % (function.upper(),
+                                               d.numeric(d.extract()) if numeric else d.extract()))
+            sql = "SELECT %s FROM %s" % (", ".join(columns), d.quote(prefix))
+            sql += self._where(d, len(filters), len(exclusions))
+            if group:
+                sql += " GROUP BY 1"
+            return sql
+
+        key = ('aggregate', prefix, bool(group), tuple(shape), len(filters), len(exclusions))
+        return [(row[0], list(row[1:])) for row in self._execute(key, build, params).fetchall()]
+
+    def pipeline(self):
+        return Transaction(self)
+
+    def check_version(self, pipeline, key, name, version):
+        """Make the pipeline fail with a ConflictError if the version of key changes"""
+        pipeline.check_version(key, name, version)
+        return True
+
+    def check_exists(self, pipeline, key):
+        """
+        Make the pipeline fail with a ConflictError if key is deleted or
+        expires, False if it already was.
+        """
+        if not self.exists(key):
+            return False
+        pipeline.check_exists(key)
+        return True
+
+    def check_fields(self, pipeline, key, fields):
+        """Make the pipeline fail with a ConflictError if one of the fields of key changes"""
+        pipeline.check_fields(key, fields)
+        return True
+
+    def index_text(self, pipeline, key, tokens):
+        """There is no full-text index, the search is done on the objects"""
+        return None
+
+    def search(self, prefix, terms):
+        """There is no full-text index, the search is done on the objects"""
+        return None
+
+    def expire(self, pipeline, key, seconds):
+        """Make key expire seconds from now"""
+        pipeline.expire(key, time.time() + seconds)
+        return True
+
+    def sweep(self, prefix, count=1000):
+        """
+        Delete up to count of the expired objects of a Model, the
+        longest expired first, and return their number.
+        """
+        self.construct(prefix)
+        now = time.time()
+        ids = [row[0] for row in self._execute(('expired', prefix), lambda d: (
+            "SELECT id FROM %s WHERE expires_at <= %s ORDER BY expires_at LIMIT %s"
+            % (d.quote(prefix), d.param, d.param)), [now, count]).fetchall()]
+        if not ids:
+            return 0
+        with self.pipeline() as pipeline:
+            for id in ids:
+                # unless saved again since
+                pipeline.stmts.append([self.statement(('sweep', prefix), lambda d: (
+                    "DELETE FROM %s WHERE id = %s AND expires_at <= %s"
+                    % (d.quote(prefix), d.param, d.param))), [id, now]])
+            for id in ids:
+                self.index_text(pipeline, "%s:%s" % (prefix, id), None)
+            pipeline.execute()
+        return len(ids)
+
+    def counter_get(self, key, name):
+        """Used by counters to get the current value"""
+        data = self.hgetall(key)
+        if data:
+            return data.get(name, 0)
+        return None
+
+    def incr_by(self, key, name, val):
+        """Increment a counter by a set amount"""
+        data = self.hgetall(key)
+
+        if data:
+            data[name] = str(int(data.get(name, 0)) + val)
+
+            with self.pipeline() as pipeline:
+                pipeline.hmset(key, data)
+                pipeline.execute()
+
+    def acquire_lock(self, name, token, ttl):
+        """Take the lock for ttl milliseconds, False if someone holds it"""
+        self._construct_locks()
+        now = time.time()
+        try:
+            self._execute(('expire_lock',), lambda d: (
+                "DELETE FROM _locks WHERE name = %s AND expires < %s" % (d.param, d.param)), [name, now])
+            cursor = self._execute(('acquire_lock',), lambda d: (
+                "%s INTO _locks (name, token, expires) VALUES (%s)" % (d.insert_or_ignore, d.params(3))),
+                [name, token, now + ttl / 1000.0])
+            acquired = cursor.rowcount == 1
+        finally:
+            self.connection.commit()
+        return acquired
+
+    def release_lock(self, name, token):
+        """Release the lock if token still holds it"""
+        self._construct_locks()
+        try:
+            cursor = self._execute(('release_lock',), lambda d: (
+                "DELETE FROM _locks WHERE name = %s AND token = %s" % (d.param, d.param)), [name, token])
+            released = cursor.rowcount == 1
+        finally:
+            self.connection.commit()
+        return released
+
+    def next_id(self, table):
+        """Get the next number of the id sequence of table"""
+        self._construct_sequences()
+        try:
+            self._execute(('start_sequence',), lambda d: (
+                "%s INTO _sequences (name, value) VALUES (%s, 0)" % (d.insert_or_ignore, d.param)), [table])
+            self._execute(('next_id',), lambda d: (
+                "UPDATE _sequences SET value = value + 1 WHERE name = %s" % d.param), [table])
+            value = self._execute(('sequence',), lambda d: (
+                "SELECT value FROM _sequences WHERE name = %s" % d.param), [table]).fetchone()[0]
+        finally:
+            self.connection.commit()
+        return value
+
+    def _construct_sequences(self):
+        if '_sequences' in self.inited:
+            return
+        self.inited.add('_sequences')
+        self.cursor().execute(self.dialect.create_sequences())
+
+    def _construct_locks(self):
+        if '_locks' in self.inited:
+            return
+        self.inited.add('_locks')
+        self.cursor().execute(self.dialect.create_locks())
+
+    def flushdb(self):
+        """Delete all of the tables..."""
+        cursor = self.cursor()
+        cursor.execute(self.dialect.list_tables)
+        # Read the names first, dropping tables while reading the catalog skips some
+        for row in cursor.fetchall():
+            # IF EXISTS, dropping a full-text table drops the tables behind it
+            cursor.execute("DROP TABLE IF EXISTS %s" % self.dialect.quote(row[0]))
+        self.inited = set()
+        invalidate_caches()
+
+    def codec_for(self, table):
+        """The codec objects of table are written with"""
+        return codec.get_codec(self.codecs.get(table, self.codec))
+
+    def is_json(self, table):
+        """True if the SQL JSON functions can work on the blobs of table"""
+        return self.codec_for(table).name == 'json'
+
+    def count(self, prefix):
+        """Number of objects of a Model"""
+        self.construct(prefix)
+        return self._execute(('count', prefix), lambda d: (
+            "SELECT COUNT(*) FROM %s WHERE %s" % (d.quote(prefix), self._live(d))),
+            [time.time()]).fetchone()[0]
+
+    def capabilities(self, table):
+        """
+        The work the store can take over: 'query', 'sort' (the whole
+        table), 'sort_ids' (a list of ids), 'aggregate' and 'count'
+        (without walking the ids).
+        """
+        if not self.is_json(table):
+            return set(['count'])
+        return set(['query', 'sort', 'aggregate', 'count'])
+
+    def binary_values(self, table):
+        """True if values can be binary strings"""
+        return not self.is_json(table)
+
+    def native_types(self, table):
+        """True if values can be stored as numbers rather than strings"""
+        return self.codec_for(table).native
+
+    def expires(self, table):
+        """True if the objects can be given a time to live"""
+        return True
+
+    def indexed_fields(self, table):
+        """The fields with an index the store uses to filter and order"""
+        return set()
+
+    def construct(self, table, codec=None, indices=None):
+        """Insure that the table is created before we start operating on it"""
+        if codec:
+            self.codecs[table] = codec
+        if table in self.inited:
+            return
+        self.inited.add(table)
+        cursor = self.cursor()
+        cursor.execute(self.dialect.create_table(table, binary=not self.is_json(table)))
+        try:
+            cursor.execute("SELECT expires_at FROM %s WHERE 1 = 0" % self.dialect.quote(table))
+            cursor.fetchall()
+        except self.connection.DatabaseError:
+            # created by an earlier version
+            cursor.execute(self.dialect.add_expiry(table))
+        expiry_index = self.dialect.create_expiry_index(table)
+        if expiry_index:
+            cursor.execute(expiry_index)
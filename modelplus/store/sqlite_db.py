@@ -1,96 +1,84 @@
-import json
 import sqlite3
-
-class Transaction(object):
-    def __init__(self, store):
-        self.store = store
-        self.cursor = store.connection.cursor()
-        self.stmts  = []
-
-    def __enter__(self):
-        return self
-
-    def __exit__(self, type, value, traceback):
-        return
-
-    def delete(self, key):
-        table, id = key.split(':')
-        self.store.construct(table)
-        self.stmts.append(["DELETE FROM %s WHERE id = ?" % table, [id]])
-
-    def hmset(self, key, hash):
-        table, id = key.split(':')
-        self.store.construct(table)
-        self.stmts.append(["INSERT OR REPLACE INTO %s (id, blob) VALUES (?, ?)" % table, [id, json.dumps(hash)]])
-
-    def execute(self):
-        for stmt in self.stmts:
-            self.cursor.execute(*stmt)
-        self.stmts = []
-
-class SqliteStore(object):
-    inited = set()
-
-    def __init__(self, file=None):
-        self.connection = sqlite3.connect(file)
-
-    def get_all(self, prefix):
-        """Get all of the keys for a Model"""
-        #return self.connection.keys("%s*" % prefix)
-        cursor = self.connection.cursor()
-        return [row[0] for row in cursor.execute("SELECT id FROM %s" % prefix)]
-
-    def exists(self, key):
-        """True if object exists"""
-        table, id = key.split(':')
-        cursor = self.connection.cursor()
-        return bool([row[0] for row in cursor.execute("SELECT id FROM %s WHERE id = ?" % table, [id])])
-
-    def hgetall(self, key):
-        """Get all of the values for a key"""
-        table, id = key.split(':')
-        cursor = self.connection.cursor()
-        for row in cursor.execute("SELECT blob FROM %s WHERE id = ?" % table, [id]):
-            return json.loads(row[0])
-        return None
-
-    def pipeline(self):
-        """TODO - Transactions"""
-        return Transaction(self)
-
-    def counter_get(self, key, name):
-        """Used by counters to get the current value"""
-        data = self.hgetall(key)
-        if data:
-            return data.get(name, 0) 
-        return None
-
-    def incr_by(self, key, name, val):
-        """Increment a counter by a set amount"""
-        data = self.hgetall(key)
-
-        if data:
-            data[name] = str(int(data.get(name, 0)) + val)
-
-            with self.pipeline() as pipeline:
-                pipeline.hmset(key, data)
-                pipeline.execute()
-
-    def flushdb(self):
-        """Delete all of the tables..."""
-        cursor = self.connection.cursor()
-        for row in cursor.execute("SELECT name FROM sqlite_master WHERE type='table'"):
-            cursor.execute("DROP TABLE %s" % row[0])
-        self.inited = set()
-
-    def construct(self, table):
-        """Insure that the table is created before we start operating on it"""
-        if table in self.inited:
-            return
-        self.inited.add(table)
-
-        cursor = self.connection.cursor()
-        cursor.execute("CREATE TABLE IF NOT EXISTS %s (id TEXT PRIMARY KEY, blob TEXT)" % table)
+import time
+from modelplus.store import instrument
+from modelplus.store.sql import Dialect, SqlStore
+
+class SqliteDialect(Dialect):
+    name = 'sqlite'
+    param = '?'
+    equals = 'IS'
+    insert_or_replace = 'INSERT OR REPLACE'
+    insert_or_ignore = 'INSERT OR IGNORE'
+    list_tables = "SELECT name FROM sqlite_master WHERE type='table'"
+    key_type = 'TEXT'
+    # TEXT affinity keeps the msgpack blobs as they are
+    binary_type = 'TEXT'
+
+    def extract(self):
+        return "json_extract(%s, ?)" % self.blob
+
+    def upsert_merge(self, table):
+        return ("INSERT INTO %s (id, %s) VALUES (?, ?) "
+                "ON CONFLICT(id) DO UPDATE SET %s = json_patch(%s, excluded.%s)"
+                % (self.quote(table), self.blob, self.blob, self.blob, self.blob))
+
+    def remove(self, table, n):
+        return "UPDATE %s SET %s = json_remove(%s, %s) WHERE id = ?" % (
+            self.quote(table), self.blob, self.blob, self.params(n))
+
+class SqliteStore(SqlStore):
+    # Prepared statements sqlite3 keeps per connection, keyed by their
+    # text, enough for the statements of a few dozen models
+    cached_statements = 512
+
+    def __init__(self, file=None, codec='json'):
+        SqlStore.__init__(self, sqlite3.connect(file, cached_statements=self.cached_statements),
+                          SqliteDialect(), codec)
+
+    def _text_table(self, table):
+        """The FTS5 table of the full-text index of table, None without FTS5"""
+        name = '_search_%s' % table
+        if name not in self.inited:
+            try:
+                # The words split as fulltext.tokenize does
+                self.cursor().execute(
+                    "CREATE VIRTUAL TABLE IF NOT EXISTS %s USING fts5(id UNINDEXED, words, "
+                    "tokenize = 'unicode61 remove_diacritics 0')" % self.dialect.quote(name))
+            except sqlite3.OperationalError:
+                return None
+            self.inited.add(name)
+        return name
+
+    def index_text(self, pipeline, key, tokens):
+        """
+        Replace the words of key in the full-text index with tokens, or
+        drop it from the index if None.
+        """
+        table, id = key.split(':', 1)
+        name = self._text_table(table)
+        if name is None:
+            return None
+        pipeline.stmts.append([self.statement(('unindex_text', table), lambda d: (
+            "DELETE FROM %s WHERE id = ?" % d.quote(name))), [id]])
+        if tokens:
+            pipeline.stmts.append([self.statement(('index_text', table), lambda d: (
+                "INSERT INTO %s (id, words) VALUES (?, ?)" % d.quote(name))), [id, u' '.join(tokens)]])
+        return True
+
+    def search(self, prefix, terms):
+        """The ids of the objects with all of the words terms, the most relevant first"""
+        name = self._text_table(prefix)
+        if name is None:
+            return None
+        # Quoted, the words are never taken for operators
+        query = u' '.join(u'"%s"' % term for term in terms)
+        # Joined to the objects to leave out those which expired
+        return [row[0] for row in self._execute(('search', prefix), lambda d: (
+            "SELECT {s}.id FROM {s} JOIN {o} ON {o}.id = {s}.id WHERE {s} MATCH ? AND {live} "
+            "ORDER BY {s}.rank, {s}.id".format(s=d.quote(name), o=d.quote(prefix), live=self._live(d))),
+            [query, time.time()]).fetchall()]
+
+instrument.register_store(SqliteStore)
 
 def setup(**kwargs):
     return SqliteStore(**kwargs)
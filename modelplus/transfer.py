@@ -0,0 +1,168 @@
+"""
+Bulk export and import of the objects of a model.
+
+``dump`` writes every object of a model to a file, one record per
+object, and ``load`` writes them back, to the same or to another
+datastore::
+
+    with open('books.ndjson', 'w') as f:
+        modelplus.dump(Book, f)
+    with open('books.ndjson') as f:
+        modelplus.load(Book, f)
+
+Both stream ``chunk_size`` objects at a time, so memory stays bounded
+whatever the size of the model: ``dump`` enumerates the ids with the
+store's ``iter_ids`` (SCAN, a cursor) and reads each chunk with a single
+``hgetall_many``, ``load`` writes each chunk with a single pipeline
+(executemany on the SQL stores).
+
+Records hold the id and the stored values in their portable form, the
+strings of ``typecast_for_storage``, uncompressed, so a dump loads into
+any store whatever the codec, compression or native types of either
+side.  The format is ``'ndjson'``, a JSON object per line, or
+``'msgpack'``, a stream of msgpack maps (requires the msgpack package).
+List fields, kept outside of the object hashes, are not carried over.
+"""
+import json
+from modelplus.models import compression, fulltext
+
+__all__ = ['dump', 'load']
+
+FORMATS = ('ndjson', 'msgpack')
+
+
+def _db(model_class):
+    import modelplus
+    return model_class._meta['db'] or modelplus.get_db()
+
+
+def _writer(fileobj, format):
+    if format == 'ndjson':
+        return lambda record: fileobj.write(json.dumps(record) + '\n')
+    if format == 'msgpack':
+        import msgpack
+        packer = msgpack.Packer(use_bin_type=True)
+        return lambda record: fileobj.write(packer.pack(record))
+    raise ValueError("Unknown format %s" % format)
+
+
+def _reader(fileobj, format):
+    if format == 'ndjson':
+        return (json.loads(line) for line in fileobj if line.strip())
+    if format == 'msgpack':
+        import msgpack
+        return msgpack.Unpacker(fileobj, raw=False)
+    raise ValueError("Unknown format %s" % format)
+
+
+def _portable(model_class, stored):
+    """The stored values of an object as the strings of typecast_for_storage"""
+    attributes = model_class._attributes
+    record = {}
+    for k, v in stored.iteritems():
+        if k in attributes:
+            v = model_class._decompress(k, v)
+            v = attributes[k].typecast_for_storage(attributes[k].typecast_for_read(v))
+        elif not isinstance(v, basestring):
+            v = unicode(v)
+        record[k] = v
+    return record
+
+
+def _stored(model_class, record, native, binary):
+    """The values to store for a record, as the model writes them"""
+    attributes = model_class._attributes
+    stored = {}
+    for k, v in record.iteritems():
+        if k in attributes:
+            field = attributes[k]
+            if native:
+                v = field.typecast_for_native(field.typecast_for_read(v))
+            compressor, threshold = model_class._compression_for(k)
+            if compressor and isinstance(v, basestring):
+                v = compression.compress(v, compressor, threshold, binary=binary)
+        stored[k] = v
+    return stored
+
+
+def dump(model_class, fileobj, format='ndjson', chunk_size=1000, progress=None):
+    """
+    Writes all of the objects of model_class to fileobj, returns the
+    number of objects written.
+
+    :param progress: called with (objects written, objects in the
+                     store) after every chunk, None for the objects in
+                     the store if it can't count them without walking
+                     their ids.
+    """
+    db = _db(model_class)
+    write = _writer(fileobj, format)
+    key = model_class._key
+    total = db.count(key) if 'count' in db.capabilities(key) else None
+    done = 0
+    for ids in db.iter_ids(key, chunk_size):
+        for id, stored in zip(ids, db.hgetall_many([key[id] for id in ids])):
+            if stored is None:
+                # deleted since its id was listed
+                continue
+            record = _portable(model_class, stored)
+            record['id'] = id
+            write(record)
+            done += 1
+        if progress is not None:
+            progress(done, total)
+    return done
+
+
+def load(model_class, fileobj, format='ndjson', chunk_size=1000, progress=None):
+    """
+    Writes the objects read from fileobj, replacing the objects with the
+    same ids, returns the number of objects written.  The ids are kept,
+    so the store's sequence of a model with ``'sequence'`` ids doesn't
+    know about them.
+
+    :param progress: called with (objects written, None) after every
+                     chunk.
+    """
+    db = _db(model_class)
+    key = model_class._key
+    db.construct(key, codec=model_class._meta['codec'], indices=model_class._indices)
+    native = db.native_types(key)
+    binary = db.binary_values(key)
+    done = 0
+    chunk = []
+
+    def flush():
+        with db.pipeline() as pipeline:
+            # deletes then writes, so the SQL stores send each as one executemany
+            for id, stored, tokens in chunk:
+                pipeline.delete(key[id])
+            for id, stored, tokens in chunk:
+                if stored:
+                    pipeline.hmset(key[id], stored)
+            for id, stored, tokens in chunk:
+                if tokens is not None:
+                    db.index_text(pipeline, key[id], tokens)
+            pipeline.execute()
+
+    for record in _reader(fileobj, format):
+        id = str(record.pop('id'))
+        tokens = None
+        if model_class._searchable:
+            tokens = []
+            for k in model_class._searchable:
+                tokens.extend(fulltext.tokenize(record.get(k)))
+        chunk.append((id, _stored(model_class, record, native, binary), tokens))
+        if len(chunk) >= chunk_size:
+            flush()
+            done += len(chunk)
+            chunk = []
+            if progress is not None:
+                progress(done, None)
+    if chunk:
+        flush()
+        done += len(chunk)
+        if progress is not None:
+            progress(done, None)
+    model_class._bump_write_version()
+    return done
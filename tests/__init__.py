@@ -5,14 +5,21 @@ import unittest
 REDIS_DB   = int(os.environ.get('REDIS_DB', 10)) # WARNING TESTS FLUSHDB!!!
 REDIS_PORT = int(os.environ.get('REDIS_PORT', 6380))
 REDIS_HOST = os.environ.get('REDIS_HOST', 'localhost')
+# 'sqlite' or 'memory'
+STORE = os.environ.get('MODELPLUS_TEST_STORE', 'sqlite')
 
-if True:
+if STORE == 'sqlite':
     modelplus.setup({
          'sqlite' : {
             'file' : ':memory:'
          }
     })
 
+if STORE == 'memory':
+    modelplus.setup({
+        'memory' : {}
+    })
+
 if False:
     modelplus.setup({
         'redis' : {
@@ -29,6 +36,18 @@ def all_tests():
     suite.addTests(unittest.defaultTestLoader.loadTestsFromName('tests.counter_field'))
     suite.addTests(unittest.defaultTestLoader.loadTestsFromName('tests.boolean_field'))
     suite.addTests(unittest.defaultTestLoader.loadTestsFromName('tests.string_field'))
+    suite.addTests(unittest.defaultTestLoader.loadTestsFromName('tests.codec'))
+    suite.addTests(unittest.defaultTestLoader.loadTestsFromName('tests.arrays'))
+    suite.addTests(unittest.defaultTestLoader.loadTestsFromName('tests.aggregates'))
+    suite.addTests(unittest.defaultTestLoader.loadTestsFromName('tests.instrument'))
+    suite.addTests(unittest.defaultTestLoader.loadTestsFromName('tests.mongodb'))
+    suite.addTests(unittest.defaultTestLoader.loadTestsFromName('tests.sql'))
+    suite.addTests(unittest.defaultTestLoader.loadTestsFromName('tests.memory'))
+    suite.addTests(unittest.defaultTestLoader.loadTestsFromName('tests.log_db'))
+    suite.addTests(unittest.defaultTestLoader.loadTestsFromName('tests.transfer'))
+    suite.addTests(unittest.defaultTestLoader.loadTestsFromName('tests.backfill'))
+    suite.addTests(unittest.defaultTestLoader.loadTestsFromName('tests.search'))
+    suite.addTests(unittest.defaultTestLoader.loadTestsFromName('tests.expiry'))
 
     return suite
 
@@ -0,0 +1,52 @@
+import base
+from datetime import datetime
+from dateutil.tz import tzutc
+from modelplus import models
+
+class Purchase(models.Model):
+    class Meta:
+        indices = ['big']
+
+    status = models.StringField()
+    amount = models.IntegerField()
+    price = models.FloatField()
+    created_at = models.DateTimeField()
+
+    def big(self):
+        return self.amount > 10
+
+class AggregateTestCase(base.BaseTestCase):
+    def setUp(self):
+        super(AggregateTestCase, self).setUp()
+        self.first = datetime(2014, 1, 1, tzinfo=tzutc())
+        self.last = datetime(2014, 6, 1, 12, 0, 0, 500000, tzinfo=tzutc())
+        Purchase.objects.create(status="paid", amount=10, price=1.5, created_at=self.first)
+        Purchase.objects.create(status="paid", amount=20, price=2.5, created_at=self.last)
+        Purchase.objects.create(status="open", amount=5, price=4.0, created_at=self.first)
+        Purchase.objects.create(status="open", amount=7)
+
+    def test_aggregate(self):
+        r = Purchase.objects.all().aggregate(total=models.Sum('amount'), n=models.Count(),
+                                          priced=models.Count('price'), avg=models.Avg('price'),
+                                          low=models.Min('created_at'), high=models.Max('created_at'))
+        self.assertEqual({'total': 42, 'n': 4, 'priced': 3, 'avg': 8.0 / 3,
+                          'low': self.first, 'high': self.last}, r)
+
+    def test_group_by(self):
+        r = Purchase.objects.all().group_by('status').aggregate(total=models.Sum('amount'),
+                                                             top=models.Max('price'))
+        r = sorted(r, key=lambda row: row['status'])
+        self.assertEqual([{'status': u'open', 'total': 12, 'top': 4.0},
+                          {'status': u'paid', 'total': 30, 'top': 2.5}], r)
+
+    def test_filtered(self):
+        total = models.Sum('amount')
+        self.assertEqual({'total': 30}, Purchase.objects.filter(status="paid").aggregate(total=total))
+        self.assertEqual({'total': 12}, Purchase.objects.exclude(status="paid").aggregate(total=total))
+        self.assertEqual({'total': 20}, Purchase.objects.filter(big=True).aggregate(total=total))
+        self.assertEqual({'total': 30}, Purchase.objects.all().order('-amount').limit(2).aggregate(total=total))
+
+    def test_empty(self):
+        r = Purchase.objects.filter(status="lost").aggregate(total=models.Sum('amount'), n=models.Count())
+        self.assertEqual({'total': None, 'n': 0}, r)
+        self.assertEqual([], Purchase.objects.filter(status="lost").group_by('status').aggregate(n=models.Count()))
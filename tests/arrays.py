@@ -0,0 +1,45 @@
+import base
+import unittest
+from datetime import datetime, date
+from dateutil.tz import tzutc
+from modelplus import models
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+class Sale(models.Model):
+    name = models.StringField()
+    price = models.FloatField()
+    quantity = models.IntegerField()
+    paid = models.BooleanField()
+    sold_at = models.DateTimeField()
+    day = models.DateField()
+
+@unittest.skipIf(np is None, "numpy is not installed")
+class ArraysTestCase(base.BaseTestCase):
+    def test_to_arrays(self):
+        sold_at = datetime(2014, 3, 1, 12, 30, 15, 250000, tzinfo=tzutc())
+        Sale.objects.create(name="a", price=1.5, quantity=2, paid=True,
+                            sold_at=sold_at, day=date(2014, 3, 1))
+        Sale.objects.create(name="b", price=2.25, paid=False, sold_at=sold_at)
+
+        arrays = Sale.objects.all().order('price').to_arrays(
+            ['id', 'name', 'price', 'quantity', 'paid', 'sold_at', 'day'])
+
+        self.assertEqual([1.5, 2.25], arrays['price'].tolist())
+        self.assertEqual([u"a", u"b"], arrays['name'].tolist())
+        self.assertEqual(2, arrays['quantity'][0])
+        self.assertEqual([True, False], arrays['paid'].tolist())
+        self.assertEqual(np.datetime64('2014-03-01T12:30:15.250000'), arrays['sold_at'][0])
+        self.assertEqual(np.datetime64('2014-03-01'), arrays['day'][0])
+        self.assertEqual([False, True], list(arrays['day'].mask))
+        self.assertEqual(2, len(arrays['id']))
+
+    def test_filtered(self):
+        Sale.objects.create(name="a", price=1.0)
+        Sale.objects.create(name="b", price=2.0)
+        arrays = Sale.objects.filter(name="b").to_arrays(['price'])
+        self.assertEqual([2.0], arrays['price'].tolist())
+        self.assertRaises(ValueError, Sale.objects.all().to_arrays, ['nope'])
@@ -0,0 +1,158 @@
+import base
+from modelplus import models
+
+class Member(models.Model):
+    class Meta:
+        indices = ['initials']
+
+    first_name = models.StringField()
+    last_name = models.StringField()
+
+    def initials(self):
+        return self.first_name[0] + self.last_name[0]
+
+class Pilot(models.Model):
+    class Meta:
+        versioned = True
+        indices = ['callsign']
+
+    name = models.StringField()
+
+    @property
+    def callsign(self):
+        return self.name.upper()
+
+class BackfillTestCase(base.BaseTestCase):
+    def setUp(self):
+        super(BackfillTestCase, self).setUp()
+        Member._index_states = Pilot._index_states = None
+
+    def forget(self, model_class, index):
+        """Makes the objects look saved before the index was added"""
+        with self.client.pipeline() as pipeline:
+            for id in self.client.get_all(model_class._key):
+                pipeline.hdel(model_class._key[id], index)
+            pipeline.execute()
+
+    def test_scan_ids(self):
+        for i in range(7):
+            Member.objects.create(first_name="Granny", last_name=str(i))
+        seen, cursor = [], None
+        while True:
+            cursor, ids = self.client.scan_ids(Member._key, cursor, 3)
+            seen.extend(ids)
+            if cursor is None:
+                break
+        self.assertEqual(sorted(self.client.get_all(Member._key)), sorted(seen))
+
+    def test_backfill(self):
+        for first, last in [("Granny", "Kent"), ("Clark", "Kent"), ("Granny", "Goose"),
+                            ("Lois", "Lane"), ("Gary", "King")]:
+            Member.objects.create(first_name=first, last_name=last)
+        self.forget(Member, 'initials')
+
+        qs = Member.objects.filter(initials="GK")
+        self.assertEqual('scan', qs.explain()['source'])
+        self.assertEqual(2, len(qs))
+
+        backfill = models.IndexBackfill(Member, batch_size=2)
+        self.assertFalse(backfill.run(batches=1))
+        self.assertEqual('scan', Member.objects.filter(initials="GK").explain()['source'])
+
+        # a new backfill resumes where the first one stopped
+        resumed = models.IndexBackfill(Member, batch_size=2)
+        self.assertEqual(backfill.cursor, resumed.cursor)
+        reports = []
+        self.assertTrue(resumed.run(progress=lambda done, cursor: reports.append(done)))
+        self.assertEqual(5, backfill.processed + resumed.processed)
+        self.assertEqual(resumed.processed, reports[-1])
+
+        qs = Member.objects.filter(initials="GK")
+        self.assertEqual('store', qs.explain()['source'])
+        self.assertEqual(["Gary", "Granny"], sorted(m.first_name for m in qs))
+        self.assertEqual(set(["GK", "CK", "GG", "LL"]),
+                         set(self.client.hgetall(m.key())['initials'] for m in Member.objects.all()))
+        # exclusions are still checked on the objects
+        self.assertEqual('scan', Member.objects.exclude(initials="GK").explain()['source'])
+        self.assertTrue(models.IndexBackfill(Member).done)
+
+    def test_concurrent_save(self):
+        pilot = Pilot.objects.create(name="maverick")
+        self.forget(Pilot, 'callsign')
+        backfill = models.IndexBackfill(Pilot)
+        hgetall_many = self.client.hgetall_many
+        saved = []
+
+        def read_then_save(keys):
+            stored = hgetall_many(keys)
+            if not saved:
+                other = Pilot.objects.get_by_id(pilot.id)
+                other.name = "goose"
+                assert other.save()
+                saved.append(other)
+            return stored
+
+        backfill.db.hgetall_many = read_then_save
+        try:
+            self.assertTrue(backfill.run())
+        finally:
+            del backfill.db.hgetall_many
+        self.assertEqual("GOOSE", self.client.hgetall(pilot.key())['callsign'])
+        self.assertEqual([saved[0]], list(Pilot.objects.filter(callsign="GOOSE")))
+
+    def test_concurrent_save_not_versioned(self):
+        member = Member.objects.create(first_name="Granny", last_name="Goose")
+        self.forget(Member, 'initials')
+        backfill = models.IndexBackfill(Member)
+        hgetall_many = self.client.hgetall_many
+        saved = []
+
+        def read_then_save(keys):
+            stored = hgetall_many(keys)
+            if not saved:
+                other = Member.objects.get_by_id(member.id)
+                other.first_name = "Clark"
+                assert other.save()
+                saved.append(other)
+            return stored
+
+        backfill.db.hgetall_many = read_then_save
+        try:
+            self.assertTrue(backfill.run())
+        finally:
+            del backfill.db.hgetall_many
+        self.assertEqual("CG", self.client.hgetall(member.key())['initials'])
+        self.assertEqual("Clark", Member.objects.get_by_id(member.id).first_name)
+        self.assertEqual([saved[0]], list(Member.objects.filter(initials="CG")))
+
+    def test_always_saved(self):
+        pilot = Pilot.objects.create(name="maverick")
+        self.forget(Pilot, 'callsign')
+        backfill = models.IndexBackfill(Pilot)
+        hgetall_many, hgetall = self.client.hgetall_many, self.client.hgetall
+        saving = []
+
+        def save(stored):
+            if not saving:
+                saving.append(True)
+                other = Pilot.objects.get_by_id(pilot.id)
+                other.name += "!"
+                assert other.save()
+                saving.pop()
+            # as if the save didn't store the index either
+            for hash in stored if isinstance(stored, list) else [stored]:
+                hash.pop('callsign', None)
+            return stored
+
+        # saved again after every read, the retries give up
+        backfill.db.hgetall_many = lambda keys: save(hgetall_many(keys))
+        backfill.db.hgetall = lambda key: save(hgetall(key))
+        try:
+            self.assertRaises(models.ConflictError, backfill.run)
+        finally:
+            del backfill.db.hgetall_many
+            del backfill.db.hgetall
+        self.assertFalse(backfill.done)
+
+    def test_not_computed(self):
+        self.assertRaises(ValueError, models.IndexBackfill, Member, indices=['first_name'])
@@ -0,0 +1,64 @@
+import base
+import unittest
+from datetime import datetime
+from dateutil.tz import tzutc
+from modelplus import models
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+class Reading(models.Model):
+    class Meta:
+        codec = 'msgpack'
+        versioned = True
+
+    name = models.StringField()
+    value = models.FloatField()
+    count = models.IntegerField()
+    valid = models.BooleanField()
+    taken_at = models.DateTimeField()
+    hits = models.Counter()
+
+@unittest.skipIf(msgpack is None, "msgpack is not installed")
+class MsgpackCodecTestCase(base.BaseTestCase):
+    def test_roundtrip(self):
+        taken_at = datetime(2014, 3, 1, 12, 30, 15, 250000, tzinfo=tzutc())
+        r = Reading.objects.create(name=u"Ni\xf1a", value=1.5, count=3, valid=True, taken_at=taken_at)
+
+        r = Reading.objects.get_by_id(r.id)
+        self.assertEqual(u"Ni\xf1a", r.name)
+        self.assertEqual(1.5, r.value)
+        self.assertEqual(3, r.count)
+        self.assertTrue(r.valid)
+        self.assertEqual(taken_at, r.taken_at)
+
+        r.incr('hits', 2)
+        r.count = 4
+        assert r.save()
+        r = Reading.objects.get_by_id(r.id)
+        self.assertEqual(4, r.count)
+        self.assertEqual(2, r.hits)
+        self.assertEqual(1.5, r.value)
+
+    def test_native_storage(self):
+        r = Reading.objects.create(name="a", value=0.25, count=7, valid=False,
+                                   taken_at=datetime.now(tz=tzutc()))
+        if not r.db.native_types(Reading._key):
+            self.skipTest("the store only keeps strings")
+        stored = r.db.hgetall(r.key())
+        self.assertEqual(7, stored['count'])
+        self.assertEqual(0.25, stored['value'])
+        self.assertTrue(isinstance(stored['taken_at'], float))
+
+    def test_order_and_conflict(self):
+        Reading.objects.create(name="b", value=2.0, count=1, valid=True, taken_at=datetime.now(tz=tzutc()))
+        r = Reading.objects.create(name="a", value=1.0, count=2, valid=True, taken_at=datetime.now(tz=tzutc()))
+        self.assertEqual(["a", "b"], [o.name for o in Reading.objects.all().order('value')])
+
+        stale = Reading.objects.get_by_id(r.id)
+        r.count = 3
+        assert r.save()
+        stale.count = 4
+        self.assertRaises(models.ConflictError, stale.save)
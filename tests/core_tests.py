@@ -1,6 +1,7 @@
 # -*- coding: utf-8 -*-
 
 import base
+import time
 from datetime import datetime
 from modelplus import models
 
@@ -15,6 +16,52 @@ class Person(models.Model):
     def full_name(self):
         return "%s %s" % (self.first_name, self.last_name,)
 
+class Account(models.Model):
+    class Meta:
+        versioned = True
+
+    name = models.StringField()
+    balance = models.IntegerField(default=0)
+
+class Task(models.Model):
+    class Meta:
+        query_cache = True
+
+    name = models.StringField()
+
+class Chief(Person):
+    class Meta:
+        key = 'Boss'
+
+    team = models.StringField()
+
+class Draft(models.Model):
+    title = models.StringField()
+    created = models.DateTimeField(auto_now_add=True)
+    modified = models.DateTimeField(auto_now=True)
+
+class Doc(models.Model):
+    title = models.StringField()
+    body = models.StringField(indexed=False)
+
+class Ticket(models.Model):
+    class Meta:
+        id_generator = 'sequence'
+
+    name = models.StringField()
+
+class Event(models.Model):
+    class Meta:
+        id_generator = 'snowflake'
+
+    name = models.StringField()
+
+class Visit(models.Model):
+    class Meta:
+        id_generator = 'uuid7'
+
+    name = models.StringField()
+
 #
 #
 #
@@ -167,3 +214,221 @@ class ModelTestCase(base.BaseTestCase):
 
         for person in Person.objects.all():
             self.assertTrue(person.full_name() in ("Granny Goose", "Clark Kent", "Granny Mommy", "Granny Kent"))
+
+    def test_iterator(self):
+        Person.objects.create(first_name="Granny", last_name="Goose")
+        Person.objects.create(first_name="Clark", last_name="Kent")
+        Person.objects.create(first_name="Granny", last_name="Mommy")
+        Person.objects.create(first_name="Granny", last_name="Kent")
+
+        names = [p.full_name() for p in Person.objects.all().iterator(chunk_size=3)]
+        self.assertEqual(4, len(names))
+        self.assertTrue("Clark Kent" in names)
+
+        persons = Person.objects.filter(first_name="Granny").exclude(last_name="Kent")
+        names = sorted(p.full_name() for p in persons.iterator(chunk_size=1))
+        self.assertEqual(["Granny Goose", "Granny Mommy"], names)
+        self.assertFalse(hasattr(persons, '_cached_set'))
+
+        persons = Person.objects.filter(first_name="Granny").order('created_at')
+        names = [p.full_name() for p in persons.iterator(chunk_size=2)]
+        self.assertEqual(["Granny Goose", "Granny Mommy", "Granny Kent"], names)
+
+    def test_query_cache(self):
+        Task.objects.create(name="Granny Goose")
+        Task.objects.create(name="Clark Kent")
+
+        self.assertEqual(1, len(Task.objects.filter(name="Clark Kent")))
+        self.assertEqual(1, len(Task._query_cache))
+        self.assertEqual(1, len(Task.objects.filter(name="Clark Kent")))
+
+        Task.objects.create(name="Clark Kent")
+        self.assertEqual(0, len(Task._query_cache))
+        self.assertEqual(2, len(Task.objects.filter(name="Clark Kent")))
+
+        for t in Task.objects.filter(name="Clark Kent"):
+            t.delete()
+        self.assertEqual(0, len(Task.objects.filter(name="Clark Kent")))
+
+    def test_query_cache_flushdb(self):
+        Task.objects.create(name="Clark Kent")
+        self.assertEqual(1, len(Task.objects.filter(name="Clark Kent")))
+        self.client.flushdb()
+        self.assertEqual(0, len(Task._query_cache))
+        self.assertEqual(0, len(Task.objects.filter(name="Clark Kent")))
+
+    def test_order(self):
+        p1 = Person.objects.create(first_name="Granny", last_name="Goose")
+        p2 = Person.objects.create(first_name="Clark", last_name="Kent")
+        p3 = Person.objects.create(first_name="Granny", last_name="Mommy")
+        p4 = Person.objects.create(first_name="Granny", last_name="Kent")
+
+        self.assertEqual([p4, p3, p2, p1], list(Person.objects.all().order('-created_at')))
+        self.assertEqual([p4, p3], list(Person.objects.all().order('-created_at').limit(2)))
+        self.assertEqual([p2, p3], list(Person.objects.all().order('created_at').limit(2, 1)))
+        self.assertEqual([p4, p3], list(Person.objects.filter(first_name="Granny")
+                                        .order('-created_at').limit(2)))
+        # by index
+        self.assertEqual([p3, p4], list(Person.objects.all().order('-full_name').limit(2)))
+        self.assertEqual([p2, p1, p4, p3], list(Person.objects.all().order('full_name')))
+        self.assertEqual([p2, p4, p3, p1], list(Person.objects.all()
+                                                .order('first_name').order('-created_at')))
+
+    def test_query_in_store(self):
+        p1 = Person.objects.create(first_name="Granny", last_name="Goose")
+        p2 = Person.objects.create(first_name="Clark", last_name="Kent")
+        p3 = Person.objects.create(first_name="Granny", last_name="Mommy")
+        p4 = Person.objects.create(first_name="Granny", last_name="Kent")
+
+        qs = Person.objects.filter(first_name="Granny").exclude(last_name="Mommy").order('last_name')
+        self.assertEqual([p1, p4], list(qs))
+        self.assertEqual(set([p1.id, p4.id]), set(qs._prefetched))
+        self.assertEqual("Granny Kent", qs[1].full_name())
+        self.assertEqual([p3, p4], list(Person.objects.filter(first_name="Granny")
+                                        .order('-last_name').limit(2)))
+        self.assertEqual([p2], list(Person.objects.exclude(first_name="Granny")))
+
+    def test_not_indexed(self):
+        Doc.objects.create(title="a", body="x")
+        self.assertRaises(models.AttributeNotIndexed, list, Doc.objects.filter(body="x"))
+        self.assertRaises(models.AttributeNotIndexed, list, Doc.objects.filter(title="a").exclude(body="y"))
+        self.assertRaises(models.AttributeNotIndexed, Doc.objects.filter(body="x").aggregate,
+                          n=models.Count())
+        self.assertEqual(1, len(Doc.objects.filter(title="a")))
+
+    def test_snowflake_worker_ids(self):
+        snowflake = models.ids.snowflake
+        worker_id = lambda event: (int(event.id) >> 12) & 0x3ff
+        previous = snowflake.worker_id, snowflake.pid
+        try:
+            snowflake.worker_id = None
+            first = worker_id(Event.objects.create(name="a"))
+            self.assertEqual(first, worker_id(Event.objects.create(name="b")))
+            # taken again in a forked process
+            snowflake.pid = -1
+            self.assertNotEqual(first, worker_id(Event.objects.create(name="c")))
+            models.ids.set_worker_id(7)
+            self.assertEqual(7, worker_id(Event.objects.create(name="d")))
+        finally:
+            snowflake.worker_id, snowflake.pid = previous
+
+    def test_id_generators(self):
+        for model in (Task, Ticket, Event, Visit):
+            objs = [model.objects.create(name=str(i)) for i in range(12)]
+            self.assertEqual(objs, list(model.objects.all()))
+            self.assertEqual(objs[3:5], list(model.objects.all().limit(2, 3)))
+        self.assertEqual([str(i) for i in range(1, 13)], [t.id for t in Ticket.objects.all()])
+        self.assertEqual(26, len(Task.objects.all()[0].id))
+        self.assertEqual('7', Visit.objects.all()[0].id[14])
+
+    def test_from_keys(self):
+        p = Ticket.objects.create(name="Granny")
+        t = Account.objects.create(name="Fly")
+        m = Chief.objects.create(first_name="Clark", last_name="Kent", team="Daily Planet")
+
+        self.assertEqual(Chief, models.base.get_model_from_key(m.key()))
+        self.assertEqual([t, None, p, m],
+                         models.from_keys([t.key(), Account._key['missing'], p.key(), m.key()]))
+        self.assertEqual("Daily Planet", models.from_key(m.key()).team)
+        self.assertRaises(models.BadKeyError, models.from_key, "Unknown:1")
+
+    def test_auto_now(self):
+        d = Draft.objects.create(title="One")
+        created, modified = d.created, d.modified
+        self.assertTrue(created is not None and modified is not None)
+        time.sleep(0.01)
+        d.title = "Two"
+        assert d.save()
+
+        d = Draft.objects.get_by_id(d.id)
+        self.assertEqual("Two", d.title)
+        self.assertEqual(created, d.created)
+        self.assertTrue(d.modified > modified)
+
+    def test_explain(self):
+        for i in range(5):
+            Person.objects.create(first_name="Granny", last_name=str(i))
+
+        indexed = self.client.indexed_fields(Person._key)
+        qs = Person.objects.filter(first_name="Granny").order('-last_name').limit(2)
+        plan = qs.explain()
+        self.assertEqual('store', plan['source'])
+        self.assertEqual(('store', 'store', 'store'), (plan['filter'], plan['order'], plan['limit']))
+        self.assertEqual((5, 2, 0, 1, 0), (plan['rows'], plan['max_results'], plan['loaded'],
+                                           plan['round_trips'], plan['load_round_trips']))
+        # the indexes the datastore has, a scan of every row without one
+        self.assertEqual(sorted(set(['first_name', 'last_name']) & indexed), plan['indexes'])
+        if 'first_name' in indexed:
+            self.assertEqual(0, plan['scanned'])
+        else:
+            self.assertEqual(5, plan['scanned'])
+            self.assertRaises(models.FullScanError, qs.explain, strict=True, threshold=4)
+
+        qs = Person.objects.filter(full_name="Granny 1")
+        plan = qs.explain()
+        self.assertEqual(('scan', 'python', 5), (plan['source'], plan['filter'], plan['loaded']))
+        self.assertRaises(models.FullScanError, qs.explain, strict=True, threshold=4)
+        self.assertEqual(plan, qs.explain(strict=True, threshold=5))
+
+        models.modelset.ModelSet.strict_threshold = 4
+        try:
+            self.assertRaises(models.FullScanError, len, Person.objects.filter(full_name="Granny 1"))
+            if 'last_name' in indexed:
+                self.assertEqual(1, len(Person.objects.filter(last_name="1")))
+            else:
+                self.assertRaises(models.FullScanError, len, Person.objects.filter(last_name="1"))
+        finally:
+            models.modelset.ModelSet.strict_threshold = None
+
+    def test_partial_update(self):
+        obj = Person.objects.create(first_name="Granny", last_name="Goose")
+
+        p1 = Person.objects.get_by_id(obj.id)
+        p2 = Person.objects.get_by_id(obj.id)
+        self.assertEqual(set(), p1._dirty)
+
+        p1.first_name = "Morgan"
+        self.assertEqual(set(['first_name']), p1._dirty)
+        assert p1.save()
+        self.assertEqual(set(), p1._dirty)
+        p2.last_name = "Freeman"
+        assert p2.save()
+
+        p = Person.objects.get_by_id(obj.id)
+        self.assertEqual("Morgan Freeman", p.full_name())
+        self.assertEqual(1, len(Person.objects.filter(full_name="Morgan Freeman")))
+        # the computed index is written from the stored first name
+        self.assertEqual("Morgan Freeman", p.db.hgetall(p.key())['full_name'])
+
+    def test_versioned(self):
+        a = Account.objects.create(name="Granny")
+        a1 = Account.objects.get_by_id(a.id)
+        a2 = Account.objects.get_by_id(a.id)
+
+        a1.balance = 10
+        assert a1.save()
+        a2.balance = 20
+        self.assertRaises(models.ConflictError, a2.save)
+
+        def deposit():
+            o = Account.objects.get_by_id(a.id)
+            o.balance += 5
+            return o.save()
+        assert models.retry_on_conflict(deposit)
+        self.assertEqual(15, Account.objects.get_by_id(a.id).balance)
+
+    def test_mutex(self):
+        p = Person.objects.create(first_name="Granny", last_name="Goose")
+
+        with models.Mutex(p) as m:
+            other = models.Mutex(p, blocking_timeout=0.05)
+            self.assertRaises(models.LockTimeout, other.lock)
+        other.lock()
+        self.assertTrue(other.unlock())
+
+        # an expired lock is free for the taking, but not ours to release
+        stale = models.Mutex('jobs', timeout=0.01)
+        stale.lock()
+        time.sleep(0.02)
+        with models.Mutex('jobs', blocking_timeout=0):
+            self.assertFalse(stale.unlock())
@@ -0,0 +1,106 @@
+import time
+import base
+from modelplus import models
+
+class Session(models.Model):
+    user = models.StringField()
+
+    class Meta:
+        ttl = 0.05
+
+class Wallet(models.Model):
+    name = models.StringField()
+    balance = models.IntegerField(default=0)
+
+    class Meta:
+        versioned = True
+
+class Memo(models.Model):
+    name = models.StringField()
+
+    class Meta:
+        query_cache = True
+
+class Note(models.Model):
+    text = models.StringField(searchable=True)
+    kind = models.StringField()
+
+class ExpiryTestCase(base.BaseTestCase):
+    def test_meta_ttl(self):
+        a = Session.objects.create(user="ann")
+        Session.objects.create(user="bob")
+        note = Note.objects.create(text="kept", kind="a")
+        self.assertEqual(2, len(Session.objects.all()))
+        time.sleep(0.1)
+        self.assertEqual([], list(Session.objects.all()))
+        self.assertEqual([], list(Session.objects.filter(user="ann")))
+        self.assertEqual(None, Session.objects.get_by_id(a.id))
+        self.assertFalse(Session.exists(a.id))
+        self.assertEqual([note], list(Note.objects.all()))
+
+    def test_save_ttl(self):
+        short = Note(text="short", kind="a")
+        assert short.save(ttl=0.05)
+        longer = Note(text="longer", kind="a")
+        assert longer.save(ttl=0.05)
+        assert longer.save(ttl=60)
+        kept = Note.objects.create(text="kept", kind="a")
+        # saved without a ttl, the expiry stays
+        short.kind = "b"
+        assert short.save()
+        time.sleep(0.1)
+        self.assertEqual(sorted([longer.id, kept.id]), sorted(n.id for n in Note.objects.all()))
+        self.assertEqual({'n': 2}, Note.objects.filter(kind="a").aggregate(n=models.Count()))
+
+    def test_sweep(self):
+        for text in ("quick fox", "lazy fox", "fox"):
+            Note(text=text, kind="a").save(ttl=0.05)
+        kept = Note.objects.create(text="the kept fox", kind="a")
+        time.sleep(0.1)
+        Note.sweep_expired()
+        self.assertEqual(0, Note.sweep_expired())
+        self.assertEqual([kept.id], [n.id for n in Note.objects.search("fox")])
+        self.assertEqual([], list(Note.objects.search("quick")))
+
+    def test_save_after_expiry(self):
+        note = Note(text="short", kind="a")
+        assert note.save(ttl=0.05)
+        time.sleep(0.1)
+        note.kind = "b"
+        assert note.save()
+        stored = Note.objects.get_by_id(note.id)
+        self.assertEqual(("short", "b"), (stored.text, stored.kind))
+        self.assertEqual([note.id], [n.id for n in Note.objects.search("short")])
+        # written again without an expiry
+        time.sleep(0.1)
+        self.assertEqual([note.id], [n.id for n in Note.objects.all()])
+
+        deleted = Note.objects.create(text="gone", kind="a")
+        Note.objects.get_by_id(deleted.id).delete()
+        deleted.kind = "b"
+        assert deleted.save()
+        self.assertEqual("gone", Note.objects.get_by_id(deleted.id).text)
+
+    def test_versioned_save_after_expiry(self):
+        wallet = Wallet(name="ann")
+        assert wallet.save(ttl=0.05)
+        time.sleep(0.1)
+        wallet.balance = 10
+        self.assertRaises(models.ConflictError, wallet.save)
+        self.assertEqual(None, Wallet.objects.get_by_id(wallet.id))
+
+    def test_query_cache(self):
+        a = Memo.objects.create(name="a")
+        b = Memo.objects.create(name="b")
+        self.assertEqual([a], list(Memo.objects.filter(name="a")))
+        assert a.save(ttl=0.05)
+        time.sleep(0.1)
+        self.assertEqual([], list(Memo.objects.filter(name="a")))
+        self.assertEqual(1, len(Memo.objects.all()))
+
+        # the objects gone since the ids were read are left out
+        qs = Memo.objects.all()
+        self.assertEqual([b], list(qs))
+        Memo.objects.get_by_id(b.id).delete()
+        self.assertEqual([], list(qs))
+        self.assertEqual([], qs[0:1])
@@ -0,0 +1,70 @@
+import threading
+import warnings
+import base
+import modelplus
+from modelplus import models
+from modelplus.store import instrument
+
+class Writer(models.Model):
+    name = models.StringField()
+
+class Novel(models.Model):
+    title = models.StringField()
+    writer = models.ReferenceField(Writer)
+
+class InstrumentTestCase(base.BaseTestCase):
+    def test_hook(self):
+        operations = []
+        store_class = modelplus.get_db().__class__
+        original = store_class.hgetall
+
+        instrument.add_hook(operations.append)
+        try:
+            self.assertNotEqual(original, store_class.hgetall)
+            w = Writer.objects.create(name="Austen")
+            Writer.objects.get_by_id(w.id)
+        finally:
+            instrument.remove_hook(operations.append)
+        self.assertEqual(original, store_class.hgetall)
+
+        names = [op.name for op in operations]
+        self.assertTrue('execute' in names)
+        op = [op for op in operations if op.name == 'hgetall'][-1]
+        self.assertEqual(w.key(), op.key)
+        self.assertEqual('Writer', op.model)
+        self.assertTrue(op.size > 0)
+        self.assertTrue(op.duration >= 0)
+
+    def test_n_plus_one(self):
+        writers = [Writer.objects.create(name=str(i)) for i in range(5)]
+        for w in writers:
+            Novel.objects.create(title=w.name, writer=w)
+
+        with warnings.catch_warnings(record=True) as caught:
+            warnings.simplefilter('always')
+            with instrument.count_operations(threshold=3) as counter:
+                for novel in Novel.objects.all().iterator():
+                    novel.writer.name
+        self.assertEqual(5, counter.counts[('hgetall', 'Writer')])
+        self.assertEqual([('exists', 'Writer'), ('hgetall', 'Writer')], counter.repeated())
+        self.assertEqual(2, len(caught))
+        self.assertTrue(issubclass(caught[0].category, instrument.NPlusOneWarning))
+
+        with instrument.count_operations(threshold=3) as counter:
+            list(Novel.objects.all().iterator())
+        self.assertEqual([], counter.repeated())
+        self.assertTrue(counter.total > 0)
+
+    def test_other_threads(self):
+        w = Writer.objects.create(name="Austen")
+
+        def other_thread():
+            # an operation of another thread, reported to the same hooks
+            instrument._emit('hgetall', w.key(), 0.0, None)
+
+        with instrument.count_operations() as counter:
+            Writer.objects.get_by_id(w.id)
+            thread = threading.Thread(target=other_thread)
+            thread.start()
+            thread.join()
+        self.assertEqual(1, counter.counts[('hgetall', 'Writer')])
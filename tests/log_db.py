@@ -0,0 +1,111 @@
+import os
+import shutil
+import tempfile
+import unittest
+import modelplus
+from modelplus import models
+from modelplus.store import log_db
+
+class Entry(models.Model):
+    class Meta:
+        versioned = True
+
+    name = models.StringField()
+    size = models.IntegerField()
+    hits = models.Counter()
+
+class LogStoreTestCase(unittest.TestCase):
+    def setUp(self):
+        self.path = tempfile.mkdtemp()
+        self.previous = modelplus.store
+        self.open(segment_size=2048)
+
+    def tearDown(self):
+        self.store.close()
+        modelplus.store = self.previous
+        shutil.rmtree(self.path)
+
+    def open(self, **kwargs):
+        self.store = modelplus.store = log_db.setup(path=self.path, **kwargs)
+
+    def reopen(self, **kwargs):
+        self.store.close()
+        self.open(**kwargs)
+
+    def files(self, suffix):
+        return sorted(name for name in os.listdir(self.path) if name.endswith(suffix))
+
+    def test_roundtrip(self):
+        e = Entry.objects.create(name="a", size=1)
+        e.incr('hits', 2)
+        gone = Entry.objects.create(name="b", size=2)
+        gone.delete()
+        self.reopen()
+        e = Entry.objects.get_by_id(e.id)
+        self.assertEqual(("a", 1, 2), (e.name, e.size, e.hits))
+        self.assertEqual(None, Entry.objects.get_by_id(gone.id))
+        self.assertEqual([e], list(Entry.objects.filter(name="a")))
+
+        stale = Entry.objects.get_by_id(e.id)
+        e.size = 3
+        assert e.save()
+        stale.size = 4
+        self.assertRaises(models.ConflictError, stale.save)
+
+    def test_no_expiry(self):
+        e = Entry(name="a", size=1)
+        self.assertRaises(models.ExpiryNotSupported, e.save, ttl=60)
+        self.assertTrue(e.is_new())
+        assert e.save()
+        self.assertEqual([e], list(Entry.objects.all()))
+
+    def test_compaction(self):
+        # no compaction in the background
+        self.reopen(segment_size=2048, compact_ratio=2)
+        entries = [Entry.objects.create(name="e%d" % i, size=i) for i in range(20)]
+        for n in range(10):
+            for e in entries[:10]:
+                e.size = n
+                e.save()
+        for e in entries[10:15]:
+            e.delete()
+        self.assertTrue(len(self.files('.hint')) > 1)
+        before = sum(os.path.getsize(os.path.join(self.path, name)) for name in self.files('.data'))
+        self.store.compact()
+        data = self.files('.data')
+        self.assertEqual(2, len(data))
+        self.assertTrue(sum(os.path.getsize(os.path.join(self.path, name)) for name in data) < before / 2)
+        self.assertEqual(1, len(self.files('.hint')))
+
+        self.reopen()
+        self.assertEqual(15, len(Entry.objects.all()))
+        self.assertEqual([9] * 10 + range(15, 20), [e.size for e in Entry.objects.all()])
+
+    def test_background_compaction(self):
+        self.reopen(segment_size=1024, compact_ratio=0.5)
+        e = Entry.objects.create(name="a", size=0)
+        for i in range(200):
+            e.size = i
+            e.save()
+        self.assertTrue(self.store.compaction is not None)
+        self.store.compaction.join()
+        self.assertTrue(len(self.files('.data')) < 10)
+        self.reopen()
+        self.assertEqual(199, Entry.objects.get_by_id(e.id).size)
+
+    def test_torn_write(self):
+        e = Entry.objects.create(name="a", size=1)
+        self.store.close()
+        active = os.path.join(self.path, self.files('.data')[-1])
+        size = os.path.getsize(active)
+        with open(active, 'ab') as f:
+            f.write('\x00\x00\x00\x07\x00\x00')
+        self.open()
+        self.assertEqual(size, os.path.getsize(active))
+        self.assertEqual("a", Entry.objects.get_by_id(e.id).name)
+        Entry.objects.create(name="b", size=2)
+        self.reopen()
+        self.assertEqual(2, len(Entry.objects.all()))
+
+    def test_single_process(self):
+        self.assertRaises(IOError, log_db.setup, path=self.path)
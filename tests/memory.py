@@ -0,0 +1,78 @@
+import unittest
+from modelplus import models
+from modelplus.store import memory
+
+store = memory.setup()
+
+class Planet(models.Model):
+    class Meta:
+        db = store
+        versioned = True
+
+    name = models.StringField()
+    kind = models.StringField()
+    moons = models.IntegerField()
+    mass = models.FloatField(indexed=False)
+    visits = models.Counter()
+
+class MemoryStoreTestCase(unittest.TestCase):
+    def setUp(self):
+        store.flushdb()
+        self.planets = [Planet.objects.create(name=name, kind=kind, moons=moons, mass=mass)
+                        for name, kind, moons, mass in [("Mercury", "rocky", 0, 0.06),
+                                                        ("Venus", "rocky", 0, 0.82),
+                                                        ("Earth", "rocky", 1, 1.0),
+                                                        ("Jupiter", "giant", 95, 317.8),
+                                                        ("Saturn", "giant", 146, None)]]
+
+    def tearDown(self):
+        store.flushdb()
+
+    def test_copy_on_read(self):
+        earth = self.planets[2]
+        stored = store.hgetall(earth.key())
+        stored['name'] = "Terra"
+        store.query(Planet._key, {}, {})[0][1]['name'] = "Terra"
+        self.assertEqual("Earth", Planet.objects.get_by_id(earth.id).name)
+        self.assertEqual(1, store.hgetall(earth.key())['moons'])
+
+    def test_indexes(self):
+        mercury, venus, earth, jupiter, saturn = self.planets
+        self.assertEqual(set(['name', 'kind', 'moons', 'visits']), store.indexed_fields(Planet._key))
+        self.assertEqual([jupiter, saturn], list(Planet.objects.filter(kind="giant")))
+        self.assertEqual([saturn, jupiter, earth], list(Planet.objects.all().order('-moons').limit(3)))
+        # equal values in the order of the ids
+        self.assertEqual([mercury, venus], list(Planet.objects.all().order('moons').limit(2)))
+        self.assertEqual([venus], list(Planet.objects.filter(kind="rocky").order('moons').limit(1, 1)))
+        # not indexed, the objects without a value come first
+        self.assertEqual([saturn.id, mercury.id, venus.id],
+                         store.sort(Planet._key, None, 'mass', alpha=False, start=0, num=3))
+        self.assertEqual([jupiter.id, earth.id, venus.id, mercury.id, saturn.id],
+                         store.sort(Planet._key, None, 'mass', desc=True, alpha=False))
+
+        jupiter.kind = "rocky"
+        assert jupiter.save()
+        saturn.delete()
+        self.assertEqual([], list(Planet.objects.filter(kind="giant")))
+        self.assertEqual([jupiter, earth], list(Planet.objects.all().order('-moons').limit(2)))
+        self.assertEqual(4, len(store.indexes[Planet._key]['kind'].sorted))
+
+    def test_aggregate(self):
+        r = Planet.objects.all().group_by('kind').aggregate(n=models.Count(), moons=models.Sum('moons'),
+                                                            mass=models.Max('mass'))
+        self.assertEqual([{'kind': 'giant', 'n': 2, 'moons': 241, 'mass': 317.8},
+                          {'kind': 'rocky', 'n': 3, 'moons': 1, 'mass': 1.0}],
+                         sorted(r, key=lambda g: g['kind']))
+
+    def test_counter_and_conflict(self):
+        earth = self.planets[2]
+        earth.incr('visits', 3)
+        self.assertEqual(3, Planet.objects.get_by_id(earth.id).visits)
+
+        e1 = Planet.objects.get_by_id(earth.id)
+        e2 = Planet.objects.get_by_id(earth.id)
+        e1.moons = 2
+        assert e1.save()
+        e2.moons = 3
+        self.assertRaises(models.ConflictError, e2.save)
+        self.assertEqual(2, Planet.objects.get_by_id(earth.id).moons)
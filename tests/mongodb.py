@@ -0,0 +1,131 @@
+import unittest
+from datetime import datetime
+from dateutil.tz import tzutc
+from modelplus import models
+
+try:
+    import mongomock
+    from modelplus.store import mongodb
+    store = mongodb.setup(client=mongomock.MongoClient())
+except ImportError:
+    store = None
+
+class Song(models.Model):
+    class Meta:
+        db = store
+        versioned = True
+
+    title = models.StringField()
+    genre = models.StringField()
+    length = models.IntegerField()
+    rating = models.FloatField(indexed=False)
+    released = models.DateTimeField()
+    plays = models.Counter()
+
+class Track(models.Model):
+    class Meta:
+        db = store
+        id_generator = 'sequence'
+
+    kind = models.StringField()
+
+@unittest.skipIf(store is None, "mongomock is not installed")
+class MongoStoreTestCase(unittest.TestCase):
+    def setUp(self):
+        store.flushdb()
+        released = datetime(2014, 3, 1, 12, 30, 15, 250000, tzinfo=tzutc())
+        self.songs = [Song.objects.create(title=title, genre=genre, length=length, released=released)
+                      for title, genre, length in [("Help", "pop", 139), ("Yesterday", "pop", 125),
+                                                   ("Money", "rock", 382), ("Time", "rock", 413)]]
+
+    def tearDown(self):
+        store.flushdb()
+
+    def test_roundtrip(self):
+        s = Song.objects.get_by_id(self.songs[2].id)
+        self.assertEqual(("Money", 382), (s.title, s.length))
+        self.assertEqual(self.songs[0].released, s.released)
+        self.assertEqual(382, store.hgetall(s.key())['length'])
+
+        s.incr('plays', 2)
+        s.title = "Money!"
+        s.rating = 4.5
+        assert s.save()
+        s = Song.objects.get_by_id(s.id)
+        self.assertEqual(("Money!", 2, 4.5), (s.title, s.plays, s.rating))
+
+        s.rating = None
+        assert s.save()
+        self.assertFalse('rating' in store.hgetall(s.key()))
+
+        s.delete()
+        self.assertEqual(None, Song.objects.get_by_id(s.id))
+        self.assertEqual(3, len(Song.objects.all()))
+
+    def test_query(self):
+        help, yesterday, money, time = self.songs
+        qs = Song.objects.filter(genre="pop").order('-length')
+        self.assertEqual([help, yesterday], list(qs))
+        self.assertEqual([time, money], list(Song.objects.exclude(genre="pop").order('-length')))
+        self.assertEqual([yesterday, help], list(Song.objects.all().order('length').limit(2)))
+        self.assertEqual([money], list(Song.objects.filter(length=382)))
+
+        plan = qs.explain()
+        self.assertEqual(('store', ['genre', 'length']), (plan['source'], plan['indexes']))
+
+    def test_id_order(self):
+        for i in range(12):
+            Track.objects.create(kind="a")
+        first = ['1', '2', '3', '4', '5']
+        self.assertEqual(first, [t.id for t in Track.objects.filter(kind="a").limit(5)])
+        self.assertEqual(first, [t.id for t in Track.objects.all().order('kind').limit(5)])
+        # the objects written before the length of the ids was stored
+        store.collection('Track').update_many({}, {'$unset': {mongodb.ID_LENGTH_FIELD: ''}})
+        store.inited.discard('Track')
+        self.assertEqual(first, [t.id for t in Track.objects.filter(kind="a").limit(5)])
+        self.assertFalse(mongodb.ID_LENGTH_FIELD in store.hgetall(Track._key['10']))
+
+    def test_aggregate(self):
+        r = Song.objects.all().group_by('genre').aggregate(total=models.Sum('length'), n=models.Count(),
+                                                          rated=models.Count('rating'),
+                                                          rating=models.Avg('rating'))
+        self.assertEqual([{'genre': u'pop', 'total': 264, 'n': 2, 'rated': 0, 'rating': None},
+                          {'genre': u'rock', 'total': 795, 'n': 2, 'rated': 0, 'rating': None}],
+                         sorted(r, key=lambda g: g['genre']))
+
+    def test_versioned(self):
+        s1 = Song.objects.get_by_id(self.songs[0].id)
+        s2 = Song.objects.get_by_id(self.songs[0].id)
+        s1.length = 140
+        assert s1.save()
+        s2.length = 141
+        self.assertRaises(models.ConflictError, s2.save)
+        self.assertEqual(140, Song.objects.get_by_id(s1.id).length)
+
+    def test_mutex(self):
+        with models.Mutex(self.songs[0], db=store):
+            self.assertRaises(models.LockTimeout,
+                              models.Mutex(self.songs[0], db=store, blocking_timeout=0.01).lock)
+        m = models.Mutex(self.songs[0], db=store, blocking_timeout=0.01)
+        m.lock()
+        self.assertTrue(m.unlock())
+
+    def test_expiry(self):
+        help, yesterday, money, time = self.songs
+        assert yesterday.save(ttl=60)
+        with store.pipeline() as pipeline:
+            store.expire(pipeline, help.key(), -1)
+            pipeline.execute()
+        self.assertFalse(mongodb.EXPIRES_FIELD in store.hgetall(yesterday.key()))
+        self.assertTrue(mongodb.EXPIRES_FIELD in store.collection('Song').find_one({'_id': yesterday.id}))
+        # hidden before the TTL monitor deletes it
+        self.assertEqual(None, Song.objects.get_by_id(help.id))
+        self.assertEqual(3, store.count(Song._key))
+        self.assertEqual([yesterday], list(Song.objects.filter(genre="pop")))
+        self.assertEqual({'n': 3}, Song.objects.all().aggregate(n=models.Count()))
+        self.assertEqual(3, len(store.scan_ids(Song._key)[1]))
+        help.length = 150
+        self.assertRaises(models.ConflictError, help.save)
+        self.assertEqual(1, store.sweep(Song._key))
+        self.assertEqual(0, store.sweep(Song._key))
+        self.assertEqual([yesterday, money, time], list(Song.objects.all().order('released')))
@@ -0,0 +1,127 @@
+# -*- coding: utf-8 -*-
+import base
+from modelplus import models
+
+class Article(models.Model):
+    title = models.StringField(searchable=True)
+    body = models.StringField(searchable=True, indexed=False, max_length=10000)
+    section = models.StringField()
+    rank = models.IntegerField()
+
+class Tag(models.Model):
+    name = models.StringField()
+
+class SearchTestCase(base.BaseTestCase):
+    def setUp(self):
+        super(SearchTestCase, self).setUp()
+        self.foxes = Article.objects.create(title="Foxes", body="The fox, the fox and the quick fox.",
+                                            section="nature", rank=2)
+        self.brown = Article.objects.create(title="Quick brown fox", body="It jumps.",
+                                            section="nature", rank=1)
+        self.dog = Article.objects.create(title="Lazy dog", body="Quick, not so quick.",
+                                          section="pets", rank=3)
+        self.cafe = Article.objects.create(title=u"Café", body=u"Crème brûlée", section="food", rank=4)
+
+    def ids(self, qs):
+        return [a.id for a in qs]
+
+    def test_search(self):
+        self.assertEqual([self.foxes.id, self.brown.id], self.ids(Article.objects.search("QUICK fox")))
+        self.assertEqual([self.dog.id], self.ids(Article.objects.search("dog")))
+        self.assertEqual([self.cafe.id], self.ids(Article.objects.search(u"café brûlée")))
+        self.assertEqual([], self.ids(Article.objects.search("cafe")))
+        self.assertEqual([], self.ids(Article.objects.search("fox cat")))
+        self.assertEqual([], self.ids(Article.objects.search("")))
+        self.assertEqual(self.brown, Article.objects.search("fox").get_by_id(self.brown.id))
+        self.assertEqual(None, Article.objects.search("fox").get_by_id(self.dog.id))
+
+    def test_updates(self):
+        self.brown.title = "Slow red panda"
+        assert self.brown.save()
+        self.assertEqual([self.foxes.id], self.ids(Article.objects.search("fox")))
+        self.assertEqual([self.brown.id], self.ids(Article.objects.search("panda")))
+        # only the searchable fields are indexed again
+        self.brown.section = "animals"
+        assert self.brown.save()
+        self.assertEqual([self.brown.id], self.ids(Article.objects.search("panda")))
+        self.foxes.delete()
+        self.assertEqual([], self.ids(Article.objects.search("fox")))
+
+    def test_stale_update(self):
+        stale = Article.objects.get_by_id(self.dog.id)
+        self.dog.title = "Sleepy cat"
+        assert self.dog.save()
+        stale.body = "Slow."
+        assert stale.save()
+        self.assertEqual([self.dog.id], self.ids(Article.objects.search("cat")))
+        self.assertEqual([self.dog.id], self.ids(Article.objects.search("slow")))
+        self.assertEqual([], self.ids(Article.objects.search("lazy")))
+
+    def test_save_while_deleting(self):
+        index_text = self.client.index_text
+        def save_meanwhile(pipeline, key, tokens):
+            # another client saves the object before the delete is executed
+            del self.client.index_text
+            indexed = index_text(pipeline, key, tokens)
+            other = Article.objects.get_by_id(self.foxes.id)
+            other.title = "Red panda"
+            assert other.save()
+            return indexed
+        self.client.index_text = save_meanwhile
+        self.foxes.delete()
+        self.assertEqual(None, Article.objects.get_by_id(self.foxes.id))
+        self.assertEqual([], self.ids(Article.objects.search("panda")))
+        # nothing is left of its words for the id to be found by
+        with self.client.pipeline() as pipeline:
+            pipeline.hmset(self.foxes.key(), {'title': "Foxes", 'section': "nature", 'rank': '2'})
+            pipeline.execute()
+        self.assertEqual([], self.ids(Article.objects.search("panda")))
+        self.assertEqual([self.brown.id], self.ids(Article.objects.search("fox")))
+
+    def test_filters_and_ordering(self):
+        qs = Article.objects.search("quick")
+        self.assertEqual(3, len(qs))
+        self.assertEqual([self.brown.id], self.ids(qs.filter(section="nature").exclude(rank=2)))
+        self.assertEqual([self.dog.id, self.foxes.id, self.brown.id], self.ids(qs.order('-rank')))
+        self.assertEqual(1, len(qs.limit(1, 1)))
+        self.assertEqual({'n': 2}, qs.filter(section="nature").aggregate(n=models.Count()))
+        self.assertEqual(sorted(self.ids(qs)), sorted(a.id for a in qs.iterator(chunk_size=1)))
+
+        plan = qs.filter(section="nature").explain()
+        self.assertEqual(('search', 'python'), (plan['source'], plan['filter']))
+        self.assertEqual('search', qs.explain()['source'])
+
+    def test_python_fallback(self):
+        self.client.search = lambda prefix, terms: None
+        try:
+            self.assertEqual([self.foxes.id, self.brown.id], self.ids(Article.objects.search("quick fox")))
+            # quick twice in the dog
+            self.assertEqual(self.dog.id, Article.objects.search("quick").first().id)
+            self.assertEqual([self.cafe.id], self.ids(Article.objects.search(u"crème")))
+        finally:
+            del self.client.search
+
+    def test_backfill(self):
+        # as if the objects were saved before their fields were searchable
+        with self.client.pipeline() as pipeline:
+            for a in (self.foxes, self.brown, self.dog, self.cafe):
+                self.client.index_text(pipeline, a.key(), None)
+            pipeline.hdel(models.base.INDEX_STATES[Article._key], Article._text_index())
+            pipeline.execute()
+        Article._index_states = None
+
+        self.assertEqual([self.foxes.id, self.brown.id], self.ids(Article.objects.search("quick fox")))
+        self.assertEqual(4, Article.objects.search("fox").explain()['loaded'])
+        self.assertTrue(models.IndexBackfill(Article, batch_size=3).run())
+        self.assertEqual(0, Article.objects.search("fox").explain()['loaded'])
+        searched = []
+        search = self.client.search
+        self.client.search = lambda prefix, terms: searched.append(terms) or search(prefix, terms)
+        try:
+            self.assertEqual([self.foxes.id, self.brown.id], self.ids(Article.objects.search("quick fox")))
+        finally:
+            del self.client.search
+        self.assertEqual(1, len(searched))
+
+    def test_not_searchable(self):
+        self.assertRaises(models.AttributeNotIndexed, Tag.objects.search, "foo")
@@ -0,0 +1,89 @@
+import time
+import unittest
+from modelplus import models
+from modelplus.store import sqlite_db
+
+store = sqlite_db.setup(file=':memory:')
+
+class Select(models.Model):
+    """Named after an SQL keyword"""
+    class Meta:
+        db = store
+        versioned = True
+
+    name = models.StringField()
+    size = models.IntegerField()
+
+class SqlStoreTestCase(unittest.TestCase):
+    def setUp(self):
+        store.flushdb()
+        self.objects = [Select.objects.create(name=name, size=size)
+                        for name, size in [("a", 3), ("b", 1), ("c", 2), ("d", 1)]]
+
+    def tearDown(self):
+        store.flushdb()
+
+    def test_keyword_table(self):
+        a, b, c, d = self.objects
+        self.assertEqual([b, d, c, a], list(Select.objects.all().order('size')))
+        self.assertEqual([b, d], list(Select.objects.filter(size=1)))
+        a.size = 4
+        assert a.save()
+        self.assertEqual(4, Select.objects.get_by_id(a.id).size)
+        d.delete()
+        self.assertEqual(3, store.count(Select._key))
+
+    def test_statements_reused(self):
+        a, b, c, d = self.objects
+        list(Select.objects.filter(name="a").order('-size').limit(2))
+        list(Select.objects.filter(name="a"))
+        models.from_keys([a.key(), b.key(), c.key()])
+        statements = dict(store.statements)
+        list(Select.objects.filter(name="b").order('-size').limit(1, 1))
+        for name in "bcd":
+            list(Select.objects.filter(name=name))
+        # Three and four ids are both looked up with an "IN" of four
+        self.assertEqual([a, b, c, d], models.from_keys([o.key() for o in self.objects]))
+        self.assertEqual(statements, store.statements)
+        for key, text in statements.iteritems():
+            self.assertTrue(store.statements[key] is text)
+
+    def test_iter_ids_while_writing(self):
+        seen = []
+        for ids in store.iter_ids(Select._key, chunk_size=3):
+            seen.extend(ids)
+            Select.objects.get_by_id(ids[0])
+        self.assertEqual(sorted(o.id for o in self.objects), sorted(seen))
+
+    def test_conflict(self):
+        s1 = Select.objects.get_by_id(self.objects[0].id)
+        s2 = Select.objects.get_by_id(self.objects[0].id)
+        s1.size = 5
+        assert s1.save()
+        s2.size = 6
+        self.assertRaises(models.ConflictError, s2.save)
+        self.assertEqual(5, Select.objects.get_by_id(s1.id).size)
+
+    def test_sweep(self):
+        a, b, c, d = self.objects
+        for o in (a, b, c):
+            o.size += 10
+            assert o.save(ttl=0.01)
+        time.sleep(0.05)
+        self.assertEqual([d], list(Select.objects.all()))
+        self.assertEqual(2, store.sweep(Select._key, 2))
+        self.assertEqual(1, store.sweep(Select._key, 2))
+        self.assertEqual(0, store.sweep(Select._key, 2))
+        self.assertEqual([(d.id,)], store.cursor().execute('SELECT id FROM "Select"').fetchall())
+
+    def test_table_without_expiry(self):
+        old = sqlite_db.setup(file=':memory:')
+        old.cursor().execute('CREATE TABLE "Select" (id TEXT PRIMARY KEY, "blob" TEXT)')
+        old.cursor().execute('INSERT INTO "Select" VALUES (?, ?)', ['1', '{"name": "a"}'])
+        old.construct('Select')
+        self.assertEqual({'name': 'a'}, old.hgetall('Select:1'))
+        with old.pipeline() as pipeline:
+            old.expire(pipeline, 'Select:1', -1)
+            pipeline.execute()
+        self.assertEqual(None, old.hgetall('Select:1'))
+        self.assertEqual(1, old.sweep('Select'))
@@ -4,6 +4,17 @@ from modelplus import models
 class Person(models.Model):
     name = models.StringField(max_length=20, required=True)
 
+class Article(models.Model):
+    title = models.StringField()
+    body = models.StringField(max_length=100000, indexed=False, compress=True, compress_threshold=100)
+
+class Note(models.Model):
+    class Meta:
+        compress = 'zlib'
+        compress_threshold = 100
+
+    text = models.StringField(max_length=100000)
+
 class StringFieldTestCase(base.BaseTestCase):
     def test_max_length(self):
 
@@ -11,3 +22,32 @@ class StringFieldTestCase(base.BaseTestCase):
 
         self.assertFalse(p.is_valid())
         self.assert_(('name', 'exceeds max length') in p.errors)
+
+    def test_compress(self):
+        body = u"Ni\xf1a " * 1000
+        a = Article.objects.create(title="Long", body=body)
+        stored = a.db.hgetall(a.key())
+        self.assertTrue(stored['body'].startswith('\x00'))
+        self.assertTrue(len(stored['body']) < len(body) / 5)
+        self.assertEqual("Long", stored['title'])
+
+        a = Article.objects.get_by_id(a.id)
+        self.assertEqual(body, a.body)
+
+        a = Article.objects.create(title="Short", body="Lorem ipsum")
+        self.assertEqual("Lorem ipsum", a.db.hgetall(a.key())['body'])
+        self.assertEqual("Lorem ipsum", Article.objects.get_by_id(a.id).body)
+
+    def test_marker(self):
+        # values that look compressed are read back as they were saved
+        p = Person.objects.create(name=u"\x00Zhello")
+        self.assertEqual(u"\x00Zhello", Person.objects.get_by_id(p.id).name)
+        for body in (u"\x00zhello", u"\x00=hello", u"\x00" + u"z" * 200):
+            a = Article.objects.create(title="Marker", body=body)
+            self.assertEqual(body, Article.objects.get_by_id(a.id).body)
+
+    def test_compress_model(self):
+        text = "Lorem ipsum dolor sit amet " * 100
+        n = Note.objects.create(text=text)
+        self.assertTrue(n.db.hgetall(n.key())['text'].startswith('\x00'))
+        self.assertEqual(text, Note.objects.get_by_id(n.id).text)
@@ -0,0 +1,105 @@
+import json
+import unittest
+from datetime import datetime
+from StringIO import StringIO
+from dateutil.tz import tzutc
+import modelplus
+from modelplus import models
+from modelplus.store import memory, sqlite_db
+
+class Book(models.Model):
+    class Meta:
+        versioned = True
+
+    title = models.StringField()
+    pages = models.IntegerField()
+    price = models.FloatField(indexed=False)
+    available = models.BooleanField()
+    published = models.DateTimeField()
+    text = models.StringField(max_length=10000, indexed=False, compress=True, compress_threshold=100)
+    reads = models.Counter()
+
+class TransferTestCase(unittest.TestCase):
+    def setUp(self):
+        self.previous = modelplus.store
+        modelplus.store = sqlite_db.setup(file=':memory:')
+        self.books = []
+        for i in range(25):
+            book = Book.objects.create(title=u"Book \xe9 %d" % i, pages=100 + i, price=i / 4.0,
+                                       available=bool(i % 2), text="lorem ipsum " * i * 2,
+                                       published=datetime(2000 + i, 1, 2, 3, 4, 5, tzinfo=tzutc()))
+            book.incr('reads', i)
+            self.books.append(book)
+
+    def tearDown(self):
+        modelplus.store = self.previous
+
+    def values(self):
+        return sorted((b.id, b.title, b.pages, b.price, b.available, b.published, b.text, b.reads)
+                      for b in Book.objects.all())
+
+    def transfer(self, format):
+        expected = self.values()
+        f = StringIO()
+        self.assertEqual(25, modelplus.dump(Book, f, format=format, chunk_size=10))
+        modelplus.store = memory.setup()
+        f.seek(0)
+        self.assertEqual(25, modelplus.load(Book, f, format=format, chunk_size=10))
+        self.assertEqual(expected, self.values())
+        # the loaded objects are plain objects of the new store
+        book = Book.objects.filter(pages=103).first()
+        book.title = "Changed"
+        assert book.save()
+        book.incr('reads')
+        self.assertEqual(4, Book.objects.get_by_id(book.id).reads)
+
+    def test_ndjson(self):
+        self.transfer('ndjson')
+
+    def test_msgpack(self):
+        self.transfer('msgpack')
+
+    def test_portable_records(self):
+        f = StringIO()
+        modelplus.dump(Book, f)
+        records = [json.loads(line) for line in f.getvalue().splitlines()]
+        self.assertEqual(25, len(records))
+        record = [r for r in records if r['id'] == self.books[3].id][0]
+        self.assertEqual(u"103", record['pages'])
+        self.assertEqual(u"lorem ipsum " * 6, record['text'])
+        self.assertEqual(u"1", record['available'])
+
+    def test_progress(self):
+        reports = []
+        modelplus.dump(Book, StringIO(), chunk_size=10, progress=lambda done, total: reports.append((done, total)))
+        self.assertEqual((25, 25), reports[-1])
+        self.assertTrue(len(reports) >= 3)
+
+        f = StringIO()
+        modelplus.dump(Book, f)
+        f.seek(0)
+        reports = []
+        modelplus.load(Book, f, chunk_size=10, progress=lambda done, total: reports.append(done))
+        self.assertEqual([10, 20, 25], reports)
+
+        # no total from a store which would walk every id to count them
+        db = modelplus.store
+        db.capabilities = lambda table: set()
+        try:
+            reports = []
+            modelplus.dump(Book, StringIO(), progress=lambda done, total: reports.append((done, total)))
+            self.assertEqual([(25, None)], reports)
+        finally:
+            del db.capabilities
+
+    def test_replace(self):
+        f = StringIO()
+        modelplus.dump(Book, f)
+        book = self.books[0]
+        book.title = "Changed"
+        book.save()
+        Book.objects.create(title="New", pages=1)
+        f.seek(0)
+        modelplus.load(Book, f)
+        self.assertEqual(26, len(Book.objects.all()))
+        self.assertEqual(u"Book \xe9 0", Book.objects.get_by_id(book.id).title)